@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive per-chat spam limits from the chat's own baseline.
+
+Every counted message gives a sample: how many messages its author has sent
+inside the window, including this one. Per chat the samples feed an
+exponentially weighted mean and variance (alpha per sample), so memory is
+O(1) per chat whatever the traffic. The limit is
+
+    clamp(ceil(mean + k * std), floor, ceiling)
+
+i.e. "well above what users of this chat usually do". Samples over the
+current limit (the messages that get a user muted) are not fed, so a flood
+cannot drag the baseline up. Until `min_samples` samples have been seen the
+static limit applies.
+
+A time-decayed message rate per chat (messages per minute, half-life
+`rate_halflife`) is kept alongside for admins; it does not affect the limit.
+"""
+import math
+import threading
+from collections import OrderedDict
+
+
+class _Baseline:
+    __slots__ = ("mean", "var", "samples", "rate", "last_ts")
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.samples = 0
+        self.rate = 0.0       # messages per second, decayed
+        self.last_ts = None
+
+
+class AdaptiveLimits:
+    def __init__(self, alpha: float = 0.01, k: float = 3.0, min_samples: int = 200,
+                 rate_halflife: float = 600, max_chats: int = 10000):
+        self.alpha = alpha
+        self.k = k
+        self.min_samples = min_samples
+        self.tau = rate_halflife / math.log(2)
+        self.max_chats = max_chats
+        # chat_id -> _Baseline, least recently active first
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _limit(self, b: _Baseline, rules) -> int:
+        if b is None or b.samples < self.min_samples:
+            return rules.spam_limit
+        limit = math.ceil(b.mean + self.k * math.sqrt(b.var))
+        return min(max(limit, rules.adaptive_floor), rules.adaptive_ceiling)
+
+    def observe(self, chat_id: int, count: int, ts: float, rules) -> int:
+        """Feed one message (its author's count in the window); returns the limit to apply."""
+        with self._lock:
+            b = self._chats.get(chat_id)
+            if b is None:
+                if len(self._chats) >= self.max_chats:
+                    self._chats.popitem(last=False)
+                b = self._chats[chat_id] = _Baseline()
+            else:
+                self._chats.move_to_end(chat_id)
+            limit = self._limit(b, rules)
+            # incremental EWMA of mean and variance
+            if count <= limit:
+                if b.samples == 0:
+                    b.mean = float(count)
+                else:
+                    diff = count - b.mean
+                    incr = self.alpha * diff
+                    b.mean += incr
+                    b.var = (1 - self.alpha) * (b.var + diff * incr)
+                b.samples += 1
+            # decayed rate: every message adds 1/tau, the total decays with exp(-dt/tau)
+            if b.last_ts is not None and ts > b.last_ts:
+                b.rate *= math.exp(-(ts - b.last_ts) / self.tau)
+            b.rate += 1 / self.tau
+            b.last_ts = ts
+        return limit
+
+    def limit(self, chat_id: int, rules) -> int:
+        """Current limit without feeding a sample."""
+        return self._limit(self._chats.get(chat_id), rules)
+
+    def snapshot(self, chat_id: int, rules, now: float) -> dict:
+        with self._lock:
+            b = self._chats.get(chat_id)
+            if b is None:
+                return {"limit": rules.spam_limit, "samples": 0, "mean": 0.0, "std": 0.0, "per_minute": 0.0}
+            rate = b.rate * math.exp(-max(0.0, now - b.last_ts) / self.tau)
+            return {"limit": self._limit(b, rules), "samples": b.samples, "mean": b.mean,
+                    "std": math.sqrt(b.var), "per_minute": rate * 60}
+
+    def __len__(self):
+        return len(self._chats)
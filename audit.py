@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only audit log of moderation actions in SQLite (WAL mode).
+
+record() only enqueues a tuple; a writer thread inserts queued records in
+one transaction per batch, so handlers never wait for the disk. Every
+`prune_interval` seconds the writer drops records older than
+`retention_days` and keeps at most `max_rows`, deleting in small chunks from
+the oldest rowid (rowids grow with time, so no index on ts is needed). The
+database uses auto_vacuum=INCREMENTAL: after a prune the freed pages are
+returned to the file system and the WAL is truncated, so the files shrink
+back instead of staying at their peak size.
+
+Reads use the (chat_id, user_id, ts) and (chat_id, ts) indexes: the last N
+actions of a user or a chat are an index range scan, independent of the
+table size.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+from persistence import connect
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS actions (
+    id       INTEGER PRIMARY KEY,
+    ts       REAL    NOT NULL,
+    chat_id  INTEGER NOT NULL,
+    user_id  INTEGER NOT NULL,  -- 0: the whole chat (/purge last N)
+    actor_id INTEGER,           -- NULL: the bot itself
+    action   TEXT    NOT NULL,  -- auto_mute, mute, unmute, ban, unban, delete, purge, lockdown
+    until    REAL,
+    reason   TEXT
+);
+CREATE INDEX IF NOT EXISTS actions_chat_user ON actions (chat_id, user_id, ts);
+CREATE INDEX IF NOT EXISTS actions_chat ON actions (chat_id, ts);
+"""
+
+COLUMNS = "ts, chat_id, user_id, actor_id, action, until, reason"
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class AuditRecord(NamedTuple):
+    ts: float
+    chat_id: int
+    user_id: int
+    actor_id: int
+    action: str
+    until: float
+    reason: str
+
+
+class AuditLog:
+    def __init__(self, path: str, batch_size: int = 500, flush_interval: float = 0.5,
+                 retention_days: float = 90, max_rows: int = 5_000_000, prune_interval: float = 600,
+                 prune_chunk: int = 10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention_days * 86400
+        self.max_rows = max_rows
+        self.prune_interval = prune_interval
+        self.prune_chunk = prune_chunk
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        conn = connect(path)
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                # takes effect on an existing database only after a full VACUUM (once)
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    # --- hot path: only enqueue ---
+    def record(self, chat_id: int, user_id: int, action: str, actor_id: int = None,
+               reason: str = None, until: float = None):
+        self._queue.put((time.time(), chat_id, user_id, actor_id, action, until, reason))
+
+    # --- queries ---
+    def query(self, chat_id: int, user_id: int = None, limit: int = 20) -> list:
+        """Last `limit` actions in a chat (of one user if given), newest first."""
+        conn = connect(self.path)
+        try:
+            if user_id is None:
+                rows = conn.execute(f"SELECT {COLUMNS} FROM actions WHERE chat_id = ? "
+                                    "ORDER BY ts DESC LIMIT ?", (chat_id, limit)).fetchall()
+            else:
+                rows = conn.execute(f"SELECT {COLUMNS} FROM actions WHERE chat_id = ? AND user_id = ? "
+                                    "ORDER BY ts DESC LIMIT ?", (chat_id, user_id, limit)).fetchall()
+        finally:
+            conn.close()
+        return [AuditRecord(*row) for row in rows]
+
+    # --- writer ---
+    def start(self):
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def _drain(self, first) -> list:
+        batch = [first]
+        try:
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def prune(self, conn: sqlite3.Connection, now: float = None) -> int:
+        """Delete expired records and records over max_rows; returns how many were deleted."""
+        now = time.time() if now is None else now
+        oldest, newest = conn.execute("SELECT MIN(id), MAX(id) FROM actions").fetchone()
+        if oldest is None:
+            return 0
+        # first record inside the retention period; scans from the oldest and stops there
+        row = conn.execute("SELECT id FROM actions WHERE ts >= ? ORDER BY id LIMIT 1",
+                           (now - self.retention,)).fetchone()
+        cutoff = max(row[0] if row else newest + 1, newest - self.max_rows + 1)
+        deleted = 0
+        while oldest < cutoff:
+            upto = min(cutoff, oldest + self.prune_chunk)
+            with conn:
+                deleted += conn.execute("DELETE FROM actions WHERE id < ?", (upto,)).rowcount
+            oldest = upto
+        if deleted:
+            # one execute() step frees a single page; executescript runs the pragma to the end
+            conn.executescript("PRAGMA incremental_vacuum;")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            logger.info("Audit log: pruned %d records", deleted)
+        return deleted
+
+    def _writer(self):
+        conn = connect(self.path)
+        last_prune = 0.0
+        while True:
+            try:
+                batch = self._drain(self._queue.get(timeout=self.prune_interval))
+            except queue.Empty:
+                batch = []
+            if batch:
+                try:
+                    with conn:
+                        conn.executemany(f"INSERT INTO actions ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                except sqlite3.Error:
+                    logger.exception("Failed to write %d audit records", len(batch))
+            if time.monotonic() - last_prune >= self.prune_interval:
+                last_prune = time.monotonic()
+                try:
+                    self.prune(conn)
+                except sqlite3.Error:
+                    logger.exception("Failed to prune the audit log")
+            if len(batch) < self.batch_size:
+                # queue drained: wait a bit so the next batch collects more records
+                time.sleep(self.flush_interval)
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Offline flood benchmark for the moderator bots.
+
+Starts fake_bot_api.FakeBotApi, points telebot at it, imports one of the bot
+modules and feeds it synthetic traffic: K chats x M users, a share of which
+are spammers sending bursts over the limit. Updates go in directly
+(bot.process_new_updates), through long polling or through the webhook
+server. Reports throughput and, per spam incident, time-to-mute,
+time-to-purge and Bot API calls.
+
+    python3 bench_flood.py --bot spam_moderator_bot --chats 50 --users 40 --spammers 0.1
+    python3 bench_flood.py --bot telegram_spam_moderator_delete --mode webhook --latency 0.05 --rate-429 0.02
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_bot_api import FakeBotApi
+
+BOTS = ("spam_moderator_bot", "telegram_spam_moderator_delete")
+TOKEN = "123456:bench"
+
+
+def percentile(values, p: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def generate(chats: int, users: int, spammer_ratio: float, burst: int, normal: int, seed: int):
+    """Returns (updates, owner, spammers).
+
+    owner maps (chat_id, message_id) -> user_id; spammers is the set of
+    (chat_id, user_id) pairs that send a burst. Messages of different users
+    are interleaved randomly, each user's own messages stay in order.
+    """
+    rnd = random.Random(seed)
+    spammers = set()
+    slots = []
+    for c in range(chats):
+        chat_id = -1000000000000 - c
+        for u in range(users):
+            user_id = 10 ** 6 + c * users + u
+            spam = rnd.random() < spammer_ratio
+            if spam:
+                spammers.add((chat_id, user_id))
+            slots.extend([(chat_id, user_id, spam)] * (burst if spam else normal))
+    rnd.shuffle(slots)
+    updates, owner = [], {}
+    now = int(time.time())
+    for i, (chat_id, user_id, spam) in enumerate(slots, 1):
+        text = "CHEAP FOLLOWERS t.me/example" if spam else f"hello #{rnd.randrange(10 ** 6)}"
+        updates.append({
+            "update_id": i,
+            "message": {
+                "message_id": i, "date": now,
+                "chat": {"id": chat_id, "type": "supergroup", "title": f"chat {chat_id}"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "text": text,
+            },
+        })
+        owner[(chat_id, i)] = user_id
+    return updates, owner, spammers
+
+
+def load_bot(name: str, api: FakeBotApi, workdir: str):
+    """Import a bot module against the fake API and start its background parts."""
+    from telebot import apihelper
+    apihelper.API_URL = api.api_url
+    os.environ["BOT_TOKEN"] = TOKEN
+    os.environ["MUTES_DB"] = os.path.join(workdir, "mutes.sqlite3")
+    os.environ["AUDIT_DB"] = os.path.join(workdir, "audit.sqlite3")
+    mod = importlib.import_module(name)
+    if name == "telegram_spam_moderator_delete":
+        mod.rights.me()
+        mod.mute_store.start()
+        mod.audit.start()
+        mod.outbound.start()
+        mod.digest.start()
+        mod.dispatcher.start()
+        mod.shedder.start()
+        mod.schedule_unmute_worker()
+        mod.schedule_delete_worker()
+    return mod
+
+
+def feed(mod, api: FakeBotApi, updates, mode: str, rate: float, fed_at: dict):
+    """Send updates to the bot, recording the monotonic time each one went in."""
+    from telebot import types
+    batch = 100
+    interval = batch / rate if rate else 0.0
+    if mode == "polling":
+        threading.Thread(target=mod.bot.infinity_polling, daemon=True,
+                         kwargs={"timeout": 5, "long_polling_timeout": 1}).start()
+    elif mode == "webhook":
+        from webhook import WebhookServer, post_updates
+        server = WebhookServer(mod.bot, "127.0.0.1", 0, secret_token="bench")
+        server.start()
+        url = "http://%s:%s/webhook" % server.address[:2]
+        pool = ThreadPoolExecutor(max_workers=16)
+    next_at = time.monotonic()
+    for i in range(0, len(updates), batch):
+        chunk = updates[i:i + batch]
+        now = time.monotonic()
+        for u in chunk:
+            fed_at[u["update_id"]] = now
+        if mode == "direct":
+            mod.bot.process_new_updates([types.Update.de_json(u) for u in chunk])
+        elif mode == "polling":
+            api.push_updates(chunk)
+        else:
+            # one poster per chat slot: like Telegram, a chat's updates arrive one after another
+            parts = [[] for _ in range(16)]
+            for u in chunk:
+                parts[u["message"]["chat"]["id"] % 16].append(json.dumps(u))
+            list(pool.map(lambda part: post_updates(part, url, "bench"), parts))
+        if interval:
+            next_at += interval
+            time.sleep(max(0.0, next_at - time.monotonic()))
+
+
+def analyze(api: FakeBotApi, updates, owner, spammers, fed_at, limit: int):
+    # the message that crosses the limit is the (limit + 1)-th of the spammer
+    seen, crossed = {}, {}
+    for u in updates:
+        m = u["message"]
+        k = (m["chat"]["id"], m["from"]["id"])
+        if k in spammers:
+            seen[k] = seen.get(k, 0) + 1
+            if seen[k] == limit + 1:
+                crossed[k] = fed_at[u["update_id"]]
+
+    muted_at, purged_at, purged = {}, {}, {}
+    for t, method, params in list(api.calls):
+        if method == "restrictChatMember":
+            k = (int(params["chat_id"]), int(params["user_id"]))
+            muted_at.setdefault(k, t)
+        elif method in ("deleteMessage", "deleteMessages"):
+            chat_id = int(params["chat_id"])
+            if method == "deleteMessage":
+                ids = [int(params["message_id"])]
+            else:
+                ids = json.loads(params["message_ids"])
+            for mid in ids:
+                k = (chat_id, owner.get((chat_id, mid)))
+                if k in spammers:
+                    purged_at[k] = t
+                    purged[k] = purged.get(k, 0) + 1
+
+    ttm = [muted_at[k] - crossed[k] for k in crossed if k in muted_at]
+    ttp = [purged_at[k] - crossed[k] for k in crossed if k in purged_at]
+    false_mutes = sum(1 for k in muted_at if k not in spammers)
+    return {
+        "incidents": len(crossed),
+        "muted": len(ttm),
+        "purged": len(ttp),
+        "purged_messages": sum(purged.values()),
+        "false_mutes": false_mutes,
+        "time_to_mute_p50": percentile(ttm, 50),
+        "time_to_mute_p99": percentile(ttm, 99),
+        "time_to_purge_p50": percentile(ttp, 50),
+        "time_to_purge_p99": percentile(ttp, 99),
+    }
+
+
+def run(args) -> dict:
+    logging.basicConfig(level=logging.WARNING)
+    api = FakeBotApi(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                     retry_after=args.retry_after).start()
+    workdir = tempfile.mkdtemp(prefix="bench_flood_")
+    mod = load_bot(args.bot, api, workdir)
+    limit = getattr(mod, "SPAM_LIMIT", None) or getattr(mod, "MAX_MSG")
+    burst = args.burst or limit + 5
+
+    updates, owner, spammers = generate(args.chats, args.users, args.spammers, burst,
+                                        args.normal, args.seed)
+    fed_at = {}
+    start = time.monotonic()
+    feed(mod, api, updates, args.mode, args.rate, fed_at)
+    fed = time.monotonic()
+
+    deadline = fed + args.settle
+    while mod.dispatcher.processed < len(updates) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    processed_at = time.monotonic()
+    # wait for outstanding mutes and purges, or until the settle time runs out
+    while time.monotonic() < deadline:
+        report = analyze(api, updates, owner, spammers, fed_at, limit)
+        if report["muted"] >= report["incidents"] and report["purged"] >= report["incidents"]:
+            break
+        time.sleep(0.2)
+    report = analyze(api, updates, owner, spammers, fed_at, limit)
+
+    calls = api.calls_by_method()
+    total_calls = sum(calls.values())
+    report.update({
+        "bot": args.bot,
+        "mode": args.mode,
+        "updates": len(updates),
+        "processed": mod.dispatcher.processed,
+        "updates_per_sec": round(mod.dispatcher.processed / max(processed_at - start, 1e-9), 1),
+        "feed_seconds": round(fed - start, 3),
+        "dispatcher_max_lag": round(mod.dispatcher.max_lag, 3),
+        "api_calls": total_calls,
+        "api_calls_by_method": calls,
+        "api_429": api.throttled,
+        "api_calls_per_incident": round(total_calls / report["incidents"], 2) if report["incidents"] else None,
+    })
+    for k in ("time_to_mute_p50", "time_to_mute_p99", "time_to_purge_p50", "time_to_purge_p99"):
+        if report[k] is not None:
+            report[k] = round(report[k], 3)
+    api.shutdown()
+    return report
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Flood benchmark against a fake Bot API")
+    p.add_argument("--bot", choices=BOTS, default=BOTS[0])
+    p.add_argument("--mode", choices=("direct", "polling", "webhook"), default="direct")
+    p.add_argument("--chats", type=int, default=20)
+    p.add_argument("--users", type=int, default=50, help="users per chat")
+    p.add_argument("--spammers", type=float, default=0.1, help="share of users that flood")
+    p.add_argument("--burst", type=int, default=0, help="messages per spammer (default: limit + 5)")
+    p.add_argument("--normal", type=int, default=3, help="messages per normal user")
+    p.add_argument("--rate", type=float, default=0, help="updates/s to feed, 0 = as fast as possible")
+    p.add_argument("--latency", type=float, default=0.02, help="fake API latency, seconds")
+    p.add_argument("--jitter", type=float, default=0.01, help="extra random latency, seconds")
+    p.add_argument("--rate-429", type=float, default=0.0, help="share of calls answered with 429")
+    p.add_argument("--retry-after", type=int, default=1)
+    p.add_argument("--settle", type=float, default=30.0, help="max seconds to wait for mutes and purges")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--json", action="store_true", help="print the report as one JSON object")
+    args = p.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        for k, v in report.items():
+            print(f"{k:>24}: {v}")
+    sys.stdout.flush()
+    # bot threads are daemons; exit without waiting for long polling
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Per-chat blocklist of phrases, link domains and invite links.
+
+Text and captions are normalized (NFKC, case folding, accents and
+zero-width characters dropped) and scanned with an Aho-Corasick automaton
+built from the chat's phrases, in one pass that is linear in the message
+length however many phrases there are. Links come from the message entities
+("url" and hidden "text_link"); their hosts are checked against the blocked
+domains, parent domains included.
+
+Look-alike letters and digits are folded only inside words that mix scripts
+("кaзинo" with Latin a and o, "c4sino"): such a word is replaced by its
+upper-cased skeleton (look-alikes folded to Latin). Words written in one
+script are left alone, so a Russian sentence never matches an English term
+through look-alikes ("нот" is not "hot"). Every term is compiled with each of
+its words either as written or as a skeleton; normal words are case-folded,
+so the upper-case skeleton variants only match inside mixed words.
+
+Every chat has an immutable compiled Blocklist. Chats without their own
+terms share the default one. Adding or removing a term recompiles only that
+chat and swaps its entry in; the hot path never takes a lock.
+
+File format (BLOCKLIST_FILE):
+    {"default": {"terms": ["казино"], "domains": ["scam.example"], "invites": false},
+     "chats": {"-1001234567890": {"terms": ["крипта"], "invites": true}}}
+Chat terms and domains are added to the default ones; "invites" overrides.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+MIN_TERM_LENGTH = 3
+MAX_VARIANT_WORDS = 6
+
+# letters that look like Latin ones, and digits used as letters
+_HOMOGLYPHS = {
+    "а": "a", "в": "b", "е": "e", "ё": "e", "к": "k", "м": "m", "н": "h", "о": "o", "р": "p",
+    "с": "c", "т": "t", "у": "y", "х": "x", "і": "i", "ї": "i", "ј": "j", "ѕ": "s", "ԁ": "d",
+    "α": "a", "β": "b", "ε": "e", "ι": "i", "κ": "k", "ν": "v", "ο": "o", "ρ": "p", "τ": "t",
+    "υ": "u", "χ": "x", "0": "o", "1": "i", "3": "з", "4": "a", "5": "s", "@": "a", "$": "s",
+}
+# character classes a mixed word draws from; look-alike digits count as one
+_SCRIPTS = [frozenset(map(chr, range(ord("a"), ord("z") + 1))), frozenset(map(chr, range(0x0400, 0x0530))),
+            frozenset(map(chr, range(0x0370, 0x0400))), frozenset("013456@$")]
+_ZERO_WIDTH = dict.fromkeys([0x00AD, 0x200B, 0x200C, 0x200D, 0x200E, 0x200F, 0x2060, 0x2061, 0x2062, 0x2063, 0xFEFF])
+_TRANSLATE = str.maketrans(_HOMOGLYPHS)
+
+_INVITE_RE = re.compile(r"^(?:t\.me|telegram\.me|telegram\.dog)/(?:joinchat/|\+)", re.IGNORECASE)
+
+
+def skeleton(word: str) -> str:
+    return word.translate(_TRANSLATE).upper()
+
+
+def _is_mixed(s: str) -> bool:
+    seen = False
+    for chars in _SCRIPTS:
+        if not chars.isdisjoint(s):
+            if seen:
+                return True
+            seen = True
+    return False
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.translate(_ZERO_WIDTH))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = unicodedata.normalize("NFKC", text).casefold()
+    if not _is_mixed(text):
+        # one script in the whole text: no word can mix them
+        return " ".join(text.split())
+    return " ".join(skeleton(w) if _is_mixed(w) else w for w in text.split())
+
+
+def term_variants(term: str) -> list:
+    """Normalized term -> the spellings to search for: each word as written or as
+    a skeleton (at most 2**MAX_VARIANT_WORDS variants; longer phrases keep
+    only the first words' choices)."""
+    variants = [""]
+    for i, word in enumerate(term.split()):
+        alt = skeleton(word)
+        sep = " " if i else ""
+        if alt == word or i >= MAX_VARIANT_WORDS:
+            variants = [v + sep + word for v in variants]
+        else:
+            variants = [v + sep + w for v in variants for w in (word, alt)]
+    return variants
+
+
+def extract_urls(text: str, entities) -> list:
+    """URLs of "url" and "text_link" entities (offsets are in UTF-16 code units)."""
+    urls = []
+    encoded = None
+    for e in entities or ():
+        if e.type == "text_link" and e.url:
+            urls.append(e.url)
+        elif e.type == "url" and text:
+            if encoded is None:
+                encoded = text.encode("utf-16-le")
+            urls.append(encoded[2 * e.offset:2 * (e.offset + e.length)].decode("utf-16-le", "replace"))
+    return urls
+
+
+def _strip_scheme(url: str) -> str:
+    url = url.strip()
+    return url.split("://", 1)[1] if "://" in url else url
+
+
+def url_host(url: str):
+    try:
+        host = urlsplit("//" + _strip_scheme(url)).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    host = host.rstrip(".")
+    return host[4:] if host.startswith("www.") else host
+
+
+def is_invite(url: str) -> bool:
+    return bool(_INVITE_RE.match(_strip_scheme(url)))
+
+
+def normalize_domain(domain: str) -> str:
+    return url_host(domain.lower()) or domain.lower()
+
+
+class Automaton:
+    """Aho-Corasick automaton over normalized terms."""
+
+    def __init__(self, terms):
+        # node -> {char: node}; node -> failure link; node -> a term ending here (or via suffix)
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [None]
+        for term in terms:
+            node = 0
+            for ch in term:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(None)
+                node = nxt
+            self.out[node] = term
+        # breadth-first: failure links point to the longest proper suffix in the trie
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, nxt in self.goto[node].items():
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                if self.out[nxt] is None:
+                    self.out[nxt] = self.out[self.fail[nxt]]
+                queue.append(nxt)
+
+    def search(self, text: str):
+        """First term found in the (normalized) text, or None."""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node] is not None:
+                return out[node]
+        return None
+
+    def __len__(self):
+        return len(self.goto)
+
+
+class Blocklist:
+    __slots__ = ("terms", "domains", "invites", "automaton", "_spellings")
+
+    def __init__(self, terms=(), domains=(), invites: bool = False):
+        self.terms = frozenset(t for t in map(normalize, terms) if len(t) >= MIN_TERM_LENGTH)
+        self.domains = frozenset(normalize_domain(d) for d in domains)
+        self.invites = invites
+        # spelling -> the term it was made from
+        self._spellings = {v: t for t in sorted(self.terms) for v in term_variants(t)}
+        self.automaton = Automaton(sorted(self._spellings)) if self.terms else None
+
+    def match(self, text: str, entities=None):
+        """Why the message is blocked ("term: ...", "domain: ...", "invite link"), or None."""
+        if self.automaton is not None and text:
+            term = self.automaton.search(normalize(text))
+            if term is not None:
+                return "term: " + self._spellings[term]
+        if not entities or not (self.domains or self.invites):
+            return None
+        for url in extract_urls(text, entities):
+            if self.invites and is_invite(url):
+                return "invite link"
+            host = url_host(url)
+            while host:
+                if host in self.domains:
+                    return "domain: " + host
+                host = host.partition(".")[2]
+        return None
+
+
+class BlocklistStore:
+    def __init__(self, path: str, default_invites: bool = False):
+        self.path = path
+        self.default_invites = default_invites
+        self._raw = {"default": {}, "chats": {}}
+        # (chat_id -> Blocklist, default Blocklist); replaced as a whole
+        self._snapshot = ({}, Blocklist(invites=default_invites))
+        self._lock = threading.Lock()
+
+    def get(self, chat_id: int) -> Blocklist:
+        lists, default = self._snapshot
+        return lists.get(chat_id, default)
+
+    def _compile_chat(self, default: dict, chat: dict) -> Blocklist:
+        return Blocklist(terms=list(default.get("terms", ())) + list(chat.get("terms", ())),
+                         domains=list(default.get("domains", ())) + list(chat.get("domains", ())),
+                         invites=chat.get("invites", default.get("invites", self.default_invites)))
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                raw = json.load(f)
+            default_raw = raw.get("default") or {}
+            default = self._compile_chat(default_raw, {})
+            lists = {int(c): self._compile_chat(default_raw, v) for c, v in (raw.get("chats") or {}).items()}
+        except FileNotFoundError:
+            return True
+        except (OSError, ValueError, AttributeError, TypeError) as e:
+            logger.error("Blocklist file %s ignored: %s", self.path, e)
+            return False
+        with self._lock:
+            self._raw = {"default": default_raw, "chats": dict(raw.get("chats") or {})}
+            self._snapshot = (lists, default)
+        logger.info("Loaded blocklists for %d chats from %s", len(lists), self.path)
+        return True
+
+    def _save(self, raw: dict):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(raw, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def _edit(self, chat_id: int, fn) -> Blocklist:
+        # recompiles only this chat's automaton
+        with self._lock:
+            chats = dict(self._raw["chats"])
+            chat = dict(chats.get(str(chat_id), {}))
+            fn(chat)
+            compiled = self._compile_chat(self._raw["default"], chat)
+            chats[str(chat_id)] = chat
+            raw = {"default": self._raw["default"], "chats": chats}
+            self._save(raw)
+            lists, default = self._snapshot
+            lists = dict(lists)
+            lists[chat_id] = compiled
+            self._raw, self._snapshot = raw, (lists, default)
+        return compiled
+
+    def add(self, chat_id: int, kind: str, value):
+        """kind: "terms" or "domains" (value is appended) or "invites" (value is a bool)."""
+        if kind == "terms" and len(normalize(value)) < MIN_TERM_LENGTH:
+            raise ValueError(f"Term is shorter than {MIN_TERM_LENGTH} characters")
+
+        def fn(chat):
+            if kind == "invites":
+                chat["invites"] = bool(value)
+            elif value not in chat.get(kind, ()):
+                chat[kind] = list(chat.get(kind, ())) + [value]
+        return self._edit(chat_id, fn)
+
+    def remove(self, chat_id: int, kind: str, value) -> Blocklist:
+        def fn(chat):
+            if kind == "invites":
+                chat["invites"] = False
+            elif kind == "terms":
+                chat[kind] = [v for v in chat.get(kind, ()) if normalize(v) != normalize(value)]
+            else:
+                chat[kind] = [v for v in chat.get(kind, ()) if v != value]
+        return self._edit(chat_id, fn)
+
+    def own_entries(self, chat_id: int) -> dict:
+        """The chat's own terms/domains/invites as stored (without defaults)."""
+        return dict(self._raw["chats"].get(str(chat_id), {}))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Batched message deletion.
+
+Message ids are collected per chat and flushed in chunks of up to 100 through
+the bulk deleteMessages method. If a chunk is rejected, its ids are retried one
+by one with deleteMessage. Deleted/failed counts are kept per chat.
+
+With an OutboundScheduler the calls go through it with PRIO_DELETE, so purges
+share the global rate limit and yield to restricts.
+"""
+import logging
+import threading
+import time
+
+from outbound import PRIO_DELETE
+
+logger = logging.getLogger(__name__)
+
+MAX_CHUNK = 100  # deleteMessages limit
+
+
+class BulkDeleter:
+    def __init__(self, bot, chunk_size: int = MAX_CHUNK, interval: float = 0.5, scheduler=None):
+        self.bot = bot
+        self.scheduler = scheduler
+        self.chunk_size = min(chunk_size, MAX_CHUNK)
+        self.interval = interval
+        # chat_id -> {message_id: None}, dict keeps insertion order and dedups
+        self._pending = {}
+        # chat_id -> [deleted, failed] since start
+        self._totals = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, chat_id: int, message_ids):
+        with self._lock:
+            pending = self._pending.setdefault(chat_id, {})
+            for mid in message_ids:
+                pending[mid] = None
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(len(p) for p in self._pending.values())
+
+    def flush(self) -> dict:
+        """Delete everything queued so far. Returns chat_id -> (deleted, failed)."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        report = {}
+        for chat_id, ids in batch.items():
+            ids = sorted(ids)
+            deleted = failed = 0
+            for i in range(0, len(ids), self.chunk_size):
+                d, f = self._delete_chunk(chat_id, ids[i:i + self.chunk_size])
+                deleted += d
+                failed += f
+            report[chat_id] = (deleted, failed)
+            with self._lock:
+                totals = self._totals.setdefault(chat_id, [0, 0])
+                totals[0] += deleted
+                totals[1] += failed
+            logger.info("Bulk delete in %s: deleted %d, failed %d", chat_id, deleted, failed)
+        return report
+
+    def totals(self) -> dict:
+        with self._lock:
+            return {chat_id: tuple(t) for chat_id, t in self._totals.items()}
+
+    def _call(self, chat_id: int, fn, *args):
+        if self.scheduler is None:
+            return fn(*args)
+        return self.scheduler.call(PRIO_DELETE, chat_id, fn, *args)
+
+    def _delete_chunk(self, chat_id: int, ids: list):
+        try:
+            self._call(chat_id, self.bot.delete_messages, chat_id, ids)
+            return len(ids), 0
+        except Exception as e:
+            logger.warning("deleteMessages failed in %s (%d ids), falling back: %s", chat_id, len(ids), e)
+        futures = []
+        for mid in ids:
+            if self.scheduler is None:
+                try:
+                    self.bot.delete_message(chat_id, mid)
+                    futures.append(None)
+                except Exception as e:
+                    # message already deleted or no rights
+                    futures.append(e)
+            else:
+                futures.append(self.scheduler.submit(PRIO_DELETE, chat_id, self.bot.delete_message, chat_id, mid))
+        deleted = failed = 0
+        for f in futures:
+            if f is None or (not isinstance(f, Exception) and f.exception() is None):
+                deleted += 1
+            else:
+                failed += 1
+        return deleted, failed
+
+    def start(self):
+        """Flush in a background thread every `interval` seconds."""
+        def worker():
+            while True:
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Bulk delete flush failed")
+                time.sleep(self.interval)
+        self._thread = threading.Thread(target=worker, daemon=True)
+        self._thread.start()
+        return self._thread
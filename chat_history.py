@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded per-chat index of recent messages, for /purge.
+
+Every chat owns a ring of (timestamp, message_id, user_id) kept in three
+parallel arrays, 20 bytes per message. The arrays grow with the chat up to
+`capacity` and are then overwritten from the oldest slot, so a quiet chat
+costs a few hundred bytes and a busy one at most capacity * 20 bytes. Chats
+are kept in LRU order; idle chats are evicted by evict_idle(), and the least
+recently active ones are dropped when the index holds more than
+`max_entries` messages in total.
+
+select() walks a chat's ring once from the newest message back and stops at
+the first message older than `since` or after `last` matches, so a purge
+costs O(messages it looks at) whatever the number of chats. Selected
+messages can be taken out of the index in the same pass, so a second purge
+does not ask Telegram to delete them again; messages deleted some other way
+(auto-mute purges, the blocklist) are taken out with discard().
+"""
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+ENTRY_BYTES = 8 + 4 + 8  # ts, message_id, user_id
+
+
+class _Log:
+    __slots__ = ("ts", "ids", "users", "head", "last_seen")
+
+    def __init__(self):
+        self.ts = array("d")
+        self.ids = array("i")    # 0 = taken by a purge
+        self.users = array("q")
+        self.head = 0            # index of the oldest element once the ring is full
+        self.last_seen = 0.0
+
+
+class ChatHistory:
+    def __init__(self, capacity: int = 20000, max_entries: int = 5_000_000, idle_seconds: float = 86400):
+        self.capacity = capacity
+        self.max_entries = max_entries
+        self.idle_seconds = idle_seconds
+        # chat_id -> _Log, least recently active first
+        self._chats = OrderedDict()
+        self._entries = 0
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def add(self, chat_id: int, user_id: int, message_id: int, ts: float):
+        with self._lock:
+            log = self._chats.get(chat_id)
+            if log is None:
+                log = self._chats[chat_id] = _Log()
+            else:
+                self._chats.move_to_end(chat_id)
+            log.last_seen = ts
+            if len(log.ts) < self.capacity:
+                log.ts.append(ts)
+                log.ids.append(message_id)
+                log.users.append(user_id)
+                self._entries += 1
+                if self._entries > self.max_entries:
+                    self._evict_lru(keep=chat_id)
+            else:
+                i = log.head
+                log.ts[i] = ts
+                log.ids[i] = message_id
+                log.users[i] = user_id
+                log.head = (i + 1) % self.capacity
+
+    def select(self, chat_id: int, user_id: int = None, since: float = None, last: int = None,
+               take: bool = False) -> list:
+        """Message ids of the chat, oldest first: of `user_id` if given, not older
+        than `since`, at most the `last` newest ones. take=True removes them from the index."""
+        out = []
+        with self._lock:
+            log = self._chats.get(chat_id)
+            if log is None:
+                return out
+            ts, ids, users = log.ts, log.ids, log.users
+            n = len(ts)
+            for k in range(n - 1, -1, -1):
+                i = (log.head + k) % n
+                if since is not None and ts[i] < since:
+                    break
+                mid = ids[i]
+                if mid == 0 or (user_id is not None and users[i] != user_id):
+                    continue
+                out.append(mid)
+                if take:
+                    ids[i] = 0
+                if last is not None and len(out) >= last:
+                    break
+        out.reverse()
+        return out
+
+    def discard(self, chat_id: int, message_ids) -> int:
+        """Take these ids out of the chat's index; returns how many were found."""
+        wanted = set(message_ids)
+        if not wanted:
+            return 0
+        oldest = min(wanted)
+        found = 0
+        with self._lock:
+            log = self._chats.get(chat_id)
+            if log is None:
+                return 0
+            ids = log.ids
+            n = len(ids)
+            # message ids grow with time inside a chat: stop at the first one older than all wanted
+            for k in range(n - 1, -1, -1):
+                i = (log.head + k) % n
+                mid = ids[i]
+                if mid in wanted:
+                    ids[i] = 0
+                    found += 1
+                    if found == len(wanted):
+                        break
+                elif mid and mid < oldest:
+                    break
+        return found
+
+    def evict_idle(self, now: float = None) -> int:
+        cutoff = (time.time() if now is None else now) - self.idle_seconds
+        n = 0
+        with self._lock:
+            # LRU order: the first chat is the one idle the longest
+            while self._chats:
+                chat_id, log = next(iter(self._chats.items()))
+                if log.last_seen >= cutoff:
+                    break
+                self._drop(chat_id)
+                n += 1
+        return n
+
+    def _evict_lru(self, keep: int):
+        while self._entries > self.max_entries and len(self._chats) > 1:
+            chat_id = next(iter(self._chats))
+            if chat_id == keep:
+                break
+            self._drop(chat_id)
+
+    def _drop(self, chat_id: int):
+        log = self._chats.pop(chat_id)
+        self._entries -= len(log.ts)
+        self.evicted += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"chats": len(self._chats), "entries": self._entries, "bytes": self._entries * ENTRY_BYTES,
+                    "evicted": self.evicted}
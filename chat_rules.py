@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Per-chat moderation rules with atomic hot reload.
+
+Rules live in a JSON file:
+    {
+      "default": {"spam_limit": 10, "window_seconds": 10},
+      "chats": {"-1001234567890": {"spam_limit": 5, "mute_seconds": 3600}}
+    }
+Missing fields fall back to "default", then to the defaults the bot passes
+in. Each chat's rules are compiled once into an immutable Rules tuple. The
+hot path does one dict lookup per message (RulesStore.get) and reads plain
+attributes after that, with no locks.
+
+A reload or a /config change builds a new chat -> Rules mapping and swaps it
+in with a single assignment, so readers see either the old rules or the new
+ones, never a mix. watch() polls the file's mtime and reloads it when it
+changes; a file that fails to parse or validate is logged and ignored.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from moderation import parse_duration
+
+logger = logging.getLogger(__name__)
+
+
+class Rules(NamedTuple):
+    spam_limit: int           # more messages than this within window_seconds -> mute
+    window_seconds: float
+    mute_seconds: int
+    delete_last: int          # how many of the user's last messages to delete on auto-mute
+    lockdown_limit: int       # spam_limit while the chat is in raid lockdown
+    adaptive: int             # 1: the limit follows the chat's baseline (adaptive.py), 0: spam_limit
+    adaptive_floor: int       # adaptive limit bounds
+    adaptive_ceiling: int
+
+
+FIELDS = Rules._fields
+DURATION_FIELDS = ("window_seconds", "mute_seconds")
+# Telegram treats restrictions shorter than 30 s or longer than 366 days as permanent
+MIN_MUTE_SECONDS = 30
+MAX_MUTE_SECONDS = 366 * 86400
+
+
+class RulesError(ValueError):
+    pass
+
+
+def compile_rules(base: Rules, fields: dict, max_messages: int) -> Rules:
+    """Merge `fields` into `base` and validate; raises RulesError."""
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        raise RulesError("Unknown fields: " + ", ".join(sorted(unknown)))
+    try:
+        rules = base._replace(**{k: Rules.__annotations__[k](v) for k, v in fields.items()})
+    except (TypeError, ValueError) as e:
+        raise RulesError(str(e))
+    if not 1 <= rules.spam_limit < max_messages or not 1 <= rules.lockdown_limit < max_messages:
+        raise RulesError(f"spam_limit and lockdown_limit must be within 1..{max_messages - 1}")
+    if rules.adaptive not in (0, 1):
+        raise RulesError("adaptive must be 0 or 1")
+    if not 1 <= rules.adaptive_floor <= rules.adaptive_ceiling < max_messages:
+        raise RulesError(f"need 1 <= adaptive_floor <= adaptive_ceiling <= {max_messages - 1}")
+    if not 1 <= rules.delete_last <= max_messages:
+        raise RulesError(f"delete_last must be within 1..{max_messages}")
+    if rules.window_seconds <= 0:
+        raise RulesError("window_seconds must be > 0")
+    if not MIN_MUTE_SECONDS <= rules.mute_seconds <= MAX_MUTE_SECONDS:
+        raise RulesError(f"mute_seconds must be within {MIN_MUTE_SECONDS}..{MAX_MUTE_SECONDS}")
+    return rules
+
+
+def parse_field(name: str, value: str):
+    """Parse a /config value: numbers, or durations like 30s / 5m / 12h for *_seconds fields."""
+    if name not in FIELDS:
+        raise RulesError(f"Unknown field {name}; known: " + ", ".join(FIELDS))
+    if name in DURATION_FIELDS and not value.replace(".", "", 1).isdigit():
+        return parse_duration(value)
+    try:
+        return Rules.__annotations__[name](value)
+    except ValueError:
+        raise RulesError(f"Bad value for {name}: {value!r}")
+
+
+def describe(rules: Rules) -> str:
+    return "\n".join(f"{name} = {getattr(rules, name):g}" for name in FIELDS)
+
+
+class RulesStore:
+    def __init__(self, path: str, defaults: Rules, max_messages: int):
+        """max_messages: how many messages per user the bot keeps (limits spam_limit/delete_last)."""
+        self.path = path
+        self.defaults = defaults
+        self.max_messages = max_messages
+        # (chat_id -> Rules, default Rules); replaced as a whole, never mutated
+        self._snapshot = ({}, defaults)
+        # raw overrides as stored in the file, for /config edits
+        self._raw = {"default": {}, "chats": {}}
+        self._mtime = None
+        self._write_lock = threading.Lock()
+
+    def get(self, chat_id: int) -> Rules:
+        rules, default = self._snapshot
+        return rules.get(chat_id, default)
+
+    def has_override(self, chat_id: int) -> bool:
+        return chat_id in self._snapshot[0]
+
+    def _compile(self, raw: dict):
+        default = compile_rules(self.defaults, raw.get("default") or {}, self.max_messages)
+        rules = {}
+        for chat, fields in (raw.get("chats") or {}).items():
+            try:
+                chat_id = int(chat)
+            except ValueError:
+                raise RulesError(f"Bad chat id: {chat!r}")
+            if not isinstance(fields, dict):
+                raise RulesError(f"chat {chat_id}: rules must be an object")
+            try:
+                rules[chat_id] = compile_rules(default, fields, self.max_messages)
+            except RulesError as e:
+                raise RulesError(f"chat {chat_id}: {e}")
+        return default, rules
+
+    def load(self) -> bool:
+        """(Re)load the file; returns False and keeps the current rules if it is invalid."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return True
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                raw = json.load(f)
+            if not isinstance(raw, dict):
+                raise RulesError("top level must be an object")
+            default, rules = self._compile(raw)
+        except (OSError, ValueError) as e:
+            logger.error("Rules file %s ignored: %s", self.path, e)
+            self._mtime = mtime
+            return False
+        with self._write_lock:
+            self._raw = {"default": raw.get("default") or {}, "chats": dict(raw.get("chats") or {})}
+            self._snapshot = (rules, default)
+            self._mtime = mtime
+        logger.info("Loaded rules for %d chats from %s", len(rules), self.path)
+        return True
+
+    def _save(self, raw: dict):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(raw, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+        self._mtime = os.stat(self.path).st_mtime
+
+    def update(self, chat_id: int, **fields) -> Rules:
+        """Override fields for one chat, persist the file and swap the rules in."""
+        with self._write_lock:
+            chats = dict(self._raw["chats"])
+            merged = dict(chats.get(str(chat_id), {}), **fields)
+            current, default = self._snapshot
+            rules = compile_rules(default, merged, self.max_messages)
+            chats[str(chat_id)] = merged
+            raw = {"default": self._raw["default"], "chats": chats}
+            self._save(raw)
+            new = dict(current)
+            new[chat_id] = rules
+            self._raw, self._snapshot = raw, (new, default)
+        return rules
+
+    def reset(self, chat_id: int):
+        """Drop a chat's overrides; it falls back to the defaults."""
+        with self._write_lock:
+            chats = dict(self._raw["chats"])
+            if chats.pop(str(chat_id), None) is None:
+                return
+            raw = {"default": self._raw["default"], "chats": chats}
+            self._save(raw)
+            current, default = self._snapshot
+            new = dict(current)
+            new.pop(chat_id, None)
+            self._raw, self._snapshot = raw, (new, default)
+
+    def watch(self, interval: float = 5):
+        """Reload the file in a daemon thread whenever its mtime changes."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    mtime = os.stat(self.path).st_mtime
+                except FileNotFoundError:
+                    continue
+                if mtime != self._mtime:
+                    self.load()
+        t = threading.Thread(target=loop, daemon=True)
+        t.start()
+        return t
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Near-duplicate text detection across users of a chat.
+
+Each message text (or caption) is normalized and reduced to a 64-bit SimHash
+of its words and word pairs. Two texts are near-duplicates when their hashes
+differ in at most `max_distance` bits. The per-chat index splits hashes into
+max_distance + 1 bands of bits: two hashes that close always share at least
+one band exactly, so a lookup only compares against the fingerprints in the
+same band buckets instead of the whole chat. Messages with an identical
+fingerprint share one group, so a raid repeating one text costs a single
+comparison.
+
+Entries live for `window` seconds, at most `max_per_chat` per chat and
+`max_chats` chats (least recently active chat dropped first). Entries are
+appended and expire in time order, so each group is a deque whose oldest
+entry is always at the left, and a group counts its entries per user. A
+lookup counts distinct users over the matched groups' user counts (stopping
+at `min_users`); the entries of a group are walked (merged by time, never
+re-sorted) only when it is first flagged. After that a message matching a
+flagged group only adds its own sender.
+"""
+import hashlib
+import heapq
+import itertools
+import re
+import threading
+from collections import OrderedDict, deque
+from operator import attrgetter
+
+HASH_BITS = 64
+
+_url_re = re.compile(r"(?:https?://|www\.)\S+|\S+\.(?:com|net|org|ru|me|io|xyz|top)\S*", re.IGNORECASE)
+_word_re = re.compile(r"\w+", re.UNICODE)
+_digits_re = re.compile(r"\d+")
+
+
+def normalize(text: str) -> list:
+    """Lower-cased words with every number replaced by 0; URLs are kept as one token."""
+    if not text:
+        return []
+    text = text.casefold()
+    urls = [u.rstrip(".,!?)") for u in _url_re.findall(text)]
+    words = _word_re.findall(_url_re.sub(" ", text))
+    return [_digits_re.sub("0", w) for w in words] + urls
+
+
+def _feature_hash(s: str) -> int:
+    # stable across processes (unlike hash()), so fingerprints can be recorded and replayed
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+# SimHash needs a per-bit vote over all features. Instead of looping over 64
+# bits per feature, each byte of a feature hash is spread into eight 16-bit
+# lanes with a lookup table, so one integer addition votes on 8 bits at once.
+_LANE = 16
+_SPREAD = [sum(1 << (_LANE * i) for i in range(8) if (v >> i) & 1) for v in range(256)]
+_BYTE_SHIFT = 8 * _LANE
+
+
+def simhash(tokens) -> int:
+    if not tokens:
+        return 0
+    features = list(tokens)
+    features += [a + " " + b for a, b in zip(tokens, tokens[1:])]
+    features = features[:(1 << _LANE) - 1]
+    total = 0
+    for f in features:
+        h = _feature_hash(f)
+        for k in range(8):
+            total += _SPREAD[(h >> (8 * k)) & 0xFF] << (_BYTE_SHIFT * k)
+    half = len(features) / 2
+    mask = (1 << _LANE) - 1
+    out = 0
+    for i in range(HASH_BITS):
+        if ((total >> (_LANE * i)) & mask) > half:
+            out |= 1 << i
+    return out
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class _Entry:
+    __slots__ = ("ts", "user_id", "message_id", "name")
+
+    def __init__(self, ts, user_id, message_id, name):
+        self.ts = ts
+        self.user_id = user_id
+        self.message_id = message_id
+        self.name = name
+
+
+class _Group:
+    __slots__ = ("entries", "users", "flagged_at")
+
+    def __init__(self):
+        self.entries = deque()  # oldest first
+        self.users = {}         # user_id -> entries in the group
+        self.flagged_at = None  # ts the group was last reported in a cluster
+
+
+_entry_ts = attrgetter("ts")
+
+
+class _ChatIndex:
+    __slots__ = ("order", "groups", "bands", "flagged", "last_seen")
+
+    def __init__(self, nbands: int):
+        # fingerprints in insertion order, one per entry (for expiry)
+        self.order = deque()
+        # fingerprint -> _Group of entries with exactly that fingerprint;
+        # a raid posting one text many times is a single group
+        self.groups = {}
+        # band number -> band value -> set of fingerprints
+        self.bands = [{} for _ in range(nbands)]
+        # user_id -> ts when the user was last returned in a cluster, oldest first
+        self.flagged = OrderedDict()
+        self.last_seen = 0.0
+
+
+class DuplicateIndex:
+    def __init__(self, window: float = 600, max_distance: int = 8, min_users: int = 3,
+                 min_tokens: int = 4, max_per_chat: int = 2000, max_chats: int = 10000):
+        self.window = window
+        self.max_distance = max_distance
+        self.min_users = min_users
+        self.min_tokens = min_tokens
+        self.max_per_chat = max_per_chat
+        self.max_chats = max_chats
+        self.nbands = max_distance + 1
+        self.band_bits = HASH_BITS // self.nbands
+        self._band_mask = (1 << self.band_bits) - 1
+        # chat_id -> _ChatIndex, least recently active first
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def fingerprint(self, text: str):
+        """SimHash of the text, or None when it is too short to compare safely."""
+        tokens = normalize(text)
+        if len(tokens) < self.min_tokens:
+            return None
+        return simhash(tokens)
+
+    def _bands(self, fp: int):
+        return [(fp >> (b * self.band_bits)) & self._band_mask for b in range(self.nbands)]
+
+    def _drop_oldest(self, idx: _ChatIndex):
+        fp = idx.order.popleft()
+        group = idx.groups[fp]
+        uid = group.entries.popleft().user_id
+        if group.users[uid] > 1:
+            group.users[uid] -= 1
+        else:
+            del group.users[uid]
+        if group.entries:
+            return
+        del idx.groups[fp]
+        for b, value in enumerate(self._bands(fp)):
+            fps = idx.bands[b][value]
+            fps.discard(fp)
+            if not fps:
+                del idx.bands[b][value]
+
+    def _spans_users(self, groups) -> bool:
+        users = set()
+        for g in groups:
+            for uid in g.users:
+                users.add(uid)
+                if len(users) >= self.min_users:
+                    return True
+        return False
+
+    def add(self, chat_id: int, user_id: int, message_id: int, text: str, ts: float, name: str = None):
+        """Index a message and look up its near-duplicates.
+
+        Returns None, or {user_id: (name, [message_ids])} with the near-duplicate
+        messages of every user not reported before, once the duplicates span at
+        least `min_users` distinct users. A user is reported at most once per
+        window.
+        """
+        fp = self.fingerprint(text)
+        if fp is None:
+            return None
+        bands = self._bands(fp)
+        with self._lock:
+            idx = self._chats.get(chat_id)
+            if idx is None:
+                if len(self._chats) >= self.max_chats:
+                    self._chats.popitem(last=False)
+                idx = self._chats[chat_id] = _ChatIndex(self.nbands)
+            else:
+                self._chats.move_to_end(chat_id)
+            idx.last_seen = ts
+            horizon = ts - self.window
+            while idx.order and (idx.groups[idx.order[0]].entries[0].ts < horizon
+                                 or len(idx.order) >= self.max_per_chat):
+                self._drop_oldest(idx)
+            while idx.flagged and next(iter(idx.flagged.values())) < horizon:
+                idx.flagged.popitem(last=False)
+
+            matched = set()
+            for b, value in enumerate(bands):
+                for other in idx.bands[b].get(value, ()):
+                    if other not in matched and hamming(fp, other) <= self.max_distance:
+                        matched.add(other)
+
+            entry = _Entry(ts, user_id, message_id, name)
+            idx.order.append(fp)
+            group = idx.groups.get(fp)
+            if group is None:
+                group = idx.groups[fp] = _Group()
+                for b, value in enumerate(bands):
+                    idx.bands[b].setdefault(value, set()).add(fp)
+            group.entries.append(entry)
+            group.users[user_id] = group.users.get(user_id, 0) + 1
+            matched.discard(fp)
+            groups = [group] + [idx.groups[other] for other in matched]
+
+            if not self._spans_users(groups):
+                return None
+            # the senders of every entry in a group flagged inside the window are
+            # flagged themselves, so only unflagged groups and the new entry can add users
+            fresh = [g for g in groups if g.flagged_at is None or g.flagged_at < horizon]
+            entries = heapq.merge(*(g.entries for g in fresh), key=_entry_ts)
+            if not fresh or fresh[0] is not group:
+                # the new entry is the newest one
+                entries = itertools.chain(entries, (entry,))
+            cluster = {}
+            for e in entries:
+                flagged_at = idx.flagged.get(e.user_id)
+                if flagged_at is not None and flagged_at >= horizon:
+                    continue
+                cluster.setdefault(e.user_id, (e.name, []))[1].append(e.message_id)
+            for g in groups:
+                g.flagged_at = ts
+            for uid in cluster:
+                idx.flagged[uid] = ts
+                idx.flagged.move_to_end(uid)
+        return cluster or None
+
+    def evict_idle(self, now: float) -> int:
+        """Drop chats with nothing inside the window; returns how many were dropped."""
+        horizon = now - self.window
+        with self._lock:
+            idle = [c for c, idx in self._chats.items() if idx.last_seen < horizon]
+            for c in idle:
+                del self._chats[c]
+        return len(idle)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"chats": len(self._chats),
+                    "entries": sum(len(idx.order) for idx in self._chats.values())}
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Per-chat ordered update dispatcher.
+
+Updates are hashed by chat id onto N worker queues: updates of one chat are
+always handled by the same worker in arrival order, different chats run
+concurrently. install(bot) replaces bot.process_new_updates, so both long
+polling and the webhook server feed the dispatcher; the bot itself must be
+created with threaded=False so handlers run inside the worker.
+
+Queues are bounded: when a worker falls behind, submit() blocks, which slows
+down polling (or makes the webhook answer 503) instead of growing memory.
+"""
+import logging
+import queue
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHAT_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post",
+               "my_chat_member", "chat_member", "chat_join_request")
+
+
+def update_type(update) -> str:
+    for attr in CHAT_FIELDS + ("callback_query",):
+        if getattr(update, attr, None) is not None:
+            return attr
+    return "other"
+
+
+def update_chat_id(update) -> int:
+    for attr in CHAT_FIELDS:
+        obj = getattr(update, attr, None)
+        if obj is not None:
+            return obj.chat.id
+    cq = getattr(update, "callback_query", None)
+    if cq is not None and cq.message is not None:
+        return cq.message.chat.id
+    # no chat (inline queries etc.): ordering does not matter
+    return update.update_id
+
+
+class OrderedDispatcher:
+    def __init__(self, handler=None, workers: int = 8, queue_size: int = 10000):
+        self.handler = handler
+        self.bot = None
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        # per worker: seconds the last update waited in the queue
+        self.lags = [0.0] * workers
+        self.max_lag = 0.0
+        self.processed = 0
+
+    def install(self, bot):
+        self.bot = bot
+        self.handler = bot.process_new_updates
+        bot.process_new_updates = self.submit
+        return self
+
+    def submit(self, updates):
+        now = time.monotonic()
+        for update in updates:
+            q = self.queues[hash(update_chat_id(update)) % len(self.queues)]
+            q.put((now, update))
+            # TeleBot.process_new_updates is what advances the polling offset;
+            # it now runs later in a worker, so confirm the update here
+            if self.bot is not None and update.update_id > self.bot.last_update_id:
+                self.bot.last_update_id = update.update_id
+
+    def _worker(self, i: int):
+        q = self.queues[i]
+        while True:
+            enqueued, update = q.get()
+            started = time.monotonic()
+            lag = started - enqueued
+            self.lags[i] = lag
+            if lag > self.max_lag:
+                self.max_lag = lag
+            kind = update_type(update) if metrics.registry.enabled else ""
+            try:
+                self.handler([update])
+            except Exception:
+                metrics.UPDATE_ERRORS.inc(kind)
+                logger.exception("Update %s failed", update.update_id)
+            metrics.UPDATE_LATENCY.observe(time.monotonic() - started, kind)
+            self.processed += 1
+
+    def start(self):
+        for i in range(len(self.queues)):
+            threading.Thread(target=self._worker, args=(i,), daemon=True, name=f"dispatch-{i}").start()
+        return self
+
+    def queue_depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    def lag(self) -> float:
+        """Worst current queueing delay across workers, seconds (0 for idle workers)."""
+        return max((lag if q.qsize() else 0.0) for lag, q in zip(self.lags, self.queues))
+
+    def metrics(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth(),
+            "queue_depths": [q.qsize() for q in self.queues],
+            "lag": self.lag(),
+            "max_lag": self.max_lag,
+            "processed": self.processed,
+        }
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Deadline scheduler for mute expiries.
+
+Keys (e.g. (chat_id, user_id)) are kept in a min-heap by deadline. Inserting
+and rescheduling are O(log n); cancelling is O(1) (stale heap entries are
+skipped lazily and the heap is compacted when they pile up). One thread
+sleeps exactly until the nearest deadline and calls `callback(key, deadline)`
+for every expired key with no lock held.
+
+An optional `journal` (e.g. persistence.MuteStore) gets put(key, deadline) /
+delete(key) for every change so the schedule survives restarts. The journal
+is called together with the change itself (under the lock, or in the same
+event-loop step), so it sees the changes of a key in the order they were
+made: an expiry or cancel can't journal its delete after a newer schedule().
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryScheduler:
+    def __init__(self, callback, clock=time.time, journal=None):
+        self.callback = callback
+        self.clock = clock
+        self.journal = journal
+        # (deadline, seq, key); entries whose seq no longer matches are stale
+        self._heap = []
+        # key -> (deadline, seq)
+        self._live = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __contains__(self, key) -> bool:
+        return key in self._live
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def keys(self):
+        with self._cond:
+            return list(self._live)
+
+    def deadline(self, key):
+        entry = self._live.get(key)
+        return entry[0] if entry is not None else None
+
+    def schedule(self, key, deadline: float):
+        """Insert the key or move its deadline."""
+        with self._cond:
+            self._push(key, deadline)
+
+    def add(self, key, deadline: float) -> bool:
+        """Insert the key only if it is not scheduled yet; returns True if inserted."""
+        with self._cond:
+            if key in self._live:
+                return False
+            self._push(key, deadline)
+            return True
+
+    def cancel(self, key) -> bool:
+        with self._cond:
+            removed = self._live.pop(key, None) is not None
+            if removed and self.journal is not None:
+                self.journal.delete(key)
+        return removed
+
+    def _push(self, key, deadline: float):
+        seq = next(self._seq)
+        self._live[key] = (deadline, seq)
+        heapq.heappush(self._heap, (deadline, seq, key))
+        if self.journal is not None:
+            self.journal.put(key, deadline)
+        if len(self._heap) > 2 * len(self._live) + 64:
+            self._heap = [(d, s, k) for k, (d, s) in self._live.items()]
+            heapq.heapify(self._heap)
+        if self._heap[0][1] == seq:
+            # new earliest deadline: wake the loop so it re-arms its timer
+            self._cond.notify()
+
+    def _pop_due(self):
+        """Wait until something expires; called with the condition held."""
+        while True:
+            heap = self._heap
+            while heap and self._live.get(heap[0][2], (None, None))[1] != heap[0][1]:
+                heapq.heappop(heap)
+            if not heap:
+                self._cond.wait()
+                continue
+            wait = heap[0][0] - self.clock()
+            if wait > 0:
+                self._cond.wait(wait)
+                continue
+            now = self.clock()
+            due = []
+            while heap and heap[0][0] <= now:
+                deadline, seq, key = heapq.heappop(heap)
+                if self._live.get(key, (None, None))[1] == seq:
+                    del self._live[key]
+                    if self.journal is not None:
+                        self.journal.delete(key)
+                    due.append((key, deadline))
+            return due
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                due = self._pop_due()
+            for key, deadline in due:
+                try:
+                    self.callback(key, deadline)
+                except Exception:
+                    logger.exception("Expiry callback failed for %s", key)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self._thread
+
+
+class AsyncExpiryScheduler:
+    """asyncio counterpart of ExpiryScheduler: run() is a task that sleeps until
+    the nearest deadline and starts `await callback(key, deadline)` tasks."""
+
+    def __init__(self, callback, clock=time.time, journal=None):
+        self.callback = callback
+        self.clock = clock
+        self.journal = journal
+        self._heap = []
+        self._live = {}
+        self._seq = itertools.count()
+        self._wake = None
+        self._tasks = set()  # keeps running callbacks referenced
+
+    def __contains__(self, key) -> bool:
+        return key in self._live
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def keys(self):
+        return list(self._live)
+
+    def schedule(self, key, deadline: float):
+        seq = next(self._seq)
+        self._live[key] = (deadline, seq)
+        heapq.heappush(self._heap, (deadline, seq, key))
+        if len(self._heap) > 2 * len(self._live) + 64:
+            self._heap = [(d, s, k) for k, (d, s) in self._live.items()]
+            heapq.heapify(self._heap)
+        if self.journal is not None:
+            self.journal.put(key, deadline)
+        if self._wake is not None and self._heap[0][1] == seq:
+            self._wake.set()
+
+    def add(self, key, deadline: float) -> bool:
+        if key in self._live:
+            return False
+        self.schedule(key, deadline)
+        return True
+
+    def cancel(self, key) -> bool:
+        removed = self._live.pop(key, None) is not None
+        if removed and self.journal is not None:
+            self.journal.delete(key)
+        return removed
+
+    async def _fire(self, key, deadline):
+        try:
+            await self.callback(key, deadline)
+        except Exception:
+            logger.exception("Expiry callback failed for %s", key)
+
+    async def run(self):
+        self._wake = asyncio.Event()
+        while True:
+            heap = self._heap
+            while heap and self._live.get(heap[0][2], (None, None))[1] != heap[0][1]:
+                heapq.heappop(heap)
+            timeout = heap[0][0] - self.clock() if heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+            now = self.clock()
+            while heap and heap[0][0] <= now:
+                deadline, seq, key = heapq.heappop(heap)
+                if self._live.get(key, (None, None))[1] == seq:
+                    del self._live[key]
+                    if self.journal is not None:
+                        self.journal.delete(key)
+                    task = asyncio.create_task(self._fire(key, deadline))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Telegram Bot API, for load tests.
+
+Answers the methods the moderator bots use, records every call with a
+timestamp, can add latency and can answer a fraction of calls with 429
+(retry_after). getUpdates serves updates queued with push_updates(), so the
+bots can also be driven through their normal long polling loop.
+
+Point telebot at it before importing a bot module:
+    apihelper.API_URL = server.api_url
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "moderator", "username": "moderator_bot"}
+
+# methods that are never throttled or delayed (bookkeeping, not moderation work)
+EXEMPT = frozenset(("getUpdates", "getMe", "setWebhook", "deleteWebhook"))
+
+
+class FakeBotApi:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, rate_429: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        # (monotonic time, method, params) of every answered call, 429s included
+        self.calls = []
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._updates = []
+        self._updates_cond = threading.Condition()
+        self._next_message_id = 10 ** 9
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def push_updates(self, updates):
+        """Queue update dicts for getUpdates."""
+        with self._updates_cond:
+            self._updates.extend(updates)
+            self._updates_cond.notify_all()
+
+    def calls_by_method(self) -> dict:
+        out = {}
+        with self._lock:
+            for _, method, _ in self.calls:
+                out[method] = out.get(method, 0) + 1
+        return out
+
+    # ---------- responses ----------
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + min(timeout, 1.0)
+        with self._updates_cond:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._updates_cond.wait(deadline - time.monotonic())
+            return self._updates[:int(params.get("limit") or 100)]
+
+    def _result(self, method: str, params: dict):
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "getMe":
+            return BOT_USER
+        if method == "getChatMember":
+            uid = int(params.get("user_id", 0))
+            status = "administrator" if uid == BOT_USER["id"] else "member"
+            return {"status": status, "user": {"id": uid, "is_bot": False, "first_name": f"user{uid}"}}
+        if method in ("sendMessage", "editMessageText"):
+            with self._lock:
+                self._next_message_id += 1
+                mid = self._next_message_id
+            chat_id = int(params.get("chat_id", 0))
+            return {"message_id": int(params.get("message_id", mid)), "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "supergroup"}, "from": BOT_USER,
+                    "text": params.get("text", "")}
+        return True
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                url = urlsplit(self.path)
+                method = url.path.rsplit("/", 1)[-1]
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    body = self.rfile.read(length).decode("utf-8", "replace")
+                    if self.headers.get("Content-Type", "").startswith("application/json"):
+                        params.update(json.loads(body))
+                    else:
+                        params.update(parse_qsl(body))
+                if method not in EXEMPT:
+                    if api.latency or api.jitter:
+                        time.sleep(api.latency + random.random() * api.jitter)
+                    if api.rate_429 and random.random() < api.rate_429:
+                        with api._lock:
+                            api.throttled += 1
+                            api.calls.append((time.monotonic(), method, params))
+                        return self._send(429, {"ok": False, "error_code": 429,
+                                                "description": f"Too Many Requests: retry after {api.retry_after}",
+                                                "parameters": {"retry_after": api.retry_after}})
+                result = api._result(method, params)
+                if method not in EXEMPT:
+                    with api._lock:
+                        api.calls.append((time.monotonic(), method, params))
+                self._send(200, {"ok": True, "result": result})
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def _send(self, code: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        return Handler
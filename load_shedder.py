@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Overload mode driven by the update backlog.
+
+A checker thread samples the dispatcher queue depth and lag every
+`interval` seconds. The shedder switches to overload when either crosses its
+enter threshold and back only after both have stayed under the (lower) exit
+thresholds for `calm_seconds`, so it does not flap around one value.
+
+While overloaded the bot keeps what stops a raid (counting, restricting,
+deleting) and sheds the rest: callers ask shed(kind) before optional work
+and skip it when it returns True. on_change(active, reason) lets the bot
+switch its own knobs (hold notifications, delete in bigger batches).
+
+Exported here: moderator_overload_entered_total by reason,
+moderator_overload_seconds_total and moderator_shed_total by kind of skipped
+work (the bot adds a moderator_overloaded gauge).
+"""
+import logging
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+OVERLOAD_ENTERED = metrics.counter("moderator_overload_entered_total", "Switches to overload mode", "reason")
+OVERLOAD_SECONDS = metrics.counter("moderator_overload_seconds_total", "Time spent in overload mode")
+SHED = metrics.counter("moderator_shed_total", "Optional work skipped in overload mode", "kind")
+
+
+class LoadShedder:
+    def __init__(self, depth, lag, enter_depth: int = 2000, exit_depth: int = 200, enter_lag: float = 5.0,
+                 exit_lag: float = 1.0, calm_seconds: float = 10.0, on_change=None):
+        """depth() -> queued updates, lag() -> seconds the oldest queued update waited."""
+        self.depth = depth
+        self.lag = lag
+        self.enter_depth = enter_depth
+        self.exit_depth = exit_depth
+        self.enter_lag = enter_lag
+        self.exit_lag = exit_lag
+        self.calm_seconds = calm_seconds
+        self.on_change = on_change
+        # read without a lock on the hot path
+        self.active = False
+        self.reason = None
+        self.since = None
+        self._calm_since = None
+        self._thread = None
+
+    def shed(self, kind: str) -> bool:
+        """True if optional work of this kind should be skipped now."""
+        if not self.active:
+            return False
+        SHED.inc(kind)
+        return True
+
+    def check(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        depth, lag = self.depth(), self.lag()
+        if not self.active:
+            if depth >= self.enter_depth:
+                reason = f"queue_depth={depth}"
+            elif lag >= self.enter_lag:
+                reason = f"lag={lag:.1f}s"
+            else:
+                return
+            self.active, self.reason, self.since, self._calm_since = True, reason, now, None
+            OVERLOAD_ENTERED.inc(reason.split("=")[0])
+            logger.warning("Overload mode on (%s): shedding optional work", reason)
+            self._notify(True, reason)
+            return
+        if depth > self.exit_depth or lag > self.exit_lag:
+            self._calm_since = None
+            return
+        if self._calm_since is None:
+            self._calm_since = now
+        elif now - self._calm_since >= self.calm_seconds:
+            duration = now - self.since
+            self.active = False
+            OVERLOAD_SECONDS.inc(n=duration)
+            logger.warning("Overload mode off after %.1f s (entered on %s)", duration, self.reason)
+            self._notify(False, self.reason)
+
+    def _notify(self, active: bool, reason: str):
+        if self.on_change is not None:
+            try:
+                self.on_change(active, reason)
+            except Exception:
+                logger.exception("Overload on_change callback failed")
+
+    def start(self, interval: float = 0.5):
+        def loop():
+            while True:
+                self.check()
+                time.sleep(interval)
+        self._thread = threading.Thread(target=loop, daemon=True, name="load-shedder")
+        self._thread.start()
+        return self._thread
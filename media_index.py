@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Repeated-media detection by file_unique_id, no downloads.
+
+Telegram gives every file a file_unique_id that is the same for everyone who
+sends it, so a sticker, photo or video reposted by a spam crew keeps its id.
+The index keeps, per (chat_id, file_unique_id), the last `capacity` sends
+inside `window` seconds and flags:
+- one user sending the same file more than `per_user_limit` times;
+- `min_users` distinct users sending the same file (not for kinds in
+  `shared_kinds`: everyone reuses the same popular stickers).
+
+Lookups are a dict access plus a scan of at most `capacity` events. Keys are
+LRU-bounded by `max_keys`.
+"""
+import threading
+from collections import OrderedDict, deque
+
+MEDIA_KINDS = ("photo", "video", "animation", "document", "sticker", "voice", "video_note", "audio")
+
+
+def media_unique_id(message):
+    """(kind, file_unique_id) of the message media, or None for text-only messages."""
+    for kind in MEDIA_KINDS:
+        obj = getattr(message, kind, None)
+        if not obj:
+            continue
+        if kind == "photo":
+            # all sizes of one photo have their own ids; the largest is the last
+            obj = obj[-1]
+        return kind, obj.file_unique_id
+    return None
+
+
+class _Sends:
+    __slots__ = ("events", "reported")
+
+    def __init__(self, capacity: int):
+        # (ts, user_id, message_id, name), oldest first
+        self.events = deque(maxlen=capacity)
+        # user_id -> ts when the user was last returned for this file
+        self.reported = {}
+
+
+class MediaIndex:
+    def __init__(self, window: float = 300, per_user_limit: int = 3, min_users: int = 5,
+                 capacity: int = 50, max_keys: int = 100000, shared_kinds=("sticker",)):
+        self.window = window
+        self.per_user_limit = per_user_limit
+        self.min_users = min_users
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.shared_kinds = frozenset(shared_kinds)
+        # (chat_id, file_unique_id) -> _Sends, least recently sent first
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, chat_id: int, user_id: int, message_id: int, message, ts: float, name: str = None):
+        """Record the media of a message.
+
+        Returns None, or {user_id: (name, [message_ids])} with the users that
+        crossed a limit for this file and were not returned within the window.
+        """
+        media = media_unique_id(message)
+        if media is None:
+            return None
+        kind, fuid = media
+        k = (chat_id, fuid)
+        horizon = ts - self.window
+        with self._lock:
+            sends = self._files.get(k)
+            if sends is None:
+                if len(self._files) >= self.max_keys:
+                    self._files.popitem(last=False)
+                sends = self._files[k] = _Sends(self.capacity)
+            else:
+                self._files.move_to_end(k)
+                while sends.events and sends.events[0][0] < horizon:
+                    sends.events.popleft()
+            sends.events.append((ts, user_id, message_id, name))
+
+            per_user = {}
+            for e in sends.events:
+                per_user.setdefault(e[1], []).append(e)
+            if len(per_user) >= self.min_users and kind not in self.shared_kinds:
+                flagged = per_user
+            elif len(per_user[user_id]) > self.per_user_limit:
+                flagged = {user_id: per_user[user_id]}
+            else:
+                return None
+            cluster = {}
+            for uid, events in flagged.items():
+                if sends.reported.get(uid, horizon - 1) >= horizon:
+                    continue
+                sends.reported[uid] = ts
+                cluster[uid] = (events[-1][3], [e[2] for e in events])
+            if len(sends.reported) > self.capacity:
+                sends.reported = {u: t for u, t in sends.reported.items() if t >= horizon}
+        return cluster or None
+
+    def evict_idle(self, now: float) -> int:
+        """Drop files not sent within the window; returns how many were dropped."""
+        horizon = now - self.window
+        dropped = 0
+        with self._lock:
+            # least recently sent first: stop at the first file still in the window
+            while self._files:
+                k, sends = next(iter(self._files.items()))
+                if sends.events and sends.events[-1][0] >= horizon:
+                    break
+                del self._files[k]
+                dropped += 1
+        return dropped
+
+    def __len__(self):
+        return len(self._files)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Directory of chat members seen in the update stream.
+
+Every message, join and button press carries a User, so the bot learns
+(chat_id, user_id) -> name / username / last seen for free. Commands and
+callbacks look names up here instead of calling get_chat_member, and
+"/mute @username" works without any Bot API call (the Bot API cannot
+resolve a user's @username at all). Entries are LRU-bounded by `maxsize`;
+a usernames index is kept in step.
+"""
+import threading
+from collections import OrderedDict
+
+
+class Member:
+    __slots__ = ("id", "first_name", "last_name", "username", "last_seen")
+
+    def __init__(self, user, ts: float):
+        self.id = user.id
+        self.first_name = user.first_name
+        self.last_name = user.last_name
+        self.username = user.username
+        self.last_seen = ts
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.first_name} {self.last_name}" if self.last_name else self.first_name
+
+    def same_names(self, user) -> bool:
+        return (self.first_name == user.first_name and self.last_name == user.last_name
+                and self.username == user.username)
+
+
+class MemberDirectory:
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        # (chat_id, user_id) -> Member, least recently seen first
+        self._members = OrderedDict()
+        # (chat_id, casefolded username) -> user_id
+        self._usernames = {}
+        self._lock = threading.Lock()
+
+    def _unindex(self, chat_id: int, member: Member):
+        if member.username:
+            k = (chat_id, member.username.casefold())
+            if self._usernames.get(k) == member.id:
+                del self._usernames[k]
+
+    def observe(self, chat_id: int, user, ts: float):
+        """Record a user seen in a chat; cheap when nothing but last_seen changed."""
+        if user is None or user.is_bot:
+            return
+        k = (chat_id, user.id)
+        with self._lock:
+            member = self._members.get(k)
+            if member is not None and member.same_names(user):
+                member.last_seen = ts
+                self._members.move_to_end(k)
+                return
+            if member is not None:
+                self._unindex(chat_id, member)
+            member = self._members[k] = Member(user, ts)
+            self._members.move_to_end(k)
+            if member.username:
+                self._usernames[(chat_id, member.username.casefold())] = member.id
+            while len(self._members) > self.maxsize:
+                (old_chat, _), old = self._members.popitem(last=False)
+                self._unindex(old_chat, old)
+
+    def get(self, chat_id: int, user_id: int):
+        with self._lock:
+            return self._members.get((chat_id, user_id))
+
+    def by_username(self, chat_id: int, username: str):
+        with self._lock:
+            user_id = self._usernames.get((chat_id, username.lstrip("@").casefold()))
+            return None if user_id is None else self._members.get((chat_id, user_id))
+
+    def resolve(self, chat_id: int, token: str):
+        """"@username" or a numeric user id -> Member seen in the chat, or None.
+
+        Raises ValueError when the token is neither.
+        """
+        if token.startswith("@"):
+            return self.by_username(chat_id, token)
+        return self.get(chat_id, int(token))
+
+    def name(self, chat_id: int, user_id: int, default: str = None) -> str:
+        member = self.get(chat_id, user_id)
+        if member is not None:
+            return member.full_name
+        return str(user_id) if default is None else default
+
+    def __len__(self):
+        return len(self._members)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+In-process metrics with a Prometheus text endpoint.
+
+Counters and histograms carry at most one label (e.g. the Bot API method).
+Gauges are callbacks evaluated at scrape time, so queue depths and store
+sizes cost nothing between scrapes.
+
+Metrics are disabled by default: inc()/observe() are bound to a no-op
+function, so instrumented hot paths pay one call. enable() rebinds them,
+serve() enables and starts the HTTP endpoint:
+    metrics.serve("127.0.0.1", 9102)   ->  GET /metrics
+"""
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+def _fmt(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def _labels(pairs) -> str:
+    pairs = [(k, v) for k, v in pairs if k]
+    if not pairs:
+        return ""
+    body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label: str = None, enabled: bool = False):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+        self._lock = threading.Lock()
+        self.bind(enabled)
+
+    def bind(self, enabled: bool):
+        self.inc = self._inc if enabled else _noop
+
+    def _inc(self, label_value="", n=1):
+        with self._lock:
+            self.values[label_value] = self.values.get(label_value, 0) + n
+
+    def render(self):
+        with self._lock:
+            items = sorted(self.values.items())
+        for lv, v in items:
+            yield f"{self.name}{_labels([(self.label, lv)])} {_fmt(v)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, label: str = None, buckets=DEFAULT_BUCKETS,
+                 enabled: bool = False):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        # label value -> [per-bucket counts (+Inf last), sum, count]
+        self.values = {}
+        self._lock = threading.Lock()
+        self.bind(enabled)
+
+    def bind(self, enabled: bool):
+        self.observe = self._observe if enabled else _noop
+
+    def _observe(self, value: float, label_value=""):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self.values.get(label_value)
+            if s is None:
+                s = self.values[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((lv, (list(s[0]), s[1], s[2])) for lv, s in self.values.items())
+        for lv, (counts, total, n) in items:
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                yield f"{self.name}_bucket{_labels([(self.label, lv), ('le', _fmt(le))])} {acc}"
+            yield f"{self.name}_sum{_labels([(self.label, lv)])} {_fmt(total)}"
+            yield f"{self.name}_count{_labels([(self.label, lv)])} {n}"
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def bind(self, enabled: bool):
+        pass
+
+    def render(self):
+        try:
+            v = self.fn()
+        except Exception:
+            logger.exception("Gauge %s failed", self.name)
+            return
+        yield f"{self.name} {_fmt(v)}"
+
+
+class Registry:
+    def __init__(self):
+        self.enabled = False
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label: str = None) -> Counter:
+        return self._add(Counter(name, help, label, self.enabled))
+
+    def histogram(self, name: str, help: str, label: str = None, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, label, buckets, self.enabled))
+
+    def gauge(self, name: str, help: str, fn) -> Gauge:
+        return self._add(Gauge(name, help, fn))
+
+    def enable(self, enabled: bool = True):
+        with self._lock:
+            self.enabled = enabled
+            for m in self.metrics.values():
+                m.bind(enabled)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host: str = "127.0.0.1", port: int = 9102):
+        """Enable metrics and serve them on http://host:port/metrics in a daemon thread."""
+        self.enable()
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                data = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, fmt, *args):
+                logger.debug("metrics: " + fmt, *args)
+
+        httpd = ThreadingHTTPServer((host, port), Handler)
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        logger.info("Metrics on http://%s:%s/metrics", *httpd.server_address[:2])
+        return httpd
+
+
+registry = Registry()
+counter = registry.counter
+histogram = registry.histogram
+gauge = registry.gauge
+enable = registry.enable
+serve = registry.serve
+
+# shared by transport.py and dispatcher.py
+API_LATENCY = histogram("telegram_api_request_seconds", "Bot API HTTP request latency", "method")
+API_ERRORS = counter("telegram_api_errors_total", "Bot API requests that failed (connection, 4xx, 5xx)", "method")
+API_FLOOD_WAITS = counter("telegram_api_429_total", "Bot API requests answered with 429", "method")
+UPDATE_LATENCY = histogram("moderator_update_seconds", "Time spent handling one update", "type")
+UPDATE_ERRORS = counter("moderator_update_errors_total", "Updates whose handler raised", "type")
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the sync and async editions of the spam moderator bot.
+No Bot API calls and no import side effects.
+"""
+import re
+import time
+
+from telebot import types
+
+duration_re = re.compile(r'(\d+)([smhdM])')  # s,m,h,d,M(months)
+
+MUTE_PERMISSIONS = types.ChatPermissions(
+    can_send_messages=False,
+    can_send_media_messages=False,
+    can_send_polls=False,
+    can_send_other_messages=False,
+    can_add_web_page_previews=False
+)
+
+UNMUTE_PERMISSIONS = types.ChatPermissions(
+    can_send_messages=True,
+    can_send_media_messages=True,
+    can_send_polls=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True
+)
+
+
+def parse_duration(s: str) -> int:
+    s = (s or "").strip()
+    if not s:
+        raise ValueError("Empty duration")
+    total = 0
+    pos = 0
+    for m in duration_re.finditer(s):
+        if m.start() != pos:
+            raise ValueError("Bad duration format near: " + s[pos:m.start()+1])
+        v = int(m.group(1)); u = m.group(2)
+        if u == 's': total += v
+        elif u == 'm': total += v * 60
+        elif u == 'h': total += v * 3600
+        elif u == 'd': total += v * 86400
+        elif u == 'M': total += v * 30 * 86400
+        pos = m.end()
+    if pos != len(s):
+        raise ValueError("Bad duration format")
+    if total <= 0:
+        raise ValueError("Duration must be > 0")
+    return total
+
+
+def format_duration(seconds) -> str:
+    seconds = int(seconds)
+    parts = []
+    for unit, size in (("д", 86400), ("ч", 3600), ("мин", 60), ("с", 1)):
+        v, seconds = divmod(seconds, size)
+        if v:
+            parts.append(f"{v} {unit}")
+    return " ".join(parts) or "0 с"
+
+
+def extract_args(text: str):
+    if not text:
+        return []
+    parts = text.strip().split(maxsplit=2)
+    return parts[1:] if len(parts) > 1 else []
+
+
+def parse_purge_args(tokens):
+    """/purge arguments -> (target, last, since_seconds).
+
+    target is the "@username" / user_id token or None; "last N" limits the
+    purge to the N newest messages, "since 10m" to a period (parse_duration
+    format). Raises ValueError on anything else.
+    """
+    target = last = since = None
+    i = 0
+    while i < len(tokens):
+        word = tokens[i].lower()
+        if word in ("last", "since") and i + 1 < len(tokens):
+            if word == "last":
+                if not tokens[i + 1].isdigit() or int(tokens[i + 1]) <= 0:
+                    raise ValueError("last: нужно число больше нуля")
+                last = int(tokens[i + 1])
+            else:
+                since = parse_duration(tokens[i + 1])
+            i += 2
+            continue
+        if target is not None or not (word.startswith("@") or word.lstrip("-").isdigit()):
+            raise ValueError(f"непонятный аргумент: {tokens[i]}")
+        target = tokens[i]
+        i += 1
+    return target, last, since
+
+
+def escape_html(s: str) -> str:
+    if s is None:
+        return ""
+    return (s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;"))
+
+
+# callback_data: short form "U:<id>" or "B:<id>" to keep it small
+def build_mute_keyboard(target_user_id: int):
+    kb = types.InlineKeyboardMarkup()
+    kb.add(types.InlineKeyboardButton("Размутить", callback_data=f"U:{target_user_id}"))
+    kb.add(types.InlineKeyboardButton("Бан", callback_data=f"B:{target_user_id}"))
+    return kb
+
+
+def build_mute_summary(entries, unmute_data: str, ban_data: str):
+    """Text and keyboard of a summary of auto-muted users (notifications.Entry list).
+
+    unmute_data / ban_data: callback_data templates with {user_id}. Users
+    already handled keep their line but lose their buttons.
+    """
+    kb = types.InlineKeyboardMarkup()
+    lines = []
+    for e in entries:
+        name = e.name or str(e.user_id)
+        mention = f"<a href='tg://user?id={e.user_id}'>{escape_html(name[:32])}</a>"
+        if e.status:
+            lines.append(f"• {mention} — {e.status}")
+            continue
+        lines.append(f"• {mention} {e.reason}")
+        kb.row(types.InlineKeyboardButton(f"🔊 {name[:16]}", callback_data=unmute_data.format(user_id=e.user_id)),
+               types.InlineKeyboardButton(f"⛔ {name[:16]}", callback_data=ban_data.format(user_id=e.user_id)))
+    title = "Автоматически замучен" if len(entries) == 1 else f"Автоматически замучены ({len(entries)})"
+    return f"{title}:\n" + "\n".join(lines), kb
+
+
+ACTION_LABELS = {"auto_mute": "автомут", "mute": "мут", "unmute": "размут", "ban": "бан", "unban": "разбан",
+                 "delete": "удалено", "purge": "очистка", "lockdown": "ограничен (рейд)"}
+
+
+def format_modlog(records, name) -> str:
+    """Lines of /modlog for audit.AuditRecord list; name(user_id) -> display name."""
+    lines = []
+    for r in records:
+        line = (f"{time.strftime('%d.%m %H:%M', time.localtime(r.ts))} {ACTION_LABELS.get(r.action, r.action)} "
+                f"{name(r.user_id) if r.user_id else 'чат'} ({'бот' if r.actor_id is None else name(r.actor_id)})")
+        if r.until:
+            line += f" до {time.strftime('%d.%m %H:%M', time.localtime(r.until))}"
+        if r.reason:
+            line += f": {r.reason}"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Coalesced auto-mute notifications.
+
+Instead of one message per muted user, mute events of a chat are buffered
+for `delay` seconds and posted as one summary message listing the users,
+with compact per-user buttons. Users caught later are added to the same
+message by editing it in place, until it holds `max_users` users or has not
+changed for `window` seconds; then the next event starts a new summary.
+
+The bot supplies three callables:
+    render(chat_id, entries) -> (text, reply_markup)
+    send(chat_id, text, reply_markup) -> Future of the sent Message
+    edit(chat_id, message_id, text, reply_markup) -> Future
+A button press on a summary goes through resolve(), which marks the user as
+handled and re-renders the message instead of replacing it. hold(True)
+(overload mode) keeps collecting users but sends and edits nothing until
+hold(False).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class Entry:
+    __slots__ = ("user_id", "name", "reason", "status")
+
+    def __init__(self, user_id: int, name: str, reason: str):
+        self.user_id = user_id
+        self.name = name
+        self.reason = reason
+        # None while muted; set by resolve() ("размучен", "забанен")
+        self.status = None
+
+
+class _Summary:
+    __slots__ = ("chat_id", "entries", "message_id", "sending", "due", "updated")
+
+    def __init__(self, chat_id: int, now: float):
+        self.chat_id = chat_id
+        self.entries = []
+        self.message_id = None
+        # send in flight: edits wait for the message id
+        self.sending = False
+        # when the next send/edit is due, None if nothing changed
+        self.due = None
+        self.updated = now
+
+
+class NotificationAggregator:
+    def __init__(self, render, send, edit, delay: float = 2.0, window: float = 60.0,
+                 max_users: int = 20, max_summaries: int = 1000):
+        self.render = render
+        self.send = send
+        self.edit = edit
+        self.delay = delay
+        self.window = window
+        self.max_users = max_users
+        self.max_summaries = max_summaries
+        # chat_id -> summary that still takes new users
+        self._open = {}
+        # (chat_id, message_id) -> posted summary, for button presses; oldest first
+        self._posted = OrderedDict()
+        # summaries with a send/edit due
+        self._dirty = set()
+        self.held = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def add(self, chat_id: int, user_id: int, name: str, reason: str):
+        now = time.monotonic()
+        with self._cond:
+            s = self._open.get(chat_id)
+            if (s is None or len(s.entries) >= self.max_users
+                    or (s.due is None and not s.sending and now - s.updated > self.window)):
+                s = self._open[chat_id] = _Summary(chat_id, now)
+            for e in s.entries:
+                if e.user_id == user_id and e.status is None:
+                    return
+            s.entries.append(Entry(user_id, name, reason))
+            s.updated = now
+            if s.due is None:
+                s.due = now + self.delay
+                self._dirty.add(s)
+                self._cond.notify()
+
+    def resolve(self, chat_id: int, message_id: int, user_id: int, status: str) -> bool:
+        """Mark a user of a summary message as handled; False if the message is not a summary."""
+        with self._cond:
+            s = self._posted.get((chat_id, message_id))
+            if s is None:
+                return False
+            for e in s.entries:
+                if e.user_id == user_id:
+                    e.status = status
+            if s.due is None:
+                s.due = time.monotonic()
+                self._dirty.add(s)
+                self._cond.notify()
+        return True
+
+    def hold(self, held: bool):
+        with self._cond:
+            self.held = held
+            self._cond.notify()
+
+    def pending(self) -> int:
+        """Summaries waiting to be sent or edited."""
+        with self._cond:
+            return len(self._dirty)
+
+    def _flush(self, s: _Summary):
+        # called with self._cond held
+        text, markup = self.render(s.chat_id, s.entries)
+        s.due = None
+        self._dirty.discard(s)
+        if s.message_id is None:
+            s.sending = True
+            fut = self.send(s.chat_id, text, markup)
+            fut.add_done_callback(lambda f: self._sent(s, f))
+        else:
+            fut = self.edit(s.chat_id, s.message_id, text, markup)
+            fut.add_done_callback(lambda f: self._edited(s, f))
+
+    def _sent(self, s: _Summary, fut):
+        e = fut.exception()
+        with self._cond:
+            s.sending = False
+            if e is not None:
+                logger.warning("Summary for chat %s not sent: %s", s.chat_id, e)
+                if self._open.get(s.chat_id) is s:
+                    del self._open[s.chat_id]
+                return
+            s.message_id = fut.result().message_id
+            self._posted[(s.chat_id, s.message_id)] = s
+            while len(self._posted) > self.max_summaries:
+                self._posted.popitem(last=False)
+            if s.due is not None:
+                # users added while the message was being sent
+                self._cond.notify()
+
+    def _edited(self, s: _Summary, fut):
+        e = fut.exception()
+        if e is not None and "message is not modified" not in str(e):
+            logger.warning("Summary %s in chat %s not edited: %s", s.message_id, s.chat_id, e)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self.held:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                wait = None
+                for s in list(self._dirty):
+                    if s.sending:
+                        continue
+                    if s.due <= now:
+                        self._flush(s)
+                    else:
+                        wait = s.due - now if wait is None else min(wait, s.due - now)
+                # drop summaries that stopped taking users
+                for chat_id, s in list(self._open.items()):
+                    if s.due is None and not s.sending and now - s.updated > self.window:
+                        del self._open[chat_id]
+                self._cond.wait(wait if wait is not None else self.window)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="notifications")
+        self._thread.start()
+        return self
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Central outbound Bot API scheduler.
+
+Every call is submitted with a priority class and a chat id and returns a
+concurrent.futures.Future. A dispatcher thread hands calls to a small worker
+pool in priority order (restrict/ban, then delete, then notify/edit) while
+respecting a global token bucket (~30 req/s) and, for messages sent to a chat,
+a per-chat bucket (~20 msg/min per group).
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PRIO_RESTRICT = 0  # restrict / ban / unrestrict
+PRIO_DELETE = 1    # deleteMessage(s)
+PRIO_NOTIFY = 2    # sendMessage / editMessageText / answers
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Seconds until one token is available (0 if it is available now)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class OutboundScheduler:
+    def __init__(self, global_rate: float = 30, chat_rate: float = 20 / 60,
+                 chat_burst: float = 5, workers: int = 8, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chats = max_chats
+        # chat_id -> TokenBucket, only for PRIO_NOTIFY calls
+        self._chat_buckets = {}
+        # (priority, seq, chat_id, fn, args, kwargs, future)
+        self._queue = []
+        # (ready_at, seq, item) - notifications waiting for their chat bucket
+        self._parked = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbound")
+        self._thread = None
+
+    def submit(self, priority: int, chat_id: int, fn, /, *args, **kwargs) -> Future:
+        fut = Future()
+        with self._cond:
+            heapq.heappush(self._queue, (priority, next(self._seq), chat_id, fn, args, kwargs, fut))
+            self._cond.notify()
+        return fut
+
+    def call(self, priority: int, chat_id: int, fn, /, *args, **kwargs):
+        """Submit and wait for the result (for rare admin commands)."""
+        return self.submit(priority, chat_id, fn, *args, **kwargs).result()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._queue) + len(self._parked)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        b = self._chat_buckets.get(chat_id)
+        if b is None:
+            if len(self._chat_buckets) >= self.max_chats:
+                # drop refilled (idle) buckets, they carry no state
+                now = time.monotonic()
+                idle = [c for c, bk in self._chat_buckets.items()
+                        if bk.delay(now) == 0 and bk.tokens >= bk.capacity]
+                for cid in idle:
+                    del self._chat_buckets[cid]
+            b = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return b
+
+    def _next_item(self):
+        """Block until an item may be sent now; called with self._cond held."""
+        while True:
+            now = time.monotonic()
+            while self._parked and self._parked[0][0] <= now:
+                heapq.heappush(self._queue, heapq.heappop(self._parked)[2])
+            wait = None
+            if self._queue:
+                wait = self.global_bucket.delay(now)
+                if wait == 0:
+                    item = heapq.heappop(self._queue)
+                    if item[0] >= PRIO_NOTIFY:
+                        bucket = self._chat_bucket(item[2])
+                        chat_wait = bucket.delay(now)
+                        if chat_wait > 0:
+                            heapq.heappush(self._parked, (now + chat_wait, item[1], item))
+                            continue
+                        bucket.take()
+                    self.global_bucket.take()
+                    return item
+            if self._parked:
+                park_wait = self._parked[0][0] - now
+                wait = park_wait if wait is None else min(wait, park_wait)
+            self._cond.wait(wait)
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                item = self._next_item()
+            self._pool.submit(self._run, item)
+
+    @staticmethod
+    def _run(item):
+        _, _, _, fn, args, kwargs, fut = item
+        if not fut.set_running_or_notify_cancel():
+            return
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            fut.set_exception(e)
+
+
+def log_errors(what: str):
+    """Done-callback that logs a failed call instead of losing it silently."""
+    def callback(fut: Future):
+        e = fut.exception()
+        if e is not None:
+            logger.warning("%s failed: %s", what, e)
+    return callback
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Durable mute state in SQLite (WAL mode).
+
+Handlers never touch the database: put()/delete() only enqueue a change, and
+a writer thread applies queued changes in one transaction per batch. On start
+load() reads every mute back with a single query and restore() hands them to
+an ExpiryScheduler: running mutes keep their deadline, mutes that expired
+while the bot was down are spread out over `spread` seconds so that the
+unrestrict calls don't arrive all at once.
+
+Sliding windows are not persisted: they only cover the last few seconds, so
+after a restart they refill from new traffic almost immediately.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mutes (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    until   REAL    NOT NULL,
+    PRIMARY KEY (chat_id, user_id)
+) WITHOUT ROWID
+"""
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class MuteStore:
+    def __init__(self, path: str, batch_size: int = 500, flush_interval: float = 0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        conn = connect(path)
+        try:
+            conn.execute(SCHEMA)
+        finally:
+            conn.close()
+
+    # --- hot path: called by ExpiryScheduler, only enqueue ---
+    def put(self, key, until: float):
+        self._queue.put((key[0], key[1], until))
+
+    def delete(self, key):
+        self._queue.put((key[0], key[1], None))
+
+    # --- startup ---
+    def load(self):
+        conn = connect(self.path)
+        try:
+            return conn.execute("SELECT chat_id, user_id, until FROM mutes").fetchall()
+        finally:
+            conn.close()
+
+    def restore(self, scheduler, spread: float = 60.0, now: float = None) -> tuple:
+        """Reschedule stored mutes; returns (active, expired) counts."""
+        t0 = time.perf_counter()
+        now = time.time() if now is None else now
+        rows = self.load()
+        expired = [(c, u) for c, u, until in rows if until <= now]
+        for c, u, until in rows:
+            if until > now:
+                scheduler.schedule((c, u), until)
+        step = spread / len(expired) if expired else 0
+        for i, k in enumerate(expired):
+            scheduler.schedule(k, now + i * step)
+        logger.info("Restored %d active and %d expired mutes in %.1f ms",
+                    len(rows) - len(expired), len(expired), (time.perf_counter() - t0) * 1000)
+        return len(rows) - len(expired), len(expired)
+
+    # --- writer ---
+    def start(self):
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def _drain(self):
+        # last write per key wins, so a burst of updates becomes one row change
+        changes = {}
+        try:
+            while len(changes) < self.batch_size:
+                c, u, until = self._queue.get_nowait()
+                changes[(c, u)] = until
+        except queue.Empty:
+            pass
+        return changes
+
+    def _writer(self):
+        conn = connect(self.path)
+        while True:
+            c, u, until = self._queue.get()
+            changes = {(c, u): until}
+            changes.update(self._drain())
+            puts = [(c, u, until) for (c, u), until in changes.items() if until is not None]
+            dels = [(c, u) for (c, u), until in changes.items() if until is None]
+            try:
+                with conn:
+                    if puts:
+                        conn.executemany("INSERT OR REPLACE INTO mutes (chat_id, user_id, until) VALUES (?, ?, ?)", puts)
+                    if dels:
+                        conn.executemany("DELETE FROM mutes WHERE chat_id = ? AND user_id = ?", dels)
+            except sqlite3.Error:
+                logger.exception("Failed to persist %d mute changes", len(changes))
+            if len(changes) < self.batch_size:
+                # queue drained: wait a bit so the next batch collects more changes
+                time.sleep(self.flush_interval)
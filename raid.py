@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Chat-wide raid detection.
+
+Per chat, three sliding-window counters: joins, first messages of users who
+joined recently, and all messages. Each counter is a ring of `buckets` time
+buckets (array-backed, O(1) add, O(buckets) sum), no per-event lists.
+
+When any counter crosses its limit the chat enters lockdown. The caller
+applies stricter per-user limits and restricts new joiners while
+in_lockdown() is true. The lockdown ends once every counter has stayed below
+half of its limit for `cooldown` seconds; tick() checks that and
+on_change(chat_id, active, reason) reports both transitions. Users who
+joined during a lockdown are kept so the caller can release them when it
+ends.
+
+At most `max_chats` chats are tracked. A new chat evicts the least recently
+active chat that is not in lockdown; when every chat is in lockdown the
+least recently active lockdown is ended early (reported through on_change
+like a normal end, its joiners handed to take_restricted()).
+"""
+import threading
+from array import array
+from collections import OrderedDict
+
+
+class BucketCounter:
+    __slots__ = ("width", "counts", "stamps")
+
+    def __init__(self, window: float, buckets: int = 12):
+        self.width = window / buckets
+        self.counts = array("l", [0] * buckets)
+        # absolute bucket number each slot currently holds
+        self.stamps = array("q", [-1] * buckets)
+
+    def add(self, ts: float, n: int = 1):
+        b = int(ts // self.width)
+        i = b % len(self.counts)
+        if self.stamps[i] != b:
+            self.stamps[i] = b
+            self.counts[i] = 0
+        self.counts[i] += n
+
+    def total(self, ts: float) -> int:
+        oldest = int(ts // self.width) - len(self.counts) + 1
+        return sum(c for c, s in zip(self.counts, self.stamps) if s >= oldest)
+
+
+class _ChatRaid:
+    __slots__ = ("joins", "new_msgs", "msgs", "recent_joiners", "lockdown_since", "calm_since",
+                 "reason", "restricted")
+
+    def __init__(self, window: float, buckets: int):
+        self.joins = BucketCounter(window, buckets)
+        self.new_msgs = BucketCounter(window, buckets)
+        self.msgs = BucketCounter(window, buckets)
+        # user_id -> join ts, oldest first; a user's first message pops it
+        self.recent_joiners = OrderedDict()
+        self.lockdown_since = None
+        self.calm_since = None
+        self.reason = None
+        # users restricted on join during the current lockdown
+        self.restricted = []
+
+
+class RaidDetector:
+    def __init__(self, window: float = 60, buckets: int = 12, join_limit: int = 20,
+                 new_msg_limit: int = 10, msg_limit: int = 300, new_user_seconds: float = 600,
+                 cooldown: float = 300, max_joiners: int = 5000, max_chats: int = 10000,
+                 on_change=None):
+        self.window = window
+        self.buckets = buckets
+        self.limits = {"joins": join_limit, "new_msgs": new_msg_limit, "msgs": msg_limit}
+        self.new_user_seconds = new_user_seconds
+        self.cooldown = cooldown
+        self.max_joiners = max_joiners
+        self.max_chats = max_chats
+        self.on_change = on_change
+        # chat_id -> _ChatRaid, least recently active first
+        self._chats = OrderedDict()
+        # lockdowns ended by eviction: (chat_id, reason) to report, chat_id -> restricted joiners
+        self._ended = []
+        self._released = {}
+        self._lock = threading.Lock()
+
+    def _chat(self, chat_id: int) -> _ChatRaid:
+        st = self._chats.get(chat_id)
+        if st is None:
+            if len(self._chats) >= self.max_chats:
+                self._evict()
+            st = self._chats[chat_id] = _ChatRaid(self.window, self.buckets)
+        else:
+            self._chats.move_to_end(chat_id)
+        return st
+
+    def _evict(self):
+        for c, old in self._chats.items():
+            if old.lockdown_since is None:
+                del self._chats[c]
+                return
+        # every chat is in lockdown: end the least recently active one
+        c, old = self._chats.popitem(last=False)
+        self._ended.append((c, old.reason))
+        if old.restricted and self.on_change is not None:
+            self._released[c] = old.restricted
+
+    def _take_ended(self) -> list:
+        """Lockdowns ended by eviction, to report once the lock is released."""
+        ended, self._ended = self._ended, []
+        return ended
+
+    def _check(self, chat_id: int, st: _ChatRaid, ts: float):
+        """Returns (active, reason) when the lockdown state changed, else None."""
+        totals = {name: getattr(st, name).total(ts) for name in self.limits}
+        if st.lockdown_since is None:
+            for name, limit in self.limits.items():
+                if totals[name] >= limit:
+                    st.lockdown_since = ts
+                    st.calm_since = None
+                    st.reason = f"{name}={totals[name]}/{self.window:g}s"
+                    return True, st.reason
+            return None
+        if all(totals[name] < limit / 2 for name, limit in self.limits.items()):
+            if st.calm_since is None:
+                st.calm_since = ts
+            elif ts - st.calm_since >= self.cooldown:
+                st.lockdown_since = None
+                st.calm_since = None
+                return False, st.reason
+        else:
+            st.calm_since = None
+        return None
+
+    def _notify(self, chat_id: int, change, ended=()):
+        for c, reason in ended:
+            self._notify(c, (False, reason))
+        if change is not None and self.on_change is not None:
+            self.on_change(chat_id, *change)
+
+    def on_join(self, chat_id: int, user_id: int, ts: float) -> bool:
+        """Count a join; returns True if the chat is in lockdown.
+
+        The caller should then restrict the joiner; the user is remembered
+        and returned by take_restricted() once the lockdown is over.
+        """
+        with self._lock:
+            st = self._chat(chat_id)
+            st.joins.add(ts)
+            st.recent_joiners[user_id] = ts
+            st.recent_joiners.move_to_end(user_id)
+            joiners = st.recent_joiners
+            while joiners and (len(joiners) > self.max_joiners
+                               or next(iter(joiners.values())) < ts - self.new_user_seconds):
+                joiners.popitem(last=False)
+            change = self._check(chat_id, st, ts)
+            locked = st.lockdown_since is not None
+            if locked:
+                st.restricted.append(user_id)
+            ended = self._take_ended()
+        self._notify(chat_id, change, ended)
+        return locked
+
+    def on_message(self, chat_id: int, user_id: int, ts: float) -> bool:
+        """Count a message; returns True if the chat is in lockdown."""
+        with self._lock:
+            st = self._chat(chat_id)
+            st.msgs.add(ts)
+            joined = st.recent_joiners.pop(user_id, None)
+            if joined is not None and ts - joined <= self.new_user_seconds:
+                st.new_msgs.add(ts)
+            change = self._check(chat_id, st, ts)
+            locked = st.lockdown_since is not None
+            ended = self._take_ended()
+        self._notify(chat_id, change, ended)
+        return locked
+
+    def in_lockdown(self, chat_id: int) -> bool:
+        st = self._chats.get(chat_id)
+        return st is not None and st.lockdown_since is not None
+
+    def take_restricted(self, chat_id: int) -> list:
+        """Joiners restricted by the lockdown that has just ended."""
+        with self._lock:
+            st = self._chats.get(chat_id)
+            if st is None:
+                return self._released.pop(chat_id, [])
+            users, st.restricted = st.restricted, []
+            return users
+
+    def tick(self, now: float):
+        """End lockdowns of chats that have calmed down; call every few seconds."""
+        changes = []
+        with self._lock:
+            for chat_id, st in self._chats.items():
+                if st.lockdown_since is not None:
+                    change = self._check(chat_id, st, now)
+                    if change is not None:
+                        changes.append((chat_id, change))
+        for chat_id, change in changes:
+            self._notify(chat_id, change)
+
+    def lockdowns(self) -> int:
+        with self._lock:
+            return sum(1 for st in self._chats.values() if st.lockdown_since is not None)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Recorder of incoming messages for offline rule replay (replay.py).
+
+record() only enqueues the message; a writer thread reduces it to ids,
+timestamp, sender and content hashes and appends one JSON line per message
+to an hourly gzip file in `directory` (updates-YYYYMMDD-HH-<pid>.jsonl.gz).
+No text is written. Every process writes its own files, so a restarted bot
+never appends to a gzip stream a killed one left unfinished. A file is closed
+when the hour changes and by stop() (registered with atexit); every batch is
+flushed, so a crash loses at most the last batch and leaves a truncated file
+that replay.py reads up to the damage.
+
+Line fields (empty ones are left out):
+    t   timestamp the bot saw the message at
+    c   chat_id          u   user_id          m   message_id
+    f   SimHash of the text (content_index.simhash), n  its token count
+    w   hashes of the blocklist-normalized words, in order
+    h   hashes of linked hosts and their parent domains
+    i   1 if the message links an invite
+    b   kind of the live blocklist verdict ("term", "domain", "invite link")
+Word and host hashes are 32-bit blake2b (word_hash), stable across processes.
+They keep texts out of the files, but they are not encryption: a guessed word
+can be checked against them.
+"""
+import gzip
+import hashlib
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from blocklist import extract_urls, is_invite, normalize as normalize_text, url_host
+from content_index import normalize as tokenize, simhash
+
+logger = logging.getLogger(__name__)
+
+MAX_WORDS = 256  # words per message kept for blocklist replay
+
+
+def word_hash(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+def host_hashes(host: str) -> list:
+    """Hashes of the host and each parent domain, as Blocklist.match walks them."""
+    out = []
+    while host:
+        out.append(word_hash(host))
+        host = host.partition(".")[2]
+    return out
+
+
+def encode(ts: float, chat_id: int, user_id: int, message_id: int, text: str, entities, blocked: str) -> dict:
+    rec = {"t": round(ts, 3), "c": chat_id, "u": user_id, "m": message_id}
+    if text:
+        tokens = tokenize(text)
+        if tokens:
+            rec["f"] = simhash(tokens)
+            rec["n"] = len(tokens)
+        words = normalize_text(text).split()[:MAX_WORDS]
+        if words:
+            rec["w"] = [word_hash(w) for w in words]
+    hosts = []
+    for url in extract_urls(text, entities):
+        if is_invite(url):
+            rec["i"] = 1
+        hosts.extend(host_hashes(url_host(url)))
+    if hosts:
+        rec["h"] = hosts
+    if blocked:
+        rec["b"] = blocked.split(":")[0]
+    return rec
+
+
+class UpdateRecorder:
+    def __init__(self, directory: str, batch_size: int = 1000, flush_interval: float = 1.0):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._file = self._path = None
+        os.makedirs(directory, exist_ok=True)
+
+    # --- hot path: only enqueue ---
+    def record(self, message, ts: float, blocked: str = None):
+        self._queue.put((ts, message.chat.id, message.from_user.id, message.message_id,
+                         message.text or message.caption, message.entities or message.caption_entities, blocked))
+
+    # --- writer ---
+    def start(self):
+        self._thread = threading.Thread(target=self._writer, daemon=True, name="recorder")
+        self._thread.start()
+        atexit.register(self.stop)
+        return self._thread
+
+    def stop(self, timeout: float = 10.0):
+        """Let the writer write what is queued and close the file; later records are dropped."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def path_for(self, ts: float) -> str:
+        hour = time.strftime("%Y%m%d-%H", time.gmtime(ts))
+        return os.path.join(self.directory, f"updates-{hour}-{os.getpid()}.jsonl.gz")
+
+    def _close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                logger.exception("Failed to close %s", self._path)
+        self._file = self._path = None
+
+    def _write(self, batch: list):
+        if not batch:
+            return
+        try:
+            for item in batch:
+                p = self.path_for(item[0])
+                if p != self._path:
+                    self._close()
+                    self._file, self._path = gzip.open(p, "at", encoding="utf-8"), p
+                self._file.write(json.dumps(encode(*item), ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._file.flush()
+            self.recorded += len(batch)
+        except Exception:
+            logger.exception("Failed to record %d messages", len(batch))
+            # reopen the file with the next batch
+            self._close()
+
+    def _drain(self, first) -> list:
+        batch = [first]
+        try:
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _writer(self):
+        while True:
+            batch = self._drain(self._queue.get())
+            if None in batch:
+                # stop(): everything queued before it is written
+                self._write(batch[:batch.index(None)])
+                self._close()
+                return
+            self._write(batch)
+            if len(batch) < self.batch_size:
+                time.sleep(self.flush_interval)
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+Offline replay of recorded messages (recorder.py) against candidate rules.
+
+Loads the recorder's hourly files (one per hour and process) into NumPy columns and evaluates, without
+contacting Telegram, who would have been muted by the per-user rate rule and
+the near-duplicate rule, and which messages a candidate blocklist would have
+deleted, for every combination of the given settings:
+
+    python3 replay.py recordings/ --spam-limit 6 8 10
+    python3 replay.py recordings/ --window 10 30 --dup-distance 0 8 --list
+    python3 replay.py recordings/ --block "казино" --block-domain scam.example --block-invites
+
+Every rule is a handful of array operations over all messages at once:
+- rate: messages are sorted by (chat, user, time); searchsorted on a key
+  that keeps users apart gives the count inside the window for each message;
+- duplicates: inside the LSH buckets of content_index each message is
+  linked to a few messages before it that are near and inside the window;
+  linked fingerprints form clusters (a chain of near texts is one cluster,
+  where the bot compares each text with its direct neighbours only), and a
+  sliding window per cluster counts distinct users;
+- blocklist: every spelling of a term (blocklist.term_variants) is matched
+  as a whole-word sequence of the recorded word hashes (the bot matches any
+  substring), domains by host and parent-domain hashes.
+Messages deleted by the live or the candidate blocklist are not counted, as
+in the bot. Per-chat overrides, raid lockdown, adaptive limits and index
+size caps are not replayed.
+
+A parsed .jsonl.gz is cached next to it as a columnar .npz and reused until
+the source changes, so repeated runs over days of history load in seconds.
+Needs numpy (pip install numpy); the bots do not.
+"""
+import argparse
+import glob
+import gzip
+import itertools
+import json
+import os
+import sys
+import time
+import zlib
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from blocklist import MIN_TERM_LENGTH, normalize, normalize_domain, term_variants
+from recorder import word_hash
+
+HASH_BITS = 64
+BLOCKED_KINDS = {"term": 1, "domain": 2, "invite link": 3}
+COLUMNS = ("t", "c", "u", "m", "f", "n", "i", "b", "w", "w_off", "h", "h_off")
+
+
+class Messages:
+    """Recorded messages as columns; w/h are flat hash arrays, w_off/h_off their per-message offsets."""
+
+    def __init__(self, **cols):
+        for k in COLUMNS:
+            setattr(self, k, cols[k])
+
+    def __len__(self):
+        return len(self.t)
+
+    @staticmethod
+    def concat(parts):
+        cols = {}
+        for k in ("t", "c", "u", "m", "f", "n", "i", "b", "w", "h"):
+            cols[k] = np.concatenate([getattr(p, k) for p in parts])
+        for k, flat in (("w_off", "w"), ("h_off", "h")):
+            offs, base = [np.zeros(1, np.int64)], 0
+            for p in parts:
+                offs.append(getattr(p, k)[1:] + base)
+                base += len(getattr(p, flat))
+            cols[k] = np.concatenate(offs)
+        return Messages(**cols)
+
+    def owners(self, offsets):
+        """Message index of every element of a flat hash array."""
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(offsets))
+
+    def select(self, idx):
+        """Messages at idx (index array in any order, or boolean mask), flat arrays included."""
+        idx = np.flatnonzero(idx) if idx.dtype == bool else idx
+        cols = {k: getattr(self, k)[idx] for k in ("t", "c", "u", "m", "f", "n", "i", "b")}
+        for k, flat in (("w_off", "w"), ("h_off", "h")):
+            offs = getattr(self, k)
+            lens = np.diff(offs)[idx]
+            new_offs = np.concatenate([np.zeros(1, np.int64), np.cumsum(lens)])
+            # position in the old flat array of every element of the new one
+            pos = np.arange(new_offs[-1]) + np.repeat(offs[:-1][idx] - new_offs[:-1], lens)
+            cols[flat] = getattr(self, flat)[pos]
+            cols[k] = new_offs
+        return Messages(**cols)
+
+
+def parse(path: str) -> Messages:
+    t, c, u, m, f, n, inv, b, w, h = ([] for _ in range(10))
+    w_off, h_off = [0], [0]
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    continue   # torn last line
+                t.append(r["t"]); c.append(r["c"]); u.append(r["u"]); m.append(r["m"])
+                f.append(r.get("f", 0)); n.append(r.get("n", 0)); inv.append(r.get("i", 0))
+                b.append(BLOCKED_KINDS.get(r.get("b"), 0))
+                w.extend(r.get("w", ())); w_off.append(len(w))
+                h.extend(r.get("h", ())); h_off.append(len(h))
+    except (EOFError, OSError, zlib.error) as e:
+        # the recorder is still writing or was killed mid-batch: keep what was read
+        print(f"{path}: {e}, using {len(t)} messages read before it", file=sys.stderr)
+    return Messages(t=np.array(t, np.float64), c=np.array(c, np.int64), u=np.array(u, np.int64),
+                    m=np.array(m, np.int64), f=np.array(f, np.uint64), n=np.array(n, np.int32),
+                    i=np.array(inv, bool), b=np.array(b, np.uint8), w=np.array(w, np.uint32),
+                    w_off=np.array(w_off, np.int64), h=np.array(h, np.uint32), h_off=np.array(h_off, np.int64))
+
+
+def load_file(path: str, cache: bool = True) -> Messages:
+    npz = path[:-len(".jsonl.gz")] + ".npz"
+    if cache and os.path.exists(npz) and os.path.getmtime(npz) >= os.path.getmtime(path):
+        with np.load(npz) as data:
+            return Messages(**{k: data[k] for k in COLUMNS})
+    msgs = parse(path)
+    if cache:
+        tmp = npz + ".tmp.npz"
+        np.savez_compressed(tmp, **{k: getattr(msgs, k) for k in COLUMNS})
+        os.replace(tmp, npz)
+    return msgs
+
+
+def load(paths, cache: bool = True) -> Messages:
+    parts = [load_file(p, cache) for p in paths]
+    if not parts:
+        raise SystemExit("no recordings found")
+    msgs = Messages.concat(parts)
+    # files are hourly and lines are in arrival order, but workers of different chats interleave
+    return msgs.select(np.argsort(msgs.t, kind="stable"))
+
+
+# ---------- rules ----------
+def _group_key(ts, *keys):
+    """Sort by keys then time; returns (order, k) where k[i] - window never reaches another group."""
+    order = np.lexsort((ts,) + tuple(reversed(keys)))
+    ts = ts[order]
+    if not len(ts):
+        return order, ts
+    new = np.zeros(len(ts), bool)
+    new[0] = True
+    for key in keys:
+        k = key[order]
+        new[1:] |= k[1:] != k[:-1]
+    gid = np.cumsum(new) - 1
+    # groups are spaced further apart than any window, so a range search stays inside one group
+    span = ts.max() - ts.min() + 1e6
+    return order, gid * span + (ts - ts.min())
+
+
+def window_counts(msgs: Messages, counted, window: float):
+    """(order, counts): for each counted message, its author's messages in the last `window` seconds."""
+    idx = np.flatnonzero(counted)
+    order, key = _group_key(msgs.t[idx], msgs.c[idx], msgs.u[idx])
+    start = np.searchsorted(key, key - window, side="left")
+    return idx[order], np.arange(len(key)) - start + 1
+
+
+def first_per_user(chat, user, ts):
+    """{(chat, user): earliest ts} over the given events."""
+    if not len(ts):
+        return {}
+    order = np.lexsort((ts, user, chat))
+    chat, user, ts = chat[order], user[order], ts[order]
+    first = np.ones(len(ts), bool)
+    first[1:] = (chat[1:] != chat[:-1]) | (user[1:] != user[:-1])
+    return {(int(c), int(u)): float(t) for c, u, t in zip(chat[first], user[first], ts[first])}
+
+
+def rate_mutes(msgs: Messages, limit: int, order, counts) -> dict:
+    """Users with more than `limit` messages in a window (counts from window_counts)."""
+    hit = order[counts > limit]
+    return first_per_user(msgs.c[hit], msgs.u[hit], msgs.t[hit])
+
+
+if np is not None and hasattr(np, "bitwise_count"):
+    popcount = np.bitwise_count
+else:
+    _BITS = None
+
+    def popcount(x):
+        global _BITS
+        if _BITS is None:
+            _BITS = np.array([bin(v).count("1") for v in range(256)], np.uint8)
+        return _BITS[x.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+def _pair_ids(a, b):
+    """(ids, n): dense id of every distinct (a, b) pair; faster than np.unique(axis=1),
+    which sorts the pairs as raw bytes."""
+    order = np.lexsort((b, a))
+    new = np.ones(len(order), bool)
+    new[1:] = (a[order][1:] != a[order][:-1]) | (b[order][1:] != b[order][:-1])
+    ids = np.empty(len(order), np.int64)
+    ids[order] = np.cumsum(new) - 1
+    return ids, int(new.sum()) if len(order) else 0
+
+
+def _components(n: int, a, b):
+    """Connected components of n nodes under edges (a, b): smallest node index per component."""
+    label = np.arange(n)
+    while True:
+        lo = np.minimum(label[a], label[b])
+        new = label.copy()
+        np.minimum.at(new, a, lo)
+        np.minimum.at(new, b, lo)
+        # pointer jumping: take the label of the node the label points to
+        new = new[new]
+        if np.array_equal(new, label):
+            return label
+        label = new
+
+
+def dup_clusters(chat, fp, ts, window: float, max_distance: int, links: int = 8):
+    """Cluster id per message. Identical fingerprints of a chat are one node. Within
+    every (chat, LSH band value) bucket, in time order, a message's node is linked to
+    the nodes of the `links` messages before it that are inside the window and
+    within max_distance bits. Runs of one node in a bucket are collapsed first, so
+    a spam wave of identical texts costs one entry, and the work is at most
+    links comparisons per message and band."""
+    node, nnodes = _pair_ids(chat, fp)
+    nbands = max_distance + 1
+    bits = HASH_BITS // nbands
+    mask = np.uint64((1 << bits) - 1)
+    edges_a, edges_b = [], []
+    for band in range(nbands):
+        value = ((fp >> np.uint64(band * bits)) & mask).astype(np.int64)
+        order = np.lexsort((ts, value, chat))
+        new = np.ones(len(order), bool)
+        new[1:] = (chat[order][1:] != chat[order][:-1]) | (value[order][1:] != value[order][:-1])
+        keep = new.copy()
+        keep[1:] |= node[order][1:] != node[order][:-1]
+        order, new = order[keep], new[keep]
+        pos = np.arange(len(order))
+        start = np.maximum.accumulate(np.where(new, pos, 0))
+        o_ts, o_fp, o_node = ts[order], fp[order], node[order]
+        for d in range(1, min(links, len(order) - 1) + 1):
+            # message at pos d.. against the one d places before it, same bucket only
+            ok = start[d:] <= pos[:-d]
+            ok &= o_ts[d:] - o_ts[:-d] <= window
+            if not ok.any():
+                break
+            ok &= popcount(o_fp[d:] ^ o_fp[:-d]) <= max_distance
+            edges_a.append(o_node[d:][ok])
+            edges_b.append(o_node[:-d][ok])
+    a = np.concatenate(edges_a) if edges_a else np.zeros(0, np.int64)
+    b = np.concatenate(edges_b) if edges_b else np.zeros(0, np.int64)
+    return _components(nnodes, a, b)[node]
+
+
+def dup_mutes(msgs: Messages, counted, window: float, max_distance: int, min_users: int,
+              min_tokens: int = 4) -> dict:
+    """Users the near-duplicate rule would mute: once a cluster has min_users distinct
+    users inside the window, every user of it in the window is muted."""
+    idx = np.flatnonzero(counted & (msgs.n >= min_tokens))
+    ts, chat, user = msgs.t[idx], msgs.c[idx], msgs.u[idx]
+    cluster = dup_clusters(chat, msgs.f[idx], ts, window, max_distance)
+    # only clusters with min_users distinct users over all time can trigger
+    pair, npairs = _pair_ids(cluster, user)
+    pair_cluster = np.zeros(npairs, np.int64)
+    pair_cluster[pair] = cluster
+    big = np.bincount(pair_cluster, minlength=len(idx)) >= min_users
+    sel = np.flatnonzero(big[cluster])
+    sel = sel[np.lexsort((ts[sel], cluster[sel]))]
+    # sliding window per cluster: linear in the messages of the clusters that can trigger
+    first = {}
+    current = None
+    for k in sel.tolist():
+        if cluster[k] != current:
+            current = cluster[k]
+            recent = deque()      # (ts, user) inside the window
+            counts = {}           # user -> messages inside the window
+            pending = set()       # users inside the window not muted by this cluster yet
+            muted = set()
+        t, u = ts[k], int(user[k])
+        while recent and recent[0][0] < t - window:
+            _, old = recent.popleft()
+            counts[old] -= 1
+            if not counts[old]:
+                del counts[old]
+                pending.discard(old)
+        recent.append((t, u))
+        counts[u] = counts.get(u, 0) + 1
+        if u not in muted:
+            pending.add(u)
+        if len(counts) >= min_users and pending:
+            # clusters are walked one after another, not in time order
+            for p in pending:
+                key = (int(chat[k]), p)
+                first[key] = min(first.get(key, t), float(t))
+            muted |= pending
+            pending.clear()
+    return first
+
+
+def blocked_mask(msgs: Messages, terms=(), domains=(), invites: bool = False):
+    """Messages a blocklist with these entries would delete."""
+    mask = np.zeros(len(msgs), bool)
+    words, owner = msgs.w, msgs.owners(msgs.w_off)
+    spellings = []
+    for term in terms:
+        term = normalize(term)
+        if len(term) >= MIN_TERM_LENGTH:
+            spellings.extend(term_variants(term))
+    for term in spellings:
+        hs = [word_hash(w) for w in term.split()]
+        k = len(hs)
+        if len(words) < k:
+            continue
+        end = len(words) - k + 1
+        hit = owner[:end] == owner[k - 1:]
+        for off, h in enumerate(hs):
+            hit &= words[off:off + end] == h
+        mask[owner[:end][hit]] = True
+    if domains:
+        hit = np.isin(msgs.h, np.array([word_hash(normalize_domain(d)) for d in domains], np.uint32))
+        mask[msgs.owners(msgs.h_off)[hit]] = True
+    if invites:
+        mask |= msgs.i
+    return mask
+
+
+# ---------- report ----------
+def fmt_ts(ts: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+
+
+def run(args) -> dict:
+    paths = sorted(p for d in args.paths for p in (glob.glob(os.path.join(d, "updates-*.jsonl.gz"))
+                                                    if os.path.isdir(d) else [d]))
+    started = time.monotonic()
+    msgs = load(paths, cache=not args.no_cache)
+    if args.chat:
+        msgs = msgs.select(np.isin(msgs.c, np.array(args.chat, np.int64)))
+    loaded = time.monotonic()
+
+    live_blocked = msgs.b > 0
+    candidate = blocked_mask(msgs, args.block, args.block_domain, args.block_invites)
+    counted = ~(live_blocked | candidate)
+    report = {
+        "files": len(paths),
+        "messages": len(msgs),
+        "chats": len(np.unique(msgs.c)),
+        "users": _pair_ids(msgs.c, msgs.u)[1],
+        "from": fmt_ts(msgs.t.min()) if len(msgs) else None,
+        "to": fmt_ts(msgs.t.max()) if len(msgs) else None,
+        "load_seconds": round(loaded - started, 3),
+        "live_blocked": int(live_blocked.sum()),
+        "candidate_blocked": int(candidate.sum()),
+        "candidate_blocked_users": len(first_per_user(msgs.c[candidate], msgs.u[candidate], msgs.t[candidate])),
+        "configs": [],
+    }
+
+    rate = {}
+    for window in args.window:
+        order, counts = window_counts(msgs, counted, window)
+        for limit in args.spam_limit:
+            rate[(limit, window)] = rate_mutes(msgs, limit, order, counts)
+    dup = {}
+    for distance, min_users in itertools.product(args.dup_distance, args.dup_users):
+        dup[(distance, min_users)] = dup_mutes(msgs, counted, args.dup_window, distance, min_users, args.min_tokens)
+
+    baseline = None
+    for (limit, window), (distance, min_users) in itertools.product(rate, dup):
+        muted = dict(dup[(distance, min_users)])
+        for k, ts in rate[(limit, window)].items():
+            muted[k] = min(ts, muted.get(k, ts))
+        if baseline is None:
+            baseline = muted
+        config = {"spam_limit": limit, "window": window, "dup_distance": distance, "dup_users": min_users,
+                  "rate_muted": len(rate[(limit, window)]), "dup_muted": len(dup[(distance, min_users)]),
+                  "muted": len(muted), "added": len(muted.keys() - baseline.keys()),
+                  "removed": len(baseline.keys() - muted.keys())}
+        if args.list:
+            config["users"] = [{"chat_id": c, "user_id": u, "at": fmt_ts(ts),
+                                "rule": "rate" if (c, u) in rate[(limit, window)] else "duplicates"}
+                               for (c, u), ts in sorted(muted.items(), key=lambda kv: kv[1])]
+        report["configs"].append(config)
+    report["replay_seconds"] = round(time.monotonic() - loaded, 3)
+    return report
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Replay recorded messages against candidate moderation rules")
+    p.add_argument("paths", nargs="+", help="recording directories or .jsonl.gz files")
+    p.add_argument("--spam-limit", type=int, nargs="+", default=[10], help="per-user limits to try")
+    p.add_argument("--window", type=float, nargs="+", default=[10.0], help="rate windows to try, seconds")
+    p.add_argument("--dup-users", type=int, nargs="+", default=[3], help="distinct users for the duplicate rule")
+    p.add_argument("--dup-distance", type=int, nargs="+", default=[8], help="SimHash bit distances to try")
+    p.add_argument("--dup-window", type=float, default=600.0)
+    p.add_argument("--min-tokens", type=int, default=4, help="shorter texts are not compared")
+    p.add_argument("--block", action="append", default=[], help="candidate blocklist phrase")
+    p.add_argument("--block-domain", action="append", default=[], help="candidate blocklist domain")
+    p.add_argument("--block-invites", action="store_true", help="candidate blocklist deletes invite links")
+    p.add_argument("--chat", type=int, action="append", help="only these chats")
+    p.add_argument("--list", action="store_true", help="list muted users of every config")
+    p.add_argument("--no-cache", action="store_true", help="do not read or write .npz caches")
+    p.add_argument("--json", action="store_true", help="print the report as one JSON object")
+    args = p.parse_args(argv)
+    if np is None:
+        raise SystemExit("replay.py needs numpy: pip install numpy")
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+        return
+    for k, v in report.items():
+        if k != "configs":
+            print(f"{k:>24}: {v}")
+    for c in report["configs"]:
+        print(f"\nspam_limit={c['spam_limit']} window={c['window']:g} dup_distance={c['dup_distance']} "
+              f"dup_users={c['dup_users']}: {c['muted']} muted ({c['rate_muted']} by rate, "
+              f"{c['dup_muted']} by duplicates), +{c['added']} / -{c['removed']} vs the first config")
+        for u in c.get("users", ()):
+            print(f"    {u['at']}  chat {u['chat_id']}  user {u['user_id']}  ({u['rule']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Shared cache of chat member statuses: (chat_id, user_id) -> status.
+
+Entries live for `ttl` seconds, the cache holds at most `maxsize` entries
+(least recently used are dropped first). my_chat_member / chat_member updates
+overwrite entries in place, so in the steady state a rights check costs no
+Bot API calls at all.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+ADMIN_STATUSES = ("administrator", "creator")
+
+
+class RightsCache:
+    def __init__(self, bot, ttl: float = 300, maxsize: int = 10000):
+        self.bot = bot
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # (chat_id, user_id) -> (expires_at, status)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._me = None
+
+    def me(self):
+        """get_me() result, requested once per process."""
+        if self._me is None:
+            self._me = self.bot.get_me()
+        return self._me
+
+    def cached(self, chat_id: int, user_id: int):
+        """Cached status or None; never calls the Bot API (usable from async code)."""
+        k = (chat_id, user_id)
+        with self._lock:
+            entry = self._entries.get(k)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(k)
+                return entry[1]
+        return None
+
+    def status(self, chat_id: int, user_id: int) -> str:
+        """Member status; Bot API errors are propagated to the caller."""
+        status = self.cached(chat_id, user_id)
+        if status is not None:
+            return status
+        member = self.bot.get_chat_member(chat_id, user_id)
+        self.put(chat_id, user_id, member.status)
+        return member.status
+
+    def put(self, chat_id: int, user_id: int, status: str):
+        k = (chat_id, user_id)
+        with self._lock:
+            self._entries[k] = (time.monotonic() + self.ttl, status)
+            self._entries.move_to_end(k)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, chat_id: int, user_id: int = None):
+        """Drop one entry or, with user_id=None, every entry of the chat."""
+        with self._lock:
+            if user_id is not None:
+                self._entries.pop((chat_id, user_id), None)
+                return
+            for k in [k for k in self._entries if k[0] == chat_id]:
+                del self._entries[k]
+
+    def is_admin(self, chat_id: int, user_id: int) -> bool:
+        return self.status(chat_id, user_id) in ADMIN_STATUSES
+
+    def bot_is_admin(self, chat_id: int) -> bool:
+        return self.is_admin(chat_id, self.me().id)
+
+    def on_member_update(self, upd):
+        """Feed a ChatMemberUpdated (my_chat_member or chat_member update)."""
+        member = upd.new_chat_member
+        self.put(upd.chat.id, member.user.id, member.status)
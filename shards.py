@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+Hash-striped per-chat state.
+
+Sharded(factory, n) holds n independent instances built by `factory`; the
+chat id selects the shard. Each instance keeps its own lock, so handlers
+working on different chats do not contend with each other.
+"""
+
+
+class Sharded:
+    def __init__(self, factory, shards: int = 16):
+        self._shards = tuple(factory() for _ in range(shards))
+
+    def __getitem__(self, chat_id: int):
+        return self._shards[hash(chat_id) % len(self._shards)]
+
+    def __iter__(self):
+        return iter(self._shards)
+
+    def __len__(self) -> int:
+        return len(self._shards)
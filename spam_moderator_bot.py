@@ -12,88 +12,194 @@ import os
 import time
 import threading
 import logging
-import re
-from collections import defaultdict, deque
 
 import telebot
-from telebot import types
+from telebot import types, util
+
+import metrics
+from adaptive import AdaptiveLimits
+from audit import AuditLog
+from blocklist import BlocklistStore, url_host
+from bulk_delete import BulkDeleter
+from chat_history import ChatHistory
+from chat_rules import FIELDS, Rules, RulesError, RulesStore, describe, parse_field
+from content_index import DuplicateIndex
+from media_index import MediaIndex
+from member_directory import MemberDirectory
+from raid import RaidDetector
+from dispatcher import OrderedDispatcher
+from expiry import ExpiryScheduler
+from load_shedder import LoadShedder
+from moderation import (MUTE_PERMISSIONS, UNMUTE_PERMISSIONS, build_mute_keyboard, build_mute_summary, escape_html,
+                        format_duration, format_modlog, extract_args, parse_duration, parse_purge_args)
+from notifications import NotificationAggregator
+from outbound import OutboundScheduler, PRIO_NOTIFY, PRIO_RESTRICT, log_errors
+from persistence import MuteStore
+from recorder import UpdateRecorder
+from rights_cache import RightsCache
+from transport import Transport
+from webhook import WebhookServer
+from window_store import WindowStore
 
 # ---------- Настройки ----------
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN not set. Set BOT_TOKEN environment variable.")
 
+# SPAM_LIMIT, WINDOW_SECONDS, AUTO_MUTE_SECONDS, DELETE_LAST_MESSAGES и LOCKDOWN_SPAM_LIMIT -
+# значения по умолчанию, для отдельных чатов переопределяются в RULES_FILE или командой /config
 SPAM_LIMIT = 10              # больше этого числа сообщений считается спамом
 WINDOW_SECONDS = 10         # окно времени (секунд)
 AUTO_MUTE_SECONDS = 12 * 3600  # 12 часов
 DELETE_LAST_MESSAGES = 25    # сколько последних сообщений удалить при триггере
+ADAPTIVE_LIMITS = False      # порог по базовой активности чата вместо SPAM_LIMIT (/config adaptive 1)
+ADAPTIVE_FLOOR = 5           # адаптивный порог не ниже
+ADAPTIVE_CEILING = 30        # и не выше
+MAX_TRACKED_MESSAGES = 50    # сколько последних сообщений хранится на пользователя (потолок для /config)
+PURGE_HISTORY_SIZE = 20000   # сколько последних сообщений чата помнить для /purge
+PURGE_HISTORY_TOTAL = 5_000_000  # всего по всем чатам (~20 байт на сообщение), дальше вытесняются тихие чаты
+RULES_FILE = os.getenv("RULES_FILE", "chat_rules.json")  # правила по чатам, перечитываются при изменении
+BLOCKLIST_FILE = os.getenv("BLOCKLIST_FILE", "blocklist.json")  # запрещённые фразы и домены по чатам
+BLOCK_INVITE_LINKS = False   # удалять ссылки-приглашения t.me/+... (по умолчанию; /block invites в чате)
+RIGHTS_CACHE_TTL = 300       # сколько секунд доверять закэшированному статусу участника
+RIGHTS_CACHE_SIZE = 10000    # максимум записей в кэше прав
+OVERLOAD_QUEUE_DEPTH = 2000  # столько апдейтов в очереди -> режим перегрузки (выход, когда < 10% и лаг < 1 с)
+OVERLOAD_LAG_SECONDS = 5     # или апдейт ждёт в очереди дольше этого
+DELETE_FLUSH_INTERVAL = 0.5  # как часто накопленные удаления уходят через deleteMessages
+OVERLOAD_DELETE_INTERVAL = 3  # в перегрузке удаления копятся дольше и уходят крупными пачками
+NOTIFY_DELAY_SECONDS = 2     # уведомления об автомутах копятся столько секунд и уходят одним сообщением
+NOTIFY_SUMMARY_USERS = 20    # пользователей в одном сводном сообщении, дальше начинается новое
+MEMBER_DIRECTORY_SIZE = 100000  # сколько (чат, пользователь) с именами помнить для /mute @username
+HTTP_POOL_SIZE = 16          # keep-alive соединений к Bot API
+UPDATE_WORKERS = 8           # воркеров диспетчера; апдейты одного чата всегда в одном воркере
+WINDOW_MAX_BYTES = 64 * 1024 * 1024  # жёсткий лимит памяти окон сообщений
+WINDOW_IDLE_SECONDS = 3600   # окна неактивных пользователей удаляются через час
+DUP_WINDOW_SECONDS = 600     # окно поиска одинаковых сообщений от разных пользователей
+DUP_MIN_USERS = 3            # столько разных пользователей с одним текстом -> мут всем
+DUP_MAX_DISTANCE = 8         # макс. число отличающихся бит SimHash (0 = только точные копии)
+MEDIA_WINDOW_SECONDS = 300   # окно учёта повторов одного и того же файла (по file_unique_id)
+MEDIA_PER_USER_LIMIT = 3     # больше стольких одинаковых файлов от одного пользователя -> мут
+MEDIA_MIN_USERS = 5          # один файл от стольких разных пользователей -> мут всем (кроме стикеров)
+RAID_WINDOW_SECONDS = 60     # окно счётчиков рейда по чату
+RAID_JOINS = 20              # столько вступлений за окно -> режим защиты
+RAID_NEW_USER_MESSAGES = 10  # столько первых сообщений от недавно вступивших за окно -> режим защиты
+RAID_MESSAGES = 300          # столько сообщений в чате за окно -> режим защиты
+RAID_COOLDOWN_SECONDS = 300  # режим снимается после стольких секунд затишья (все счётчики < половины)
+LOCKDOWN_SPAM_LIMIT = 3      # лимит сообщений на пользователя за WINDOW_SECONDS во время рейда
+LOCKDOWN_JOIN_MUTE_SECONDS = 2 * 3600  # новички ограничиваются до конца рейда, но не дольше этого
+MUTES_DB = os.getenv("MUTES_DB", "mutes.sqlite3")  # SQLite-файл с активными мьютами
+AUDIT_DB = os.getenv("AUDIT_DB", "audit.sqlite3")  # журнал действий модерации (/modlog)
+AUDIT_RETENTION_DAYS = 90    # записи журнала старше удаляются
+MODLOG_LIMIT = 15            # сколько последних действий показывает /modlog
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN")  # "host:port" -> webhook вместо long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")        # публичный URL для setWebhook (необязательно)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # проверяется в X-Telegram-Bot-Api-Secret-Token
+METRICS_LISTEN = os.getenv("METRICS_LISTEN")  # "host:port" -> Prometheus /metrics (по умолчанию выключено)
+RECORD_DIR = os.getenv("RECORD_DIR")  # каталог записи сообщений (только хэши) для replay.py; не задан -> выключено
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-bot = telebot.TeleBot(BOT_TOKEN, parse_mode='HTML')
-
-# chat_id -> user_id -> deque of (timestamp, message_id)
-recent_msgs = defaultdict(lambda: defaultdict(lambda: deque()))
-recent_lock = threading.Lock()
-
-# (chat_id, user_id) -> until_timestamp (unix)
-active_mutes = {}
-mutes_lock = threading.Lock()
-
-duration_re = re.compile(r'(\d+)([smhdM])')  # s,m,h,d,M(months)
+# pooled session, flood-wait/retry handling and circuit breakers for every call
+transport = Transport(pool_size=HTTP_POOL_SIZE).install()
+# threaded=False: handlers run inside the dispatcher workers, in per-chat order
+bot = telebot.TeleBot(BOT_TOKEN, parse_mode='HTML', threaded=False)
+dispatcher = OrderedDispatcher(workers=UPDATE_WORKERS).install(bot)
+rights = RightsCache(bot, ttl=RIGHTS_CACHE_TTL, maxsize=RIGHTS_CACHE_SIZE)
+# names and usernames of users seen in each chat, fed from updates; saves get_chat_member calls
+members = MemberDirectory(maxsize=MEMBER_DIRECTORY_SIZE)
+# all outgoing Bot API calls go through the scheduler (rate limits + priorities)
+outbound = OutboundScheduler()
+deleter = BulkDeleter(bot, interval=DELETE_FLUSH_INTERVAL, scheduler=outbound)
+# auto-mutes of a burst go into one summary message per chat, edited in place
+digest = NotificationAggregator(
+    render=lambda chat_id, entries: build_mute_summary(entries, "U:{user_id}", "B:{user_id}"),
+    send=lambda chat_id, text, kb: notify(chat_id, bot.send_message, chat_id, text, reply_markup=kb),
+    edit=lambda chat_id, message_id, text, kb: notify(chat_id, bot.edit_message_text, text, chat_id, message_id,
+                                                      reply_markup=kb),
+    delay=NOTIFY_DELAY_SECONDS, max_users=NOTIFY_SUMMARY_USERS)
+
+# (chat_id, user_id) -> ring of (timestamp, message_id), bounded and idle-evicted
+recent_msgs = WindowStore(capacity=MAX_TRACKED_MESSAGES,
+                          idle_seconds=WINDOW_IDLE_SECONDS, max_bytes=WINDOW_MAX_BYTES)
+
+# chat_id -> ring of (timestamp, message_id, user_id) in arrays; /purge selects from it in one pass
+history = ChatHistory(capacity=PURGE_HISTORY_SIZE, max_entries=PURGE_HISTORY_TOTAL)
+
+# (chat_id, user_id) -> until_timestamp (unix); fires on_mute_expired at the deadline,
+# every change is journaled to SQLite in the background
+mute_store = MuteStore(MUTES_DB)
+active_mutes = ExpiryScheduler(lambda key, until_ts: on_mute_expired(key, until_ts), journal=mute_store)
+# every moderation action, appended in batches by a writer thread
+audit = AuditLog(AUDIT_DB, retention_days=AUDIT_RETENTION_DAYS)
+
+# per-chat limits, compiled into immutable Rules; hot-reloaded from RULES_FILE
+chat_rules = RulesStore(RULES_FILE, Rules(spam_limit=SPAM_LIMIT, window_seconds=WINDOW_SECONDS,
+                                          mute_seconds=AUTO_MUTE_SECONDS, delete_last=DELETE_LAST_MESSAGES,
+                                          lockdown_limit=LOCKDOWN_SPAM_LIMIT, adaptive=int(ADAPTIVE_LIMITS),
+                                          adaptive_floor=ADAPTIVE_FLOOR, adaptive_ceiling=ADAPTIVE_CEILING),
+                        max_messages=MAX_TRACKED_MESSAGES)
+
+# banned phrases (Aho-Corasick), link domains and invite links; checked before the rate limit
+blocklists = BlocklistStore(BLOCKLIST_FILE, default_invites=BLOCK_INVITE_LINKS)
+
+# per-chat EWMA baseline of per-user message counts, for chats with adaptive=1
+baselines = AdaptiveLimits()
+
+# near-duplicate texts per chat (SimHash + LSH), catches raids of slow posters
+dup_index = DuplicateIndex(window=DUP_WINDOW_SECONDS, max_distance=DUP_MAX_DISTANCE, min_users=DUP_MIN_USERS)
+# repeated stickers/photos/videos per chat, keyed by file_unique_id (nothing is downloaded)
+media_index = MediaIndex(window=MEDIA_WINDOW_SECONDS, per_user_limit=MEDIA_PER_USER_LIMIT,
+                         min_users=MEDIA_MIN_USERS)
+# chat-wide joins / new-user messages / message rate; lockdown while a raid is on
+raid = RaidDetector(window=RAID_WINDOW_SECONDS, join_limit=RAID_JOINS, new_msg_limit=RAID_NEW_USER_MESSAGES,
+                    msg_limit=RAID_MESSAGES, cooldown=RAID_COOLDOWN_SECONDS,
+                    on_change=lambda chat_id, active, reason: on_raid_change(chat_id, active, reason))
+
+# ids, timestamps and content hashes of messages for offline replay; off unless RECORD_DIR is set
+recorder = UpdateRecorder(RECORD_DIR) if RECORD_DIR else None
+
+# overload mode: past these backlog limits optional work is skipped (see on_overload_change)
+shedder = LoadShedder(dispatcher.queue_depth, dispatcher.lag, enter_depth=OVERLOAD_QUEUE_DEPTH,
+                      exit_depth=OVERLOAD_QUEUE_DEPTH // 10, enter_lag=OVERLOAD_LAG_SECONDS,
+                      on_change=lambda active, reason: on_overload_change(active, reason))
+
+# gauges are evaluated on scrape only; counters are no-ops unless METRICS_LISTEN is set
+auto_mutes = metrics.counter("moderator_auto_mutes_total", "Users muted automatically for flooding")
+blocked_messages = metrics.counter("moderator_blocked_messages_total", "Messages deleted by the blocklist", "kind")
+metrics.gauge("moderator_active_mutes", "Mutes waiting for expiry", lambda: len(active_mutes))
+metrics.gauge("moderator_window_entries", "Tracked (chat, user) message windows",
+              lambda: recent_msgs.stats()["entries"])
+metrics.gauge("moderator_window_bytes", "Approximate memory of message windows",
+              lambda: recent_msgs.stats()["bytes"])
+metrics.gauge("moderator_history_messages", "Messages in the /purge index", lambda: history.stats()["entries"])
+metrics.gauge("moderator_dispatcher_queue_depth", "Updates waiting in dispatcher queues", dispatcher.queue_depth)
+metrics.gauge("moderator_dispatcher_lag_seconds", "Worst queueing delay of a dispatcher worker", dispatcher.lag)
+metrics.gauge("moderator_outbound_queue_depth", "Bot API calls waiting in the outbound scheduler",
+              outbound.queue_depth)
+metrics.gauge("moderator_duplicate_index_entries", "Messages in the near-duplicate index",
+              lambda: dup_index.stats()["entries"])
+metrics.gauge("moderator_media_index_files", "Files tracked by the repeated-media index", lambda: len(media_index))
+metrics.gauge("moderator_raid_lockdowns", "Chats currently in raid lockdown", raid.lockdowns)
+metrics.gauge("moderator_notification_summaries_pending", "Summary messages waiting to be sent or edited",
+              digest.pending)
+metrics.gauge("moderator_overloaded", "1 while the bot is shedding load", lambda: int(shedder.active))
+metrics.gauge("moderator_member_directory_entries", "Chat members known by name", lambda: len(members))
 
 # ---------- Утилиты ----------
-def parse_duration(s: str) -> int:
-    s = (s or "").strip()
-    if not s:
-        raise ValueError("Empty duration")
-    total = 0
-    pos = 0
-    for m in duration_re.finditer(s):
-        if m.start() != pos:
-            raise ValueError("Bad duration format near: " + s[pos:m.start()+1])
-        v = int(m.group(1)); u = m.group(2)
-        if u == 's': total += v
-        elif u == 'm': total += v * 60
-        elif u == 'h': total += v * 3600
-        elif u == 'd': total += v * 86400
-        elif u == 'M': total += v * 30 * 86400
-        pos = m.end()
-    if pos != len(s):
-        raise ValueError("Bad duration format")
-    if total <= 0:
-        raise ValueError("Duration must be > 0")
-    return total
-
 def is_admin(chat_id: int, user_id: int) -> bool:
     try:
-        member = bot.get_chat_member(chat_id, user_id)
-        return member.status in ("administrator", "creator")
+        return rights.is_admin(chat_id, user_id)
     except Exception as e:
         logger.exception("is_admin check failed: %s", e)
         return False
 
 def restrict_user(chat_id: int, user_id: int, until_ts: int):
-    perms = types.ChatPermissions(
-        can_send_messages=False,
-        can_send_media_messages=False,
-        can_send_polls=False,
-        can_send_other_messages=False,
-        can_add_web_page_previews=False
-    )
-    bot.restrict_chat_member(chat_id, user_id, permissions=perms, until_date=until_ts)
+    bot.restrict_chat_member(chat_id, user_id, permissions=MUTE_PERMISSIONS, until_date=until_ts)
     logger.info("Restricted %s in %s until %s", user_id, chat_id, until_ts)
 
 def unrestrict_user(chat_id: int, user_id: int):
-    perms = types.ChatPermissions(
-        can_send_messages=True,
-        can_send_media_messages=True,
-        can_send_polls=True,
-        can_send_other_messages=True,
-        can_add_web_page_previews=True
-    )
-    bot.restrict_chat_member(chat_id, user_id, permissions=perms, until_date=None)
+    bot.restrict_chat_member(chat_id, user_id, permissions=UNMUTE_PERMISSIONS, until_date=None)
     logger.info("Unrestricted %s in %s", user_id, chat_id)
 
 def ban_user(chat_id: int, user_id: int):
@@ -105,15 +211,40 @@ def unban_user(chat_id: int, user_id: int):
     bot.unban_chat_member(chat_id, user_id)
     logger.info("Unbanned %s in %s", user_id, chat_id)
 
-# callback_data: short form "U:<id>" or "B:<id>" to keep it small
-def build_mute_keyboard(target_user_id: int):
-    kb = types.InlineKeyboardMarkup()
-    kb.add(types.InlineKeyboardButton("Размутить", callback_data=f"U:{target_user_id}"))
-    kb.add(types.InlineKeyboardButton("Бан", callback_data=f"B:{target_user_id}"))
-    return kb
+def notify(chat_id: int, fn, /, *args, **kwargs):
+    # low-priority send/edit; failures are logged, handler does not wait
+    fut = outbound.submit(PRIO_NOTIFY, chat_id, fn, *args, **kwargs)
+    fut.add_done_callback(log_errors(getattr(fn, "__name__", "notify")))
+    return fut
+
+def reply(message: types.Message, text: str, **kwargs):
+    return notify(message.chat.id, bot.reply_to, message, text, **kwargs)
+
+def record_action(chat_id: int, actor: types.User, user_id: int, action: str, reason: str = None, until=None):
+    # admin commands skip handle_all_messages: put the admin into the directory so /modlog shows a name
+    members.observe(chat_id, actor, time.time())
+    audit.record(chat_id, user_id, action, actor.id, reason, until)
+
+def queue_delete(chat_id: int, message_ids):
+    # out of the /purge index as well, so a later /purge doesn't pick already deleted messages
+    history.discard(chat_id, message_ids)
+    deleter.add(chat_id, message_ids)
+
+def find_member(chat_id: int, token: str):
+    # "@username" or user_id -> user; the directory first, get_chat_member only for ids never seen
+    member = members.resolve(chat_id, token)
+    if member is not None:
+        return member
+    if token.startswith("@"):
+        raise LookupError(f"{token} ещё не писал в этом чате")
+    user_id = int(token)
+    if shedder.shed("member_lookup"):
+        # overloaded: act on the bare id, the name is only cosmetic
+        return types.User(user_id, False, str(user_id))
+    return bot.get_chat_member(chat_id, user_id).user
 
 # ---------- Обработка сообщений (спам детект) ----------
-@bot.message_handler(func=lambda m: True, content_types=['text','sticker','photo','video','audio','document','voice','animation','video_note','location','contact'])
+# registered below the commands, see register_message_handler at the end of the commands section
 def handle_all_messages(message: types.Message):
     # ignore private chats
     if message.chat.type == "private":
@@ -123,130 +254,156 @@ def handle_all_messages(message: types.Message):
     user_id = message.from_user.id
     msg_id = message.message_id
     now = time.time()
+    if not shedder.shed("member_directory"):
+        members.observe(chat_id, message.from_user, now)
+
+    # blocklist goes first: a match is deleted right away and is not counted
+    blocked = blocklists.get(chat_id).match(message.text or message.caption,
+                                           message.entities or message.caption_entities)
+    if blocked and is_admin(chat_id, user_id):
+        blocked = None
+    if recorder is not None and not shedder.shed("recorder"):
+        recorder.record(message, now, blocked)
+    if blocked:
+        logger.info("Blocked message %s of %s in chat %s (%s)", msg_id, user_id, chat_id, blocked)
+        blocked_messages.inc(blocked.split(":")[0])
+        queue_delete(chat_id, [msg_id])
+        audit.record(chat_id, user_id, "delete", reason=blocked)
+        return
 
-    # store message
-    with recent_lock:
-        dq = recent_msgs[chat_id][user_id]
-        dq.append((now, msg_id))
-        # remove old
-        cutoff = now - WINDOW_SECONDS
-        while dq and dq[0][0] < cutoff:
-            dq.popleft()
-        count = len(dq)
+    # kept even in overload mode: purging a raid needs exactly these messages
+    history.add(chat_id, user_id, msg_id, now)
+    rules = chat_rules.get(chat_id)
+    # store message, count the ones inside the window
+    count = recent_msgs.add(chat_id, user_id, now, msg_id, rules.window_seconds)
+    # during a raid the per-user limit is stricter (and raid traffic stays out of the baseline)
+    if raid.on_message(chat_id, user_id, now):
+        limit = rules.lockdown_limit
+    elif rules.adaptive:
+        limit = baselines.observe(chat_id, count, now, rules)
+    else:
+        limit = rules.spam_limit
 
     # If over limit -> auto mute
-    if count > SPAM_LIMIT:
-        key = (chat_id, user_id)
-        with mutes_lock:
-            if key in active_mutes:
-                logger.debug("User %s in chat %s already muted", user_id, chat_id)
-                return
-            until_ts = int(now + AUTO_MUTE_SECONDS)
-            try:
-                restrict_user(chat_id, user_id, until_ts)
-            except Exception as e:
-                logger.exception("Failed to restrict: %s", e)
-                try:
-                    bot.reply_to(message, "Не могу замутить пользователя — проверь права бота (должен быть админ).")
-                except Exception:
-                    pass
-                return
-            active_mutes[key] = until_ts
-
-        # delete last DELETE_LAST_MESSAGES messages (from that deque)
-        with recent_lock:
-            all_msgs = list(recent_msgs[chat_id][user_id])  # list of (ts, id)
-        # sort by timestamp just in case and take last N
-        all_msgs.sort(key=lambda x: x[0])
-        to_delete = [mid for ts, mid in all_msgs[-DELETE_LAST_MESSAGES:]]
-        deleted = 0
-        for mid in to_delete:
-            try:
-                bot.delete_message(chat_id, mid)
-                deleted += 1
-            except Exception:
-                # ignore any delete errors (message already deleted or permissions)
-                pass
-        logger.info("Auto-mute: deleted %d messages of user %s in chat %s", deleted, user_id, chat_id)
-
-        # send notification with inline buttons
-        user_mention = f"<a href='tg://user?id={user_id}'>{escape_html(message.from_user.first_name)}</a>"
-        text = f"Пользователь {user_mention} автоматически замучен за спам на 12 часов."
-        kb = build_mute_keyboard(user_id)
-        try:
-            bot.send_message(chat_id, text, reply_markup=kb)
-        except Exception as e:
-            logger.exception("Failed to send mute notification: %s", e)
+    if count > limit:
+        auto_mute(message, user_id, message.from_user.first_name, now, rules)
         return
 
-# ---------- Команды: /mute /ban /unmute /unban ----------
-def extract_args(text: str):
-    if not text:
-        return []
-    parts = text.strip().split(maxsplit=2)
-    return parts[1:] if len(parts) > 1 else []
+    # the same text or file from several users (or one file over and over) ->
+    # mute and purge all of them
+    name = message.from_user.first_name
+    cluster = dup_index.add(chat_id, user_id, msg_id, message.text or message.caption, now, name)
+    if cluster:
+        logger.info("Duplicate text from %d users in chat %s", len(cluster), chat_id)
+        mute_cluster(message, cluster, now, "за рассылку одинаковых сообщений")
+    cluster = media_index.add(chat_id, user_id, msg_id, message, now, name)
+    if cluster:
+        logger.info("Repeated media from %d users in chat %s", len(cluster), chat_id)
+        mute_cluster(message, cluster, now, "за повтор одного и того же медиа")
+
+def mute_cluster(message: types.Message, cluster: dict, triggered_at: float, reason: str):
+    # cluster: user_id -> (name, message_ids to purge); admins are never muted
+    rules = chat_rules.get(message.chat.id)
+    for uid, (name, ids) in cluster.items():
+        if is_admin(message.chat.id, uid):
+            continue
+        auto_mute(message, uid, name, triggered_at, rules, purge_ids=ids, reason=reason)
+
+def auto_mute(message: types.Message, user_id: int, name: str, triggered_at: float, rules: Rules,
+              purge_ids=None, reason: str = "за спам"):
+    chat_id = message.chat.id
+    until_ts = int(triggered_at + rules.mute_seconds)
+    # reserved right away so parallel updates don't trigger a second mute
+    if not active_mutes.add((chat_id, user_id), until_ts):
+        logger.debug("User %s in chat %s already muted", user_id, chat_id)
+        return
+    fut = outbound.submit(PRIO_RESTRICT, chat_id, restrict_user, chat_id, user_id, until_ts)
+    fut.add_done_callback(lambda f: after_auto_mute(f, message, user_id, name, triggered_at, rules,
+                                                    purge_ids, reason))
 
+def after_auto_mute(fut, message: types.Message, user_id: int, name: str, triggered_at: float, rules: Rules,
+                    purge_ids, reason: str):
+    # runs when the restrict call has finished: purge and notify, or roll back
+    chat_id = message.chat.id
+    e = fut.exception()
+    if e is not None:
+        logger.error("Failed to restrict: %s", e)
+        active_mutes.cancel((chat_id, user_id))
+        reply(message, "Не могу замутить пользователя — проверь права бота (должен быть админ).")
+        return
+    auto_mutes.inc()
+    audit.record(chat_id, user_id, "auto_mute", reason=reason, until=triggered_at + rules.mute_seconds)
+
+    # delete the last rules.delete_last messages of the current window,
+    # plus the duplicates that triggered the mute
+    to_delete = recent_msgs.message_ids(chat_id, user_id, last=rules.delete_last,
+                                        since=triggered_at - rules.window_seconds)
+    if purge_ids:
+        to_delete = sorted(set(to_delete).union(purge_ids))
+    # deleted in bulk by the deleter thread, per-chat counts are logged there
+    queue_delete(chat_id, to_delete)
+    logger.info("Auto-mute: queued %d messages of user %s in chat %s for deletion", len(to_delete), user_id, chat_id)
+
+    # one summary per burst with unmute/ban buttons per user
+    digest.add(chat_id, user_id, name, f"{reason} на {format_duration(rules.mute_seconds)}")
+
+# ---------- Команды: /mute /ban /unmute /unban ----------
 @bot.message_handler(commands=['mute'])
 def cmd_mute(message: types.Message):
     chat_id = message.chat.id
     args = extract_args(message.text)
     if not message.reply_to_message and len(args) < 2:
-        bot.reply_to(message, "Использование (reply): /mute 1d причина\nИли: /mute <user_id> <duration> [причина]")
+        reply(message, "Использование (reply): /mute 1d причина\nИли: /mute <user_id|@username> <duration> [причина]")
         return
 
     # determine target
     if message.reply_to_message:
         target_user = message.reply_to_message.from_user
         if not args:
-            bot.reply_to(message, "Укажи длительность, напр. /mute 1d причина")
+            reply(message, "Укажи длительность, напр. /mute 1d причина")
             return
         duration_token = args[0]
         reason = args[1] if len(args) > 1 else ""
     else:
         try:
-            uid = int(args[0])
+            target_user = find_member(chat_id, args[0])
         except ValueError:
-            bot.reply_to(message, "user_id должен быть числом")
+            reply(message, "Укажи user_id числом или @username")
             return
-        try:
-            cm = bot.get_chat_member(chat_id, uid)
-            target_user = cm.user
         except Exception as e:
-            bot.reply_to(message, f"Не удалось найти участника {uid}: {e}")
+            reply(message, f"Не удалось найти участника {escape_html(args[0])}: {escape_html(str(e))}")
             return
-        duration_token = args[1]
-        reason = args[2] if len(args) > 2 else ""
+        # extract_args leaves "<duration> [причина]" in one piece
+        duration_token, _, reason = args[1].partition(" ")
+        reason = reason.strip()
 
     try:
         seconds = parse_duration(duration_token)
     except Exception as e:
-        bot.reply_to(message, f"Неправильный формат длительности: {e}")
+        reply(message, f"Неправильный формат длительности: {e}")
         return
 
     until_ts = int(time.time() + seconds)
     try:
-        restrict_user(chat_id, target_user.id, until_ts)
+        outbound.call(PRIO_RESTRICT, chat_id, restrict_user, chat_id, target_user.id, until_ts)
     except Exception:
-        bot.reply_to(message, "Не удалось замутить пользователя (проверь права бота).")
+        reply(message, "Не удалось замутить пользователя (проверь права бота).")
         return
 
-    with mutes_lock:
-        active_mutes[(chat_id, target_user.id)] = until_ts
+    active_mutes.schedule((chat_id, target_user.id), until_ts)
+    record_action(chat_id, message.from_user, target_user.id, "mute", reason, until_ts)
 
     user_mention = f"<a href='tg://user?id={target_user.id}'>{escape_html(target_user.first_name)}</a>"
-    bot.reply_to(message, f"Пользователь {user_mention} замучен до {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(until_ts))}. Причина: {escape_html(reason)}")
+    reply(message, f"Пользователь {user_mention} замучен до {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(until_ts))}. Причина: {escape_html(reason)}")
     # send buttons for admins
-    try:
-        bot.send_message(chat_id, f"Пользователь {user_mention} замучен.", reply_markup=build_mute_keyboard(target_user.id))
-    except Exception:
-        pass
+    notify(chat_id, bot.send_message, chat_id, f"Пользователь {user_mention} замучен.", reply_markup=build_mute_keyboard(target_user.id))
 
 @bot.message_handler(commands=['ban'])
 def cmd_ban(message: types.Message):
     chat_id = message.chat.id
     args = extract_args(message.text)
     if not message.reply_to_message and not args:
-        bot.reply_to(message, "Использование (reply): /ban причина\nИли: /ban <user_id> [причина]")
+        reply(message, "Использование (reply): /ban причина\nИли: /ban <user_id|@username> [причина]")
         return
 
     if message.reply_to_message:
@@ -254,29 +411,26 @@ def cmd_ban(message: types.Message):
         reason = args[0] if args else ""
     else:
         try:
-            uid = int(args[0])
+            target_user = find_member(chat_id, args[0])
         except ValueError:
-            bot.reply_to(message, "user_id должен быть числом")
+            reply(message, "Укажи user_id числом или @username")
             return
-        try:
-            cm = bot.get_chat_member(chat_id, uid)
-            target_user = cm.user
         except Exception as e:
-            bot.reply_to(message, f"Не удалось найти участника {uid}: {e}")
+            reply(message, f"Не удалось найти участника {escape_html(args[0])}: {escape_html(str(e))}")
             return
         reason = args[1] if len(args) > 1 else ""
 
     try:
-        ban_user(chat_id, target_user.id)
+        outbound.call(PRIO_RESTRICT, chat_id, ban_user, chat_id, target_user.id)
     except Exception:
-        bot.reply_to(message, "Не удалось забанить пользователя (проверь права бота).")
+        reply(message, "Не удалось забанить пользователя (проверь права бота).")
         return
 
-    with mutes_lock:
-        active_mutes.pop((chat_id, target_user.id), None)
+    active_mutes.cancel((chat_id, target_user.id))
+    record_action(chat_id, message.from_user, target_user.id, "ban", reason)
 
     user_mention = f"<a href='tg://user?id={target_user.id}'>{escape_html(target_user.first_name)}</a>"
-    bot.reply_to(message, f"Пользователь {user_mention} забанен. Причина: {escape_html(reason)}")
+    reply(message, f"Пользователь {user_mention} забанен. Причина: {escape_html(reason)}")
 
 @bot.message_handler(commands=['unmute'])
 def cmd_unmute(message: types.Message):
@@ -286,37 +440,37 @@ def cmd_unmute(message: types.Message):
         target_user = message.reply_to_message.from_user
     else:
         if not args:
-            bot.reply_to(message, "Использование: /unmute <user_id> или reply на сообщение")
+            reply(message, "Использование: /unmute <user_id|@username> или reply на сообщение")
             return
         try:
-            uid = int(args[0])
-            target_user = bot.get_chat_member(chat_id, uid).user
+            target_user = find_member(chat_id, args[0])
         except Exception as e:
-            bot.reply_to(message, f"Не удалось: {e}")
+            reply(message, f"Не удалось: {e}")
             return
     try:
-        unrestrict_user(chat_id, target_user.id)
+        outbound.call(PRIO_RESTRICT, chat_id, unrestrict_user, chat_id, target_user.id)
     except Exception:
-        bot.reply_to(message, "Не удалось размутить (проверь права бота).")
+        reply(message, "Не удалось размутить (проверь права бота).")
         return
-    with mutes_lock:
-        active_mutes.pop((chat_id, target_user.id), None)
-    bot.reply_to(message, f"Пользователь <a href='tg://user?id={target_user.id}'>{escape_html(target_user.first_name)}</a> размучен.", parse_mode='HTML')
+    active_mutes.cancel((chat_id, target_user.id))
+    record_action(chat_id, message.from_user, target_user.id, "unmute")
+    reply(message, f"Пользователь <a href='tg://user?id={target_user.id}'>{escape_html(target_user.first_name)}</a> размучен.", parse_mode='HTML')
 
 @bot.message_handler(commands=['unban'])
 def cmd_unban(message: types.Message):
     chat_id = message.chat.id
     args = extract_args(message.text)
     if not args:
-        bot.reply_to(message, "Использование: /unban <user_id>")
+        reply(message, "Использование: /unban <user_id>")
         return
     try:
         uid = int(args[0])
-        unban_user(chat_id, uid)
+        outbound.call(PRIO_RESTRICT, chat_id, unban_user, chat_id, uid)
     except Exception as e:
-        bot.reply_to(message, f"Не удалось разбанить: {e}")
+        reply(message, f"Не удалось разбанить: {e}")
         return
-    bot.reply_to(message, f"Пользователь {uid} разбанен.")
+    record_action(chat_id, message.from_user, uid, "unban")
+    reply(message, f"Пользователь {uid} разбанен.")
 
 # ---------- Callback query (кнопки) ----------
 @bot.callback_query_handler(func=lambda call: True)
@@ -335,75 +489,316 @@ def handle_callback(call: types.CallbackQuery):
 
     chat_id = call.message.chat.id
     caller_id = call.from_user.id
+    members.observe(chat_id, call.from_user, time.time())
 
     # только админы могут нажимать кнопки
     if not is_admin(chat_id, caller_id):
         bot.answer_callback_query(call.id, "Только администратор может нажимать эти кнопки.")
         return
 
+    target_name = escape_html(members.name(chat_id, target_id, "пользователь"))
     if action == "U":  # unmute
         try:
-            unrestrict_user(chat_id, target_id)
+            outbound.call(PRIO_RESTRICT, chat_id, unrestrict_user, chat_id, target_id)
         except Exception:
             bot.answer_callback_query(call.id, "Не удалось размутить (проверь права бота).")
             return
-        with mutes_lock:
-            active_mutes.pop((chat_id, target_id), None)
-        try:
-            bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id,
-                                  text=f"Пользователь <a href='tg://user?id={target_id}'>пользователь</a> был размучен администратором.",
-                                  parse_mode='HTML')
-        except Exception:
-            # возможно нельзя редактировать — просто уведомим
-            pass
+        active_mutes.cancel((chat_id, target_id))
+        record_action(chat_id, call.from_user, target_id, "unmute")
+        if not digest.resolve(chat_id, call.message.message_id, target_id, "размучен администратором"):
+            notify(chat_id, bot.edit_message_text, chat_id=chat_id, message_id=call.message.message_id,
+                   text=f"Пользователь <a href='tg://user?id={target_id}'>{target_name}</a> был размучен администратором.",
+                   parse_mode='HTML')
         bot.answer_callback_query(call.id, "Пользователь размучен.")
     elif action == "B":  # ban
         try:
-            ban_user(chat_id, target_id)
+            outbound.call(PRIO_RESTRICT, chat_id, ban_user, chat_id, target_id)
         except Exception:
             bot.answer_callback_query(call.id, "Не удалось забанить (проверь права бота).")
             return
-        with mutes_lock:
-            active_mutes.pop((chat_id, target_id), None)
-        try:
-            bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id,
-                                  text=f"Пользователь <a href='tg://user?id={target_id}'>пользователь</a> был забанен администратором.",
-                                  parse_mode='HTML')
-        except Exception:
-            pass
+        active_mutes.cancel((chat_id, target_id))
+        record_action(chat_id, call.from_user, target_id, "ban")
+        if not digest.resolve(chat_id, call.message.message_id, target_id, "забанен администратором"):
+            notify(chat_id, bot.edit_message_text, chat_id=chat_id, message_id=call.message.message_id,
+                   text=f"Пользователь <a href='tg://user?id={target_id}'>{target_name}</a> был забанен администратором.",
+                   parse_mode='HTML')
         bot.answer_callback_query(call.id, "Пользователь забанен.")
     else:
         bot.answer_callback_query(call.id, "Неизвестное действие.")
 
-# ---------- Очистка просроченных мьютов ----------
-def mute_cleanup_loop():
+# ---------- /config: правила чата ----------
+@bot.message_handler(commands=['config'])
+def cmd_config(message: types.Message):
+    chat_id = message.chat.id
+    if message.chat.type == "private":
+        return
+    args = (message.text or "").split()[1:]
+    if not args:
+        rules = chat_rules.get(chat_id)
+        source = "свои правила" if chat_rules.has_override(chat_id) else "правила по умолчанию"
+        reply(message, f"Чат использует {source}:\n<code>{escape_html(describe(rules))}</code>\n\n"
+                       f"Изменить: /config &lt;поле&gt; &lt;значение&gt;, сбросить: /config reset\n"
+                       f"Поля: {', '.join(FIELDS)}")
+        return
+    if not is_admin(chat_id, message.from_user.id):
+        reply(message, "Только админы могут менять правила.")
+        return
+    try:
+        if args[0] == "reset":
+            chat_rules.reset(chat_id)
+            rules = chat_rules.get(chat_id)
+        elif len(args) == 2:
+            rules = chat_rules.update(chat_id, **{args[0]: parse_field(args[0], args[1])})
+        else:
+            reply(message, "Использование: /config &lt;поле&gt; &lt;значение&gt; или /config reset")
+            return
+    except (RulesError, ValueError) as e:
+        reply(message, f"Не получилось: {escape_html(str(e))}")
+        return
+    except OSError as e:
+        logger.exception("Failed to save rules: %s", e)
+        reply(message, "Не удалось сохранить правила.")
+        return
+    logger.info("Rules of chat %s changed by %s: %s", chat_id, message.from_user.id, rules)
+    reply(message, f"Готово:\n<code>{escape_html(describe(rules))}</code>")
+
+# ---------- /limits: текущие пороги ----------
+@bot.message_handler(commands=['limits'])
+def cmd_limits(message: types.Message):
+    chat_id = message.chat.id
+    if message.chat.type == "private":
+        return
+    if not is_admin(chat_id, message.from_user.id):
+        reply(message, "Пороги видны только админам.")
+        return
+    rules = chat_rules.get(chat_id)
+    b = baselines.snapshot(chat_id, rules, time.time())
+    if raid.in_lockdown(chat_id):
+        mode = f"режим защиты от рейда: {rules.lockdown_limit}"
+    elif rules.adaptive:
+        mode = f"адаптивный: {b['limit']} (границы {rules.adaptive_floor}..{rules.adaptive_ceiling})"
+    else:
+        mode = f"фиксированный: {rules.spam_limit}"
+    reply(message, f"Мут после более чем N сообщений за {rules.window_seconds:g} с, N сейчас — {mode}.\n"
+                   f"База чата: в среднем {b['mean']:.1f} ± {b['std']:.1f} сообщений на пользователя за окно "
+                   f"({b['samples']} замеров), {b['per_minute']:.1f} сообщений в минуту.\n"
+                   f"Адаптивный режим: /config adaptive 1")
+
+# ---------- /block /unblock: блоклист чата ----------
+def parse_block_entry(arg: str):
+    # "invites" -> invite links; a single word with a dot that parses as a host -> domain; else a phrase
+    if arg.lower() == "invites":
+        return "invites", True
+    if " " not in arg and "." in arg and url_host(arg):
+        return "domains", url_host(arg)
+    return "terms", arg
+
+@bot.message_handler(commands=['block', 'unblock'])
+def cmd_block(message: types.Message):
+    chat_id = message.chat.id
+    if message.chat.type == "private":
+        return
+    if not is_admin(chat_id, message.from_user.id):
+        reply(message, "Только админы могут менять блоклист.")
+        return
+    command = util.extract_command(message.text)
+    arg = (util.extract_arguments(message.text) or "").strip()
+    if not arg:
+        own = blocklists.own_entries(chat_id)
+        lines = [f"Фразы: {', '.join(own.get('terms', ())) or '—'}",
+                 f"Домены: {', '.join(own.get('domains', ())) or '—'}",
+                 f"Инвайт-ссылки: {'удаляются' if blocklists.get(chat_id).invites else 'разрешены'}"]
+        reply(message, escape_html("\n".join(lines)) +
+              "\n\nДобавить: /block &lt;фраза|домен|invites&gt;, убрать: /unblock &lt;...&gt;")
+        return
+    kind, value = parse_block_entry(arg)
+    try:
+        if command == "block":
+            blocklists.add(chat_id, kind, value)
+        else:
+            blocklists.remove(chat_id, kind, value)
+    except ValueError as e:
+        reply(message, f"Не получилось: {escape_html(str(e))}")
+        return
+    except OSError as e:
+        logger.exception("Failed to save blocklist: %s", e)
+        reply(message, "Не удалось сохранить блоклист.")
+        return
+    logger.info("Blocklist of chat %s: %s %s %r by %s", chat_id, command, kind, value, message.from_user.id)
+    reply(message, "Готово.")
+
+# ---------- /modlog: журнал модерации ----------
+@bot.message_handler(commands=['modlog'])
+def cmd_modlog(message: types.Message):
+    chat_id = message.chat.id
+    if message.chat.type == "private":
+        return
+    if not is_admin(chat_id, message.from_user.id):
+        reply(message, "Журнал доступен только админам.")
+        return
+    args = extract_args(message.text)
+    user_id = None
+    if message.reply_to_message:
+        user_id = message.reply_to_message.from_user.id
+    elif args:
+        try:
+            member = members.resolve(chat_id, args[0])
+        except ValueError:
+            reply(message, "Использование: /modlog [user_id|@username] или reply на сообщение")
+            return
+        if member is None and args[0].startswith("@"):
+            reply(message, f"{escape_html(args[0])} ещё не писал в этом чате")
+            return
+        user_id = member.id if member is not None else int(args[0])
+    records = audit.query(chat_id, user_id, limit=MODLOG_LIMIT)
+    if not records:
+        reply(message, "Записей нет.")
+        return
+    reply(message, escape_html(format_modlog(records, lambda uid: members.name(chat_id, uid))))
+
+# ---------- /purge: удаление недавних сообщений ----------
+PURGE_USAGE = ("Использование: /purge &lt;user_id|@username&gt; или reply — сообщения пользователя,\n"
+               "/purge last 50 — последние 50 сообщений чата, /purge since 10m — за 10 минут.\n"
+               "Можно сочетать: /purge @username since 1h")
+
+@bot.message_handler(commands=['purge'])
+def cmd_purge(message: types.Message):
+    chat_id = message.chat.id
+    if message.chat.type == "private":
+        return
+    if not is_admin(chat_id, message.from_user.id):
+        reply(message, "Чистить чат могут только админы.")
+        return
+    args = message.text.split()[1:]
+    try:
+        target, last, since = parse_purge_args(args)
+    except ValueError as e:
+        reply(message, f"{escape_html(str(e))}\n{PURGE_USAGE}")
+        return
+    user_id = None
+    if message.reply_to_message:
+        user_id = message.reply_to_message.from_user.id
+    elif target is not None:
+        member = members.resolve(chat_id, target)
+        if member is None and target.startswith("@"):
+            reply(message, f"{escape_html(target)} ещё не писал в этом чате")
+            return
+        user_id = member.id if member is not None else int(target)
+    if user_id is None and last is None and since is None:
+        reply(message, PURGE_USAGE)
+        return
+
+    # one pass over the chat's index; taken ids are not selected again by the next purge
+    ids = history.select(chat_id, user_id, since=time.time() - since if since else None, last=last, take=True)
+    # the command goes too, so the confirmation is a plain message rather than a reply
+    deleter.add(chat_id, ids + [message.message_id])
+    record_action(chat_id, message.from_user, user_id or 0, "purge", f"сообщений: {len(ids)}")
+    logger.info("Purge in chat %s by %s (%s): %d messages", chat_id, message.from_user.id, " ".join(args), len(ids))
+    notify(chat_id, bot.send_message, chat_id, f"Удаляю сообщений: {len(ids)}.")
+
+# registered after all commands: telebot picks the first matching handler, and a
+# catch-all registered earlier swallowed /mute, /ban, /config...
+bot.register_message_handler(handle_all_messages, func=lambda m: True,
+                             content_types=['text', 'sticker', 'photo', 'video', 'audio', 'document', 'voice',
+                                            'animation', 'video_note', 'location', 'contact'])
+
+# ---------- Изменения прав участников ----------
+@bot.my_chat_member_handler()
+@bot.chat_member_handler()
+def handle_member_update(upd: types.ChatMemberUpdated):
+    # keep the rights cache current without extra get_chat_member calls
+    rights.on_member_update(upd)
+    user = upd.new_chat_member.user
+    members.observe(upd.chat.id, user, time.time())
+    joined = (upd.old_chat_member.status in ("left", "kicked")
+              and upd.new_chat_member.status in ("member", "restricted"))
+    if not joined or user.id == rights.me().id:
+        return
+    chat_id = upd.chat.id
+    if raid.on_join(chat_id, user.id, time.time()):
+        # lockdown: new members stay read-only until the raid is over
+        until_ts = int(time.time() + LOCKDOWN_JOIN_MUTE_SECONDS)
+        fut = outbound.submit(PRIO_RESTRICT, chat_id, restrict_user, chat_id, user.id, until_ts)
+        fut.add_done_callback(log_errors(f"Lockdown restrict for {user.id} in {chat_id}"))
+        audit.record(chat_id, user.id, "lockdown", until=until_ts)
+
+# ---------- Рейды ----------
+def on_raid_change(chat_id: int, active: bool, reason: str):
+    if active:
+        logger.warning("Raid in chat %s (%s): lockdown on", chat_id, reason)
+        notify(chat_id, bot.send_message, chat_id,
+               "🚨 Похоже на рейд. Включён режим защиты: новые участники временно не могут писать, "
+               "лимит сообщений снижен.")
+        return
+    joiners = raid.take_restricted(chat_id)
+    logger.warning("Raid in chat %s is over: lockdown off, releasing %d joiners", chat_id, len(joiners))
+    for uid in joiners:
+        # users muted for spam meanwhile stay muted
+        if (chat_id, uid) in active_mutes:
+            continue
+        fut = outbound.submit(PRIO_RESTRICT, chat_id, unrestrict_user, chat_id, uid)
+        fut.add_done_callback(log_errors(f"Lockdown release for {uid} in {chat_id}"))
+    notify(chat_id, bot.send_message, chat_id, "Рейд закончился, режим защиты снят.")
+
+# ---------- Перегрузка ----------
+def on_overload_change(active: bool, reason: str):
+    # counting, restricts and deletes go on; summaries wait (they are sent once the backlog
+    # is gone, with every user caught meanwhile) and deletions go out in bigger batches
+    digest.hold(active)
+    deleter.interval = OVERLOAD_DELETE_INTERVAL if active else DELETE_FLUSH_INTERVAL
+
+# ---------- Снятие просроченных мьютов ----------
+def on_mute_expired(key, until_ts):
+    # called by the expiry thread exactly at the deadline, no locks held
+    chat_id, user_id = key
+    fut = outbound.submit(PRIO_RESTRICT, chat_id, unrestrict_user, chat_id, user_id)
+    fut.add_done_callback(log_errors(f"Auto unmute for {user_id} in {chat_id}"))
+
+def maintenance_loop():
+    last_evict = 0
     while True:
-        now = int(time.time())
-        to_unmute = []
-        with mutes_lock:
-            for (chat_id, user_id), until_ts in list(active_mutes.items()):
-                if until_ts <= now:
-                    to_unmute.append((chat_id, user_id))
-            for k in to_unmute:
-                active_mutes.pop(k, None)
-        for chat_id, user_id in to_unmute:
-            try:
-                unrestrict_user(chat_id, user_id)
-            except Exception:
-                logger.exception("Auto unmute failed for %s in %s", user_id, chat_id)
-        time.sleep(30)
-
-cleanup_thread = threading.Thread(target=mute_cleanup_loop, daemon=True)
-cleanup_thread.start()
-
-# ---------- Helpers ----------
-def escape_html(s: str) -> str:
-    if s is None:
-        return ""
-    return (s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;"))
+        now = time.time()
+        # ends lockdowns of chats that calmed down
+        raid.tick(now)
+        if now - last_evict >= 60:
+            recent_msgs.evict_idle()
+            history.evict_idle(now)
+            dup_index.evict_idle(now)
+            media_index.evict_idle(now)
+            last_evict = now
+        time.sleep(5)
+
+chat_rules.load()
+chat_rules.watch()
+blocklists.load()
+mute_store.start()
+audit.start()
+if recorder is not None:
+    recorder.start()
+active_mutes.start()
+maintenance_thread = threading.Thread(target=maintenance_loop, daemon=True)
+maintenance_thread.start()
+outbound.start()
+digest.start()
+deleter.start()
+dispatcher.start()
+shedder.start()
 
 # ---------- Run ----------
 if __name__ == "__main__":
+    if METRICS_LISTEN:
+        host, port = METRICS_LISTEN.rsplit(":", 1)
+        metrics.serve(host, int(port))
+    rights.me()
+    # mutes that expired while we were down are unrestricted gradually
+    mute_store.restore(active_mutes)
     logger.info("Bot started.")
-    # long polling
-    bot.infinity_polling(timeout=60, long_polling_timeout=65)
+    if WEBHOOK_LISTEN:
+        host, port = WEBHOOK_LISTEN.rsplit(":", 1)
+        server = WebhookServer(bot, host, int(port), secret_token=WEBHOOK_SECRET)
+        if WEBHOOK_URL:
+            bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=util.update_types)
+        server.serve_forever()
+    else:
+        # long polling; chat_member updates are not delivered unless requested explicitly
+        bot.infinity_polling(timeout=60, long_polling_timeout=65, allowed_updates=util.update_types)
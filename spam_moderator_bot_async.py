@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Telegram spam moderator bot, asyncio edition (AsyncTeleBot + aiohttp)
+Same rules and commands as spam_moderator_bot.py, but one event loop serves
+every chat: deletions and notifications fan out concurrently behind bounded
+semaphores and mute expiry is an asyncio task.
+Requirements:
+    pip install pyTelegramBotAPI aiohttp
+Run:
+    export BOT_TOKEN="1234:ABC..."
+    python3 spam_moderator_bot_async.py
+"""
+import os
+import time
+import asyncio
+import logging
+
+from telebot import asyncio_helper, types, util
+from telebot.async_telebot import AsyncTeleBot
+
+from bulk_delete import MAX_CHUNK
+from expiry import AsyncExpiryScheduler
+from moderation import (MUTE_PERMISSIONS, UNMUTE_PERMISSIONS, build_mute_keyboard, escape_html,
+                        extract_args, parse_duration)
+from persistence import MuteStore
+from rights_cache import ADMIN_STATUSES, RightsCache
+from window_store import WindowStore
+
+# ---------- Настройки ----------
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+if not BOT_TOKEN:
+    raise RuntimeError("BOT_TOKEN not set. Set BOT_TOKEN environment variable.")
+
+SPAM_LIMIT = 10              # больше этого числа сообщений считается спамом
+WINDOW_SECONDS = 10         # окно времени (секунд)
+AUTO_MUTE_SECONDS = 12 * 3600  # 12 часов
+DELETE_LAST_MESSAGES = 25    # сколько последних сообщений удалить при триггере
+RIGHTS_CACHE_TTL = 300       # сколько секунд доверять закэшированному статусу участника
+RIGHTS_CACHE_SIZE = 10000    # максимум записей в кэше прав
+HTTP_POOL_SIZE = 64          # одновременных соединений aiohttp к Bot API
+DELETE_CONCURRENCY = 16      # одновременных запросов на удаление
+NOTIFY_CONCURRENCY = 8       # одновременных отправок/редактирований
+WINDOW_MAX_BYTES = 64 * 1024 * 1024  # жёсткий лимит памяти окон сообщений
+WINDOW_IDLE_SECONDS = 3600   # окна неактивных пользователей удаляются через час
+MUTES_DB = os.getenv("MUTES_DB", "mutes.sqlite3")  # SQLite-файл с активными мьютами
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+asyncio_helper.REQUEST_LIMIT = HTTP_POOL_SIZE
+bot = AsyncTeleBot(BOT_TOKEN, parse_mode='HTML')
+# used only through cached()/put(): lookups are awaited here
+rights = RightsCache(bot, ttl=RIGHTS_CACHE_TTL, maxsize=RIGHTS_CACHE_SIZE)
+
+delete_sem = asyncio.Semaphore(DELETE_CONCURRENCY)
+notify_sem = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+
+# (chat_id, user_id) -> ring of (timestamp, message_id), bounded and idle-evicted
+recent_msgs = WindowStore(capacity=max(SPAM_LIMIT + 1, DELETE_LAST_MESSAGES),
+                          idle_seconds=WINDOW_IDLE_SECONDS, max_bytes=WINDOW_MAX_BYTES)
+
+# (chat_id, user_id) -> until_timestamp (unix), journaled to SQLite
+mute_store = MuteStore(MUTES_DB)
+active_mutes = AsyncExpiryScheduler(lambda key, until_ts: on_mute_expired(key, until_ts), journal=mute_store)
+
+# ---------- Утилиты ----------
+async def is_admin(chat_id: int, user_id: int) -> bool:
+    status = rights.cached(chat_id, user_id)
+    if status is None:
+        try:
+            member = await bot.get_chat_member(chat_id, user_id)
+        except Exception as e:
+            logger.exception("is_admin check failed: %s", e)
+            return False
+        status = member.status
+        rights.put(chat_id, user_id, status)
+    return status in ADMIN_STATUSES
+
+async def restrict_user(chat_id: int, user_id: int, until_ts: int):
+    await bot.restrict_chat_member(chat_id, user_id, permissions=MUTE_PERMISSIONS, until_date=until_ts)
+    logger.info("Restricted %s in %s until %s", user_id, chat_id, until_ts)
+
+async def unrestrict_user(chat_id: int, user_id: int):
+    await bot.restrict_chat_member(chat_id, user_id, permissions=UNMUTE_PERMISSIONS, until_date=None)
+    logger.info("Unrestricted %s in %s", user_id, chat_id)
+
+async def ban_user(chat_id: int, user_id: int):
+    await bot.kick_chat_member(chat_id, user_id)
+    logger.info("Banned %s from %s", user_id, chat_id)
+
+async def unban_user(chat_id: int, user_id: int):
+    await bot.unban_chat_member(chat_id, user_id)
+    logger.info("Unbanned %s in %s", user_id, chat_id)
+
+async def notify(coro):
+    # sends/edits share NOTIFY_CONCURRENCY slots; failures are only logged
+    async with notify_sem:
+        try:
+            return await coro
+        except Exception as e:
+            logger.warning("Notification failed: %s", e)
+
+async def reply(message: types.Message, text: str, **kwargs):
+    return await notify(bot.reply_to(message, text, **kwargs))
+
+async def _delete_one(chat_id: int, message_id: int) -> bool:
+    async with delete_sem:
+        try:
+            await bot.delete_message(chat_id, message_id)
+            return True
+        except Exception:
+            return False
+
+async def _delete_chunk(chat_id: int, ids: list):
+    async with delete_sem:
+        try:
+            await bot.delete_messages(chat_id, ids)
+            return len(ids), 0
+        except Exception as e:
+            logger.warning("deleteMessages failed in %s (%d ids), falling back: %s", chat_id, len(ids), e)
+    results = await asyncio.gather(*(_delete_one(chat_id, mid) for mid in ids))
+    deleted = sum(results)
+    return deleted, len(ids) - deleted
+
+async def delete_messages(chat_id: int, ids: list):
+    """Bulk delete in chunks of 100, all chunks concurrently; returns (deleted, failed)."""
+    ids = sorted(set(ids))
+    chunks = [ids[i:i + MAX_CHUNK] for i in range(0, len(ids), MAX_CHUNK)]
+    results = await asyncio.gather(*(_delete_chunk(chat_id, c) for c in chunks))
+    return sum(d for d, _ in results), sum(f for _, f in results)
+
+# ---------- Команды: /mute /ban /unmute /unban ----------
+async def resolve_target(message: types.Message, uid_token: str):
+    try:
+        uid = int(uid_token)
+    except ValueError:
+        await reply(message, "user_id должен быть числом")
+        return None
+    try:
+        return (await bot.get_chat_member(message.chat.id, uid)).user
+    except Exception as e:
+        await reply(message, f"Не удалось найти участника {uid}: {e}")
+        return None
+
+@bot.message_handler(commands=['mute'])
+async def cmd_mute(message: types.Message):
+    chat_id = message.chat.id
+    args = extract_args(message.text)
+    if not message.reply_to_message and len(args) < 2:
+        await reply(message, "Использование (reply): /mute 1d причина\nИли: /mute <user_id> <duration> [причина]")
+        return
+
+    if message.reply_to_message:
+        target_user = message.reply_to_message.from_user
+        if not args:
+            await reply(message, "Укажи длительность, напр. /mute 1d причина")
+            return
+        duration_token = args[0]
+        reason = args[1] if len(args) > 1 else ""
+    else:
+        target_user = await resolve_target(message, args[0])
+        if target_user is None:
+            return
+        # extract_args leaves "<duration> [причина]" in one piece
+        duration_token, _, reason = args[1].partition(" ")
+
+    try:
+        seconds = parse_duration(duration_token)
+    except Exception as e:
+        await reply(message, f"Неправильный формат длительности: {e}")
+        return
+
+    until_ts = int(time.time() + seconds)
+    try:
+        await restrict_user(chat_id, target_user.id, until_ts)
+    except Exception:
+        await reply(message, "Не удалось замутить пользователя (проверь права бота).")
+        return
+    active_mutes.schedule((chat_id, target_user.id), until_ts)
+
+    user_mention = f"<a href='tg://user?id={target_user.id}'>{escape_html(target_user.first_name)}</a>"
+    await asyncio.gather(
+        reply(message, f"Пользователь {user_mention} замучен до {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(until_ts))}. Причина: {escape_html(reason)}"),
+        notify(bot.send_message(chat_id, f"Пользователь {user_mention} замучен.", reply_markup=build_mute_keyboard(target_user.id))),
+    )
+
+@bot.message_handler(commands=['ban'])
+async def cmd_ban(message: types.Message):
+    chat_id = message.chat.id
+    args = extract_args(message.text)
+    if not message.reply_to_message and not args:
+        await reply(message, "Использование (reply): /ban причина\nИли: /ban <user_id> [причина]")
+        return
+
+    if message.reply_to_message:
+        target_user = message.reply_to_message.from_user
+        reason = args[0] if args else ""
+    else:
+        target_user = await resolve_target(message, args[0])
+        if target_user is None:
+            return
+        reason = args[1] if len(args) > 1 else ""
+
+    try:
+        await ban_user(chat_id, target_user.id)
+    except Exception:
+        await reply(message, "Не удалось забанить пользователя (проверь права бота).")
+        return
+    active_mutes.cancel((chat_id, target_user.id))
+
+    user_mention = f"<a href='tg://user?id={target_user.id}'>{escape_html(target_user.first_name)}</a>"
+    await reply(message, f"Пользователь {user_mention} забанен. Причина: {escape_html(reason)}")
+
+@bot.message_handler(commands=['unmute'])
+async def cmd_unmute(message: types.Message):
+    chat_id = message.chat.id
+    args = extract_args(message.text)
+    if message.reply_to_message:
+        target_user = message.reply_to_message.from_user
+    else:
+        if not args:
+            await reply(message, "Использование: /unmute <user_id> или reply на сообщение")
+            return
+        target_user = await resolve_target(message, args[0])
+        if target_user is None:
+            return
+    try:
+        await unrestrict_user(chat_id, target_user.id)
+    except Exception:
+        await reply(message, "Не удалось размутить (проверь права бота).")
+        return
+    active_mutes.cancel((chat_id, target_user.id))
+    await reply(message, f"Пользователь <a href='tg://user?id={target_user.id}'>{escape_html(target_user.first_name)}</a> размучен.")
+
+@bot.message_handler(commands=['unban'])
+async def cmd_unban(message: types.Message):
+    chat_id = message.chat.id
+    args = extract_args(message.text)
+    if not args:
+        await reply(message, "Использование: /unban <user_id>")
+        return
+    try:
+        uid = int(args[0])
+        await unban_user(chat_id, uid)
+    except Exception as e:
+        await reply(message, f"Не удалось разбанить: {e}")
+        return
+    await reply(message, f"Пользователь {uid} разбанен.")
+
+# ---------- Обработка сообщений (спам детект) ----------
+@bot.message_handler(func=lambda m: True, content_types=['text','sticker','photo','video','audio','document','voice','animation','video_note','location','contact'])
+async def handle_all_messages(message: types.Message):
+    if message.chat.type == "private":
+        return
+
+    chat_id = message.chat.id
+    user_id = message.from_user.id
+    now = time.time()
+
+    # no await before the mute is reserved, so updates of one chat can't interleave here
+    count = recent_msgs.add(chat_id, user_id, now, message.message_id, WINDOW_SECONDS)
+    if count <= SPAM_LIMIT:
+        return
+    until_ts = int(now + AUTO_MUTE_SECONDS)
+    if not active_mutes.add((chat_id, user_id), until_ts):
+        logger.debug("User %s in chat %s already muted", user_id, chat_id)
+        return
+
+    try:
+        await restrict_user(chat_id, user_id, until_ts)
+    except Exception as e:
+        logger.error("Failed to restrict: %s", e)
+        active_mutes.cancel((chat_id, user_id))
+        await reply(message, "Не могу замутить пользователя — проверь права бота (должен быть админ).")
+        return
+
+    to_delete = recent_msgs.message_ids(chat_id, user_id, last=DELETE_LAST_MESSAGES, since=now - WINDOW_SECONDS)
+    user_mention = f"<a href='tg://user?id={user_id}'>{escape_html(message.from_user.first_name)}</a>"
+    text = f"Пользователь {user_mention} автоматически замучен за спам на 12 часов."
+    # purge and notification go out concurrently
+    (deleted, failed), _ = await asyncio.gather(
+        delete_messages(chat_id, to_delete),
+        notify(bot.send_message(chat_id, text, reply_markup=build_mute_keyboard(user_id))),
+    )
+    logger.info("Auto-mute: deleted %d (failed %d) messages of user %s in chat %s", deleted, failed, user_id, chat_id)
+
+# ---------- Callback query (кнопки) ----------
+@bot.callback_query_handler(func=lambda call: True)
+async def handle_callback(call: types.CallbackQuery):
+    logger.info("Callback received: %s from %s", call.data, call.from_user.id)
+    data = (call.data or "").strip()
+    if ":" not in data:
+        await bot.answer_callback_query(call.id, "Неправильные данные.")
+        return
+    action, sid = data.split(":", 1)
+    try:
+        target_id = int(sid)
+    except ValueError:
+        await bot.answer_callback_query(call.id, "Неправильный id.")
+        return
+
+    chat_id = call.message.chat.id
+    if not await is_admin(chat_id, call.from_user.id):
+        await bot.answer_callback_query(call.id, "Только администратор может нажимать эти кнопки.")
+        return
+
+    if action == "U":  # unmute
+        try:
+            await unrestrict_user(chat_id, target_id)
+        except Exception:
+            await bot.answer_callback_query(call.id, "Не удалось размутить (проверь права бота).")
+            return
+        active_mutes.cancel((chat_id, target_id))
+        done, answer = "размучен", "Пользователь размучен."
+    elif action == "B":  # ban
+        try:
+            await ban_user(chat_id, target_id)
+        except Exception:
+            await bot.answer_callback_query(call.id, "Не удалось забанить (проверь права бота).")
+            return
+        active_mutes.cancel((chat_id, target_id))
+        done, answer = "забанен", "Пользователь забанен."
+    else:
+        await bot.answer_callback_query(call.id, "Неизвестное действие.")
+        return
+    await asyncio.gather(
+        notify(bot.edit_message_text(chat_id=chat_id, message_id=call.message.message_id,
+                                     text=f"Пользователь <a href='tg://user?id={target_id}'>пользователь</a> был {done} администратором.")),
+        bot.answer_callback_query(call.id, answer),
+    )
+
+# ---------- Изменения прав участников ----------
+@bot.my_chat_member_handler()
+@bot.chat_member_handler()
+async def handle_member_update(upd: types.ChatMemberUpdated):
+    rights.on_member_update(upd)
+
+# ---------- Снятие просроченных мьютов ----------
+async def on_mute_expired(key, until_ts):
+    chat_id, user_id = key
+    try:
+        await unrestrict_user(chat_id, user_id)
+    except Exception:
+        logger.exception("Auto unmute failed for %s in %s", user_id, chat_id)
+
+async def maintenance_loop():
+    while True:
+        recent_msgs.evict_idle()
+        await asyncio.sleep(60)
+
+# ---------- Run ----------
+async def main():
+    mute_store.start()
+    mute_store.restore(active_mutes)
+    tasks = [asyncio.create_task(active_mutes.run()), asyncio.create_task(maintenance_loop())]
+    logger.info("Async bot started.")
+    try:
+        await bot.infinity_polling(timeout=60, request_timeout=65, allowed_updates=util.update_types)
+    finally:
+        for t in tasks:
+            t.cancel()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,90 +1,263 @@
 # telegram_spam_moderator_delete.py
 import time
 import threading
-from collections import defaultdict, deque
 import re
 import telebot
-from telebot import types
+from telebot import types, util
 
 import os
-bot = telebot.TeleBot(os.getenv("BOT_TOKEN"))
-
+import metrics
+from adaptive import AdaptiveLimits
+from audit import AuditLog
+from blocklist import BlocklistStore, url_host
+from bulk_delete import BulkDeleter
+from chat_history import ChatHistory
+from chat_rules import FIELDS, Rules, RulesError, RulesStore, describe, parse_field
+from content_index import DuplicateIndex
+from media_index import MediaIndex
+from member_directory import MemberDirectory
+from moderation import build_mute_summary, format_duration, format_modlog, parse_purge_args
+from notifications import NotificationAggregator
+from raid import RaidDetector
+from dispatcher import OrderedDispatcher
+from expiry import ExpiryScheduler
+from load_shedder import LoadShedder
+from outbound import OutboundScheduler, PRIO_NOTIFY, PRIO_RESTRICT, log_errors
+from persistence import MuteStore
+from recorder import UpdateRecorder
+from rights_cache import RightsCache
+from shards import Sharded
+from transport import Transport
+from webhook import WebhookServer
+from window_store import WindowStore
+
+# общий пул соединений, ожидание retry_after и повторы для всех вызовов API
+transport = Transport(pool_size=16).install()
+# threaded=False: обработчики выполняются в воркерах диспетчера, по порядку внутри чата
+bot = telebot.TeleBot(os.getenv("BOT_TOKEN"), threaded=False)
+dispatcher = OrderedDispatcher(workers=8).install(bot)
+
+# MAX_MSG, WINDOW_SECONDS, MUTE_SECONDS, DELETE_LAST, LOCKDOWN_MAX_MSG - значения по умолчанию,
+# для отдельных чатов они задаются в RULES_FILE или командой /config
 MAX_MSG = 10            # порог сообщений (если > MAX_MSG -> мут)
 WINDOW_SECONDS = 10     # окно в секундах
 MUTE_SECONDS = 12 * 3600  # 12 часов
 CLEAN_SLEEP = 10        # интервал фонового потока в секундах
 DELETE_LAST = 25        # сколько последних сообщений удалять
+ADAPTIVE = False        # порог по базовой активности чата вместо MAX_MSG (/config adaptive 1)
+ADAPTIVE_MIN = 5        # адаптивный порог не ниже
+ADAPTIVE_MAX = 30       # и не выше
+MAX_TRACKED = 50        # сколько последних сообщений хранится на пользователя (потолок для /config)
+HISTORY_SIZE = 20000    # сколько последних сообщений чата помнить для /purge
+HISTORY_TOTAL = 5_000_000  # всего по всем чатам (~20 байт на сообщение), дальше вытесняются тихие чаты
+RULES_FILE = os.getenv("RULES_FILE", "chat_rules.json")  # правила по чатам, перечитываются при изменении
+BLOCKLIST_FILE = os.getenv("BLOCKLIST_FILE", "blocklist.json")  # запрещённые фразы и домены по чатам
+BLOCK_INVITES = False   # удалять ссылки-приглашения t.me/+... (по умолчанию; /block invites в чате)
+RIGHTS_TTL = 300        # время жизни записи в кэше прав (сек)
+RIGHTS_MAX = 10000      # максимум записей в кэше прав
+OVERLOAD_DEPTH = 2000   # столько апдейтов в очереди -> режим перегрузки (выход, когда < 10% и лаг < 1 с)
+OVERLOAD_LAG = 5        # или апдейт ждёт в очереди дольше этого (сек)
+DELETE_SLEEP = 1        # пауза delete worker между пачками удалений
+OVERLOAD_DELETE_SLEEP = 3  # в перегрузке удаления копятся дольше и уходят крупными пачками
+NOTIFY_DELAY = 2        # уведомления об автомутах копятся столько секунд и уходят одним сообщением
+NOTIFY_MAX_USERS = 20   # пользователей в одном сводном сообщении
+MEMBERS_MAX = 100000    # сколько (чат, пользователь) с именами помнить для /mute @username
+WINDOW_MAX_BYTES = 64 * 1024 * 1024  # лимит памяти под окна сообщений
+WINDOW_IDLE = 3600      # окна неактивных пользователей удаляются через час
+STATE_SHARDS = 32       # число независимых шардов состояния (у каждого свой lock)
+DUP_WINDOW = 600        # окно поиска одинаковых сообщений от разных пользователей (сек)
+DUP_MIN_USERS = 3       # столько разных пользователей с одним текстом -> мут всем
+DUP_MAX_DISTANCE = 8    # макс. число отличающихся бит SimHash (0 = только точные копии)
+MEDIA_WINDOW = 300      # окно учёта повторов одного и того же файла (по file_unique_id)
+MEDIA_PER_USER = 3      # больше стольких одинаковых файлов от одного пользователя -> мут
+MEDIA_MIN_USERS = 5     # один файл от стольких разных пользователей -> мут всем (кроме стикеров)
+RAID_WINDOW = 60        # окно счётчиков рейда по чату (сек)
+RAID_JOINS = 20         # столько вступлений за окно -> режим защиты
+RAID_NEW_MSGS = 10      # столько первых сообщений от недавно вступивших за окно -> режим защиты
+RAID_MSGS = 300         # столько сообщений в чате за окно -> режим защиты
+RAID_COOLDOWN = 300     # режим снимается после стольких секунд затишья
+LOCKDOWN_MAX_MSG = 3    # порог сообщений на пользователя во время рейда
+LOCKDOWN_JOIN_MUTE = 2 * 3600  # новички ограничены до конца рейда, но не дольше этого
+MUTES_DB = os.getenv("MUTES_DB", "muted_users.sqlite3")  # файл с активными мутами
+AUDIT_DB = os.getenv("AUDIT_DB", "moderation_audit.sqlite3")  # журнал действий модерации (/modlog)
+AUDIT_DAYS = 90         # записи журнала старше удаляются
+MODLOG_LIMIT = 15       # сколько последних действий показывает /modlog
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN")  # "host:port" -> режим webhook вместо polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")        # публичный URL для setWebhook (необязательно)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # секрет для X-Telegram-Bot-Api-Secret-Token
+METRICS_LISTEN = os.getenv("METRICS_LISTEN")  # "host:port" -> Prometheus /metrics (по умолчанию выключено)
+RECORD_DIR = os.getenv("RECORD_DIR")  # каталог записи сообщений (только хэши) для replay.py; не задан -> выключено
 # -------------------------
 
-# key: "chat_id:user_id" -> deque([timestamps...])
-user_messages = defaultdict(lambda: deque())
-# key: "chat_id:user_id" -> deque([message_ids...])
-user_msg_ids = defaultdict(lambda: deque())
-# muted users: key -> until_timestamp
-muted_users = {}
-lock = threading.Lock()
-
-def key(chat_id: int, user_id: int) -> str:
-    return f"{chat_id}:{user_id}"
-
-def clean_old_timestamps(dq: deque, now: int):
-    while dq and (now - dq[0][0]) > WINDOW_SECONDS:
-        dq.popleft()
+# key: (chat_id, user_id) -> кольцо последних (timestamp, message_id);
+# шард выбирается по chat_id, чаты из разных шардов не ждут друг друга
+user_messages = Sharded(lambda: WindowStore(capacity=MAX_TRACKED,
+                                            idle_seconds=WINDOW_IDLE,
+                                            max_bytes=WINDOW_MAX_BYTES // STATE_SHARDS),
+                        shards=STATE_SHARDS)
+# chat_id -> кольцо (timestamp, message_id, user_id) в массивах; /purge выбирает из него за один проход
+history = ChatHistory(capacity=HISTORY_SIZE, max_entries=HISTORY_TOTAL)
+# muted users: key -> until_timestamp, по истечении вызывается unmute_expired;
+# изменения пишутся в SQLite фоновым потоком
+mute_store = MuteStore(MUTES_DB)
+muted_users = ExpiryScheduler(lambda k, until: unmute_expired(k, until), journal=mute_store)
+# журнал действий модерации: запись только кладётся в очередь, пишет фоновый поток пачками
+audit = AuditLog(AUDIT_DB, retention_days=AUDIT_DAYS)
+rights = RightsCache(bot, ttl=RIGHTS_TTL, maxsize=RIGHTS_MAX)
+# имена и username участников из апдейтов: команды и кнопки не ходят в get_chat_member
+members = MemberDirectory(maxsize=MEMBERS_MAX)
+# правила по чатам: неизменяемые Rules, атомарная подмена при перечитывании файла
+chat_rules = RulesStore(RULES_FILE, Rules(spam_limit=MAX_MSG, window_seconds=WINDOW_SECONDS,
+                                          mute_seconds=MUTE_SECONDS, delete_last=DELETE_LAST,
+                                          lockdown_limit=LOCKDOWN_MAX_MSG, adaptive=int(ADAPTIVE),
+                                          adaptive_floor=ADAPTIVE_MIN, adaptive_ceiling=ADAPTIVE_MAX),
+                        max_messages=MAX_TRACKED)
+# блоклист: запрещённые фразы (Aho-Corasick), домены ссылок, инвайт-ссылки; проверяется до подсчёта
+blocklists = BlocklistStore(BLOCKLIST_FILE, default_invites=BLOCK_INVITES)
+# базовая активность чатов (EWMA по числу сообщений пользователя за окно) для adaptive=1
+baselines = AdaptiveLimits()
+# почти одинаковые тексты от разных пользователей (SimHash + LSH по чатам)
+dup_index = DuplicateIndex(window=DUP_WINDOW, max_distance=DUP_MAX_DISTANCE, min_users=DUP_MIN_USERS)
+# повторы одного и того же файла (file_unique_id), без скачивания
+media_index = MediaIndex(window=MEDIA_WINDOW, per_user_limit=MEDIA_PER_USER, min_users=MEDIA_MIN_USERS)
+# рейды: вступления / первые сообщения новичков / общий поток сообщений по чату
+raid = RaidDetector(window=RAID_WINDOW, join_limit=RAID_JOINS, new_msg_limit=RAID_NEW_MSGS,
+                    msg_limit=RAID_MSGS, cooldown=RAID_COOLDOWN,
+                    on_change=lambda chat_id, active, reason: on_raid_change(chat_id, active, reason))
+# все исходящие вызовы Bot API идут через планировщик (лимиты + приоритеты)
+outbound = OutboundScheduler()
+deleter = BulkDeleter(bot, scheduler=outbound)
+# автомуты одной волны - одно сводное сообщение на чат, оно редактируется по мере поимки
+digest = NotificationAggregator(
+    render=lambda chat_id, entries: build_mute_summary(entries, f"unmute:{chat_id}:{{user_id}}",
+                                                       f"ban:{chat_id}:{{user_id}}"),
+    send=lambda chat_id, text, kb: send(chat_id, text, reply_markup=kb, parse_mode="HTML"),
+    edit=lambda chat_id, message_id, text, kb: outbound.submit(PRIO_NOTIFY, chat_id, bot.edit_message_text, text,
+                                                               chat_id, message_id, reply_markup=kb,
+                                                               parse_mode="HTML"),
+    delay=NOTIFY_DELAY, max_users=NOTIFY_MAX_USERS)
+
+# запись id, времени и хэшей содержимого сообщений для replay.py; только если задан RECORD_DIR
+recorder = UpdateRecorder(RECORD_DIR) if RECORD_DIR else None
+
+# режим перегрузки: при большой очереди апдейтов необязательная работа пропускается
+shedder = LoadShedder(dispatcher.queue_depth, dispatcher.lag, enter_depth=OVERLOAD_DEPTH,
+                      exit_depth=OVERLOAD_DEPTH // 10, enter_lag=OVERLOAD_LAG,
+                      on_change=lambda active, reason: on_overload_change(active, reason))
+
+# метрики: счётчики ничего не стоят, пока не задан METRICS_LISTEN; gauges считаются при запросе
+auto_mutes = metrics.counter("moderator_auto_mutes_total", "Users muted automatically for flooding")
+blocked_messages = metrics.counter("moderator_blocked_messages_total", "Messages deleted by the blocklist", "kind")
+metrics.gauge("moderator_active_mutes", "Mutes waiting for expiry", lambda: len(muted_users))
+metrics.gauge("moderator_window_entries", "Tracked (chat, user) message windows",
+              lambda: sum(s.stats()["entries"] for s in user_messages))
+metrics.gauge("moderator_window_bytes", "Approximate memory of message windows",
+              lambda: sum(s.stats()["bytes"] for s in user_messages))
+metrics.gauge("moderator_history_messages", "Messages in the /purge index", lambda: history.stats()["entries"])
+metrics.gauge("moderator_dispatcher_queue_depth", "Updates waiting in dispatcher queues", dispatcher.queue_depth)
+metrics.gauge("moderator_dispatcher_lag_seconds", "Worst queueing delay of a dispatcher worker", dispatcher.lag)
+metrics.gauge("moderator_outbound_queue_depth", "Bot API calls waiting in the outbound scheduler",
+              outbound.queue_depth)
+metrics.gauge("moderator_duplicate_index_entries", "Messages in the near-duplicate index",
+              lambda: dup_index.stats()["entries"])
+metrics.gauge("moderator_media_index_files", "Files tracked by the repeated-media index", lambda: len(media_index))
+metrics.gauge("moderator_raid_lockdowns", "Chats currently in raid lockdown", raid.lockdowns)
+metrics.gauge("moderator_notification_summaries_pending", "Summary messages waiting to be sent or edited",
+              digest.pending)
+metrics.gauge("moderator_overloaded", "1 while the bot is shedding load", lambda: int(shedder.active))
+metrics.gauge("moderator_member_directory_entries", "Chat members known by name", lambda: len(members))
+
+def key(chat_id: int, user_id: int) -> tuple:
+    return (chat_id, user_id)
 
 def bot_has_restrict_rights(chat_id: int) -> bool:
     try:
-        me = bot.get_me()
-        bot_member = bot.get_chat_member(chat_id, me.id)
-        return bot_member.status in ('administrator', 'creator')
+        return rights.bot_is_admin(chat_id)
     except Exception:
         return False
 
+def notify(chat_id: int, fn, /, *args, **kwargs):
+    """Вызов API с низким приоритетом через outbound; обработчик не ждёт, ошибки только логируются"""
+    fut = outbound.submit(PRIO_NOTIFY, chat_id, fn, *args, **kwargs)
+    fut.add_done_callback(log_errors(getattr(fn, "__name__", "notify")))
+    return fut
+
+def send(chat_id: int, text: str, **kwargs):
+    """Уведомление в чат"""
+    return notify(chat_id, bot.send_message, chat_id, text, **kwargs)
+
+def reply(message: types.Message, text: str, **kwargs):
+    """Ответ на команду"""
+    return notify(message.chat.id, bot.reply_to, message, text, **kwargs)
+
+def answer(cq: types.CallbackQuery, text: str, **kwargs):
+    """Ответ на нажатие кнопки, в корзине чата, где она нажата"""
+    chat_id = cq.message.chat.id if cq.message else 0
+    return notify(chat_id, bot.answer_callback_query, cq.id, text, **kwargs)
+
+def record_action(chat_id: int, actor: types.User, user_id: int, action: str, reason: str = None, until=None):
+    """Действие админа в журнал; админ попадает и в members, чтобы /modlog показал его имя, а не id"""
+    members.observe(chat_id, actor, time.time())
+    audit.record(chat_id, user_id, action, actor.id, reason, until)
+
+def queue_delete(chat_id: int, message_ids):
+    """Удаление пачкой через deleter; id убираются и из индекса /purge, чтобы он не выбрал их снова"""
+    history.discard(chat_id, message_ids)
+    deleter.add(chat_id, message_ids)
+
+def restrict(chat_id: int, user_id: int, perms: types.ChatPermissions, until=None):
+    """restrict_chat_member с наивысшим приоритетом, возвращает Future"""
+    return outbound.submit(PRIO_RESTRICT, chat_id, bot.restrict_chat_member,
+                           chat_id, user_id, permissions=perms, until_date=until)
+
+def unmute_expired(k: tuple, until: int):
+    """Вызывается потоком ExpiryScheduler точно в момент истечения мута, без блокировок"""
+    chat_id, user_id = k
+    perms = types.ChatPermissions(
+        can_send_messages=True,
+        can_send_media_messages=True,
+        can_send_other_messages=True,
+        can_add_web_page_previews=True
+    )
+    restrict(chat_id, user_id, perms).add_done_callback(log_errors(f"unmute {k}"))
+
 def schedule_unmute_worker():
+    muted_users.start()
+    # отдельный поток только для вытеснения неактивных окон
     def worker():
         while True:
-            now = int(time.time())
-            with lock:
-                to_unmute = [k for k, until in muted_users.items() if now >= until]
-                for k in to_unmute:
-                    try:
-                        chat_s, user_s = k.split(":")
-                        chat_id = int(chat_s); user_id = int(user_s)
-                        perms = types.ChatPermissions(
-                            can_send_messages=True,
-                            can_send_media_messages=True,
-                            can_send_other_messages=True,
-                            can_add_web_page_previews=True
-                        )
-                        bot.restrict_chat_member(chat_id, user_id, permissions=perms)
-                    except Exception as e:
-                        print("unmute error for", k, e)
-                    finally:
-                        if k in muted_users:
-                            del muted_users[k]
+            for shard in user_messages:
+                shard.evict_idle()
+            dup_index.evict_idle(time.time())
+            history.evict_idle(time.time())
+            media_index.evict_idle(time.time())
+            # снимает режим защиты в чатах, где рейд закончился
+            raid.tick(time.time())
             time.sleep(CLEAN_SLEEP)
     t = threading.Thread(target=worker, daemon=True)
     t.start()
 
+def sweep_muted(chat_id: int, user_id: int):
+    """Последние delete_last сообщений замученного из его окна - на удаление.
+    Вызывается при муте и при каждом сообщении замученного, без обхода всех мутов"""
+    ids = user_messages[chat_id].take_ids(chat_id, user_id)
+    ids = ids[-chat_rules.get(chat_id).delete_last:]
+    if ids:
+        queue_delete(chat_id, ids)
+
 def schedule_delete_worker():
     def worker():
         while True:
-            with lock:
-                for k in list(muted_users.keys()):
-                    chat_id, user_id = map(int, k.split(":"))
-                    dq_ids = user_msg_ids.get(k, deque())
-                    while dq_ids:
-                        msg_id = dq_ids.popleft()
-                        try:
-                            bot.delete_message(chat_id, msg_id)
-                        except Exception:
-                            pass
-            time.sleep(1)
+            # удаление пачками через deleteMessages
+            deleter.flush()
+            # в перегрузке реже и крупнее
+            time.sleep(OVERLOAD_DELETE_SLEEP if shedder.active else DELETE_SLEEP)
     t = threading.Thread(target=worker, daemon=True)
     t.start()
 
 def parse_time_string(s: str) -> int:
     """Парсит время в секундах. Формат: 10s, 5m, 2h, 1d"""
-    pattern = r"(\d+)([smHd])"
+    pattern = r"(\d+)([smhHd])"
     m = re.match(pattern, s)
     if not m:
         return None
@@ -101,34 +274,66 @@ def parse_time_string(s: str) -> int:
         return val * 86400
     return None
 
+def command_target(message: types.Message, parts: list):
+    """Цель команды: автор сообщения, на которое ответили, или @username / id вторым словом.
+    Возвращает (user_id, имя, parts без цели) или None; имена берутся из members, без запросов к API.
+    id, которого нет в members (например, после рестарта), возвращается как есть с именем None"""
+    if message.reply_to_message:
+        target = message.reply_to_message.from_user
+        return target.id, target.full_name, parts
+    if len(parts) < 2:
+        return None
+    try:
+        member = members.resolve(message.chat.id, parts[1])
+    except ValueError:
+        return None
+    if member is None:
+        if parts[1].startswith("@"):
+            return None
+        return int(parts[1]), None, parts[:1] + parts[2:]
+    return member.id, member.full_name, parts[:1] + parts[2:]
+
+def member_name(chat_id: int, user_id: int) -> str:
+    """Имя для уведомления: из members, иначе у API; в перегрузке - просто id"""
+    member = members.get(chat_id, user_id)
+    if member is not None:
+        return member.full_name
+    if shedder.shed("member_lookup"):
+        return str(user_id)
+    try:
+        return bot.get_chat_member(chat_id, user_id).user.full_name
+    except Exception:
+        return str(user_id)
+
 # -------------------- Команды модерации --------------------
 @bot.message_handler(commands=['mute', 'ban'])
 def on_command(message: types.Message):
-    """Команды вида /mute 2d ответ_пользователю комментарий"""
+    """Команды вида /mute 2d комментарий (ответом на сообщение) или /mute @username 2d комментарий"""
     if message.chat.type != 'supergroup':
         return
     if not bot_has_restrict_rights(message.chat.id):
-        bot.reply_to(message, "Бот должен быть админом с правами.")
+        reply(message, "Бот должен быть админом с правами.")
         return
-    if not message.reply_to_message:
-        bot.reply_to(message, "Команду нужно использовать ответом на сообщение пользователя.")
+    target = command_target(message, message.text.split())
+    if target is None:
+        reply(message, "Ответьте на сообщение пользователя или укажите id либо @username того, "
+                              "кто уже писал в чате.")
         return
 
-    parts = message.text.split()
+    user_id, target_name, parts = target
     if len(parts) < 2:
-        bot.reply_to(message, "Укажите время и комментарий: /mute 2d причина")
+        reply(message, "Укажите время и комментарий: /mute 2d причина")
         return
 
     time_str = parts[1]
     duration = parse_time_string(time_str)
     if duration is None:
-        bot.reply_to(message, "Неверный формат времени. Пример: 10s, 5m, 2h, 1d")
+        reply(message, "Неверный формат времени. Пример: 10s, 5m, 2h, 1d")
         return
 
     comment = " ".join(parts[2:]) if len(parts) > 2 else ""
 
     chat_id = message.chat.id
-    user_id = message.reply_to_message.from_user.id
     k = key(chat_id, user_id)
 
     try:
@@ -140,77 +345,251 @@ def on_command(message: types.Message):
                 can_add_web_page_previews=False
             )
             until = int(time.time()) + duration
-            bot.restrict_chat_member(chat_id, user_id, permissions=perms, until_date=until)
-            with lock:
-                muted_users[k] = until
-            bot.send_message(chat_id,
-                             f"⚠️ Пользователь <a href='tg://user?id={user_id}'>"
-                             f"{message.reply_to_message.from_user.full_name}</a> замучен на {time_str}. {comment}",
-                             parse_mode="HTML")
+            restrict(chat_id, user_id, perms, until).result()
+            muted_users.schedule(k, until)
+            sweep_muted(chat_id, user_id)
+            record_action(chat_id, message.from_user, user_id, "mute", comment, until)
+            send(chat_id,
+                 f"⚠️ Пользователь <a href='tg://user?id={user_id}'>"
+                 f"{target_name or member_name(chat_id, user_id)}</a> замучен на {time_str}. {comment}",
+                 parse_mode="HTML")
         elif message.text.startswith("/ban"):
-            bot.kick_chat_member(chat_id, user_id)
-            with lock:
-                if k in muted_users: del muted_users[k]
-                if k in user_messages: del user_messages[k]
-                if k in user_msg_ids: del user_msg_ids[k]
-            bot.send_message(chat_id,
-                             f"⛔ Пользователь <a href='tg://user?id={user_id}'>"
-                             f"{message.reply_to_message.from_user.full_name}</a> забанен. {comment}",
-                             parse_mode="HTML")
+            outbound.call(PRIO_RESTRICT, chat_id, bot.kick_chat_member, chat_id, user_id)
+            muted_users.cancel(k)
+            record_action(chat_id, message.from_user, user_id, "ban", comment)
+            user_messages[chat_id].discard(chat_id, user_id)
+            send(chat_id,
+                 f"⛔ Пользователь <a href='tg://user?id={user_id}'>"
+                 f"{target_name or member_name(chat_id, user_id)}</a> забанен. {comment}",
+                 parse_mode="HTML")
     except Exception as e:
-        bot.reply_to(message, f"Ошибка: {e}")
+        reply(message, f"Ошибка: {e}")
 
 @bot.message_handler(commands=['unmute', 'unban'])
 def on_unmute_unban_command(message: types.Message):
-    """Команды /unmute и /unban через ответ на пользователя"""
+    """Команды /unmute и /unban ответом на сообщение пользователя или с @username / id"""
     if message.chat.type != 'supergroup':
         return
     if not bot_has_restrict_rights(message.chat.id):
-        bot.reply_to(message, "Бот должен быть админом с правами.")
+        reply(message, "Бот должен быть админом с правами.")
         return
-    if not message.reply_to_message:
-        bot.reply_to(message, "Команду нужно использовать ответом на сообщение пользователя.")
+    target = command_target(message, message.text.split())
+    if target is None:
+        reply(message, "Ответьте на сообщение пользователя или укажите id либо @username того, "
+                              "кто уже писал в чате.")
         return
 
     chat_id = message.chat.id
-    user_id = message.reply_to_message.from_user.id
+    user_id, target_name, parts = target
     k = key(chat_id, user_id)
-    comment = " ".join(message.text.split()[1:]) if len(message.text.split()) > 1 else ""
+    comment = " ".join(parts[1:])
 
     try:
         if message.text.startswith("/unmute"):
-            with lock:
-                if k not in muted_users:
-                    bot.reply_to(message, "Пользователь не находится в муте.")
-                    return
-                perms = types.ChatPermissions(
-                    can_send_messages=True,
-                    can_send_media_messages=True,
-                    can_send_other_messages=True,
-                    can_add_web_page_previews=True
-                )
-                bot.restrict_chat_member(chat_id, user_id, permissions=perms)
-                del muted_users[k]
-            bot.send_message(chat_id,
-                             f"🔊 Пользователь <a href='tg://user?id={user_id}'>"
-                             f"{message.reply_to_message.from_user.full_name}</a> был размучен. {comment}",
-                             parse_mode="HTML")
+            if k not in muted_users:
+                reply(message, "Пользователь не находится в муте.")
+                return
+            perms = types.ChatPermissions(
+                can_send_messages=True,
+                can_send_media_messages=True,
+                can_send_other_messages=True,
+                can_add_web_page_previews=True
+            )
+            restrict(chat_id, user_id, perms).result()
+            muted_users.cancel(k)
+            record_action(chat_id, message.from_user, user_id, "unmute", comment)
+            send(chat_id,
+                 f"🔊 Пользователь <a href='tg://user?id={user_id}'>"
+                 f"{target_name or member_name(chat_id, user_id)}</a> был размучен. {comment}",
+                 parse_mode="HTML")
         elif message.text.startswith("/unban"):
             try:
-                bot.unban_chat_member(chat_id, user_id)
+                outbound.call(PRIO_RESTRICT, chat_id, bot.unban_chat_member, chat_id, user_id)
             except Exception as e:
-                bot.reply_to(message, f"Ошибка при разбане: {e}")
+                reply(message, f"Ошибка при разбане: {e}")
+                return
+            muted_users.cancel(k)
+            record_action(chat_id, message.from_user, user_id, "unban", comment)
+            user_messages[chat_id].discard(chat_id, user_id)
+            send(chat_id,
+                 f"✅ Пользователь <a href='tg://user?id={user_id}'>"
+                 f"{target_name or member_name(chat_id, user_id)}</a> был разбанен. {comment}",
+                 parse_mode="HTML")
+    except Exception as e:
+        reply(message, f"Ошибка: {e}")
+
+# -------------------- Правила чата --------------------
+@bot.message_handler(commands=['config'])
+def on_config_command(message: types.Message):
+    """/config - показать правила чата, /config поле значение - изменить, /config reset - сбросить"""
+    if message.chat.type != 'supergroup':
+        return
+    chat_id = message.chat.id
+    args = message.text.split()[1:]
+    if not args:
+        source = "свои правила" if chat_rules.has_override(chat_id) else "правила по умолчанию"
+        reply(message, f"Чат использует {source}:\n{describe(chat_rules.get(chat_id))}\n\n"
+                              f"Изменить: /config <поле> <значение>, сбросить: /config reset\n"
+                              f"Поля: {', '.join(FIELDS)}")
+        return
+    try:
+        if not rights.is_admin(chat_id, message.from_user.id):
+            reply(message, "Только админы могут менять правила.")
+            return
+        if args[0] == "reset":
+            chat_rules.reset(chat_id)
+            rules = chat_rules.get(chat_id)
+        elif len(args) == 2:
+            rules = chat_rules.update(chat_id, **{args[0]: parse_field(args[0], args[1])})
+        else:
+            reply(message, "Использование: /config <поле> <значение> или /config reset")
+            return
+    except (RulesError, ValueError) as e:
+        reply(message, f"Не получилось: {e}")
+        return
+    except Exception as e:
+        reply(message, f"Ошибка: {e}")
+        return
+    print(f"Правила чата {chat_id} изменены: {rules}")
+    reply(message, f"Готово:\n{describe(rules)}")
+
+# -------------------- Текущие пороги --------------------
+@bot.message_handler(commands=['limits'])
+def on_limits_command(message: types.Message):
+    """/limits - текущий порог мута и базовая активность чата"""
+    if message.chat.type != 'supergroup':
+        return
+    chat_id = message.chat.id
+    try:
+        if not rights.is_admin(chat_id, message.from_user.id):
+            reply(message, "Пороги видны только админам.")
+            return
+    except Exception as e:
+        reply(message, f"Ошибка: {e}")
+        return
+    rules = chat_rules.get(chat_id)
+    b = baselines.snapshot(chat_id, rules, time.time())
+    if raid.in_lockdown(chat_id):
+        mode = f"режим защиты от рейда: {rules.lockdown_limit}"
+    elif rules.adaptive:
+        mode = f"адаптивный: {b['limit']} (границы {rules.adaptive_floor}..{rules.adaptive_ceiling})"
+    else:
+        mode = f"фиксированный: {rules.spam_limit}"
+    reply(message, f"Мут после более чем N сообщений за {rules.window_seconds:g} сек., N сейчас - {mode}.\n"
+                          f"База чата: в среднем {b['mean']:.1f} ± {b['std']:.1f} сообщений на пользователя за окно "
+                          f"({b['samples']} замеров), {b['per_minute']:.1f} сообщений в минуту.\n"
+                          f"Адаптивный режим: /config adaptive 1")
+
+# -------------------- Блоклист --------------------
+@bot.message_handler(commands=['block', 'unblock'])
+def on_block_command(message: types.Message):
+    """/block - показать блоклист, /block фраза|домен|invites - добавить, /unblock ... - убрать"""
+    if message.chat.type != 'supergroup':
+        return
+    chat_id = message.chat.id
+    try:
+        if not rights.is_admin(chat_id, message.from_user.id):
+            reply(message, "Только админы могут менять блоклист.")
+            return
+        command = util.extract_command(message.text)
+        arg = (util.extract_arguments(message.text) or "").strip()
+        if not arg:
+            own = blocklists.own_entries(chat_id)
+            reply(message, f"Фразы: {', '.join(own.get('terms', ())) or '—'}\n"
+                                  f"Домены: {', '.join(own.get('domains', ())) or '—'}\n"
+                                  f"Инвайт-ссылки: {'удаляются' if blocklists.get(chat_id).invites else 'разрешены'}\n\n"
+                                  f"Добавить: /block <фраза|домен|invites>, убрать: /unblock <...>")
+            return
+        # "invites" -> инвайт-ссылки; одно слово с точкой -> домен; иначе фраза
+        if arg.lower() == "invites":
+            kind, value = "invites", True
+        elif " " not in arg and "." in arg and url_host(arg):
+            kind, value = "domains", url_host(arg)
+        else:
+            kind, value = "terms", arg
+        if command == "block":
+            blocklists.add(chat_id, kind, value)
+        else:
+            blocklists.remove(chat_id, kind, value)
+    except ValueError as e:
+        reply(message, f"Не получилось: {e}")
+        return
+    except Exception as e:
+        reply(message, f"Ошибка: {e}")
+        return
+    print(f"Блоклист чата {chat_id}: {command} {kind} {value!r}")
+    reply(message, "Готово.")
+
+# -------------------- Журнал модерации --------------------
+@bot.message_handler(commands=['modlog'])
+def on_modlog_command(message: types.Message):
+    """/modlog - последние действия в чате, /modlog @username|id или ответом - по пользователю"""
+    if message.chat.type != 'supergroup':
+        return
+    chat_id = message.chat.id
+    try:
+        if not rights.is_admin(chat_id, message.from_user.id):
+            reply(message, "Журнал доступен только админам.")
+            return
+        parts = message.text.split()
+        user_id = None
+        if message.reply_to_message or len(parts) > 1:
+            target = command_target(message, parts)
+            if target is None:
+                reply(message, "Не знаю такого пользователя. Укажите @username / id или ответьте на сообщение.")
                 return
-            with lock:
-                if k in muted_users: del muted_users[k]
-                if k in user_messages: del user_messages[k]
-                if k in user_msg_ids: del user_msg_ids[k]
-            bot.send_message(chat_id,
-                             f"✅ Пользователь <a href='tg://user?id={user_id}'>"
-                             f"{message.reply_to_message.from_user.full_name}</a> был разбанен. {comment}",
-                             parse_mode="HTML")
+            user_id = target[0]
+        records = audit.query(chat_id, user_id, limit=MODLOG_LIMIT)
+    except Exception as e:
+        reply(message, f"Ошибка: {e}")
+        return
+    if not records:
+        reply(message, "Записей нет.")
+        return
+    reply(message, format_modlog(records, lambda uid: members.name(chat_id, uid)))
+
+# -------------------- Очистка чата --------------------
+PURGE_USAGE = ("Использование: /purge @username|id или ответом - сообщения пользователя,\n"
+               "/purge last 50 - последние 50 сообщений чата, /purge since 10m - за 10 минут.\n"
+               "Можно сочетать: /purge @username since 1h")
+
+@bot.message_handler(commands=['purge'])
+def on_purge_command(message: types.Message):
+    """/purge - удаляет недавние сообщения пользователя и/или чата по индексу history"""
+    if message.chat.type != 'supergroup':
+        return
+    chat_id = message.chat.id
+    try:
+        if not rights.is_admin(chat_id, message.from_user.id):
+            reply(message, "Чистить чат могут только админы.")
+            return
     except Exception as e:
-        bot.reply_to(message, f"Ошибка: {e}")
+        reply(message, f"Ошибка: {e}")
+        return
+    parts = message.text.split()
+    try:
+        target, last, since = parse_purge_args(parts[1:])
+    except ValueError as e:
+        reply(message, f"{e}\n{PURGE_USAGE}")
+        return
+    user_id = None
+    if target is not None or message.reply_to_message:
+        found = command_target(message, parts[:1] + [target] if target is not None else parts)
+        if found is None:
+            reply(message, "Не знаю такого пользователя. Укажите @username / id или ответьте на сообщение.")
+            return
+        user_id = found[0]
+    if user_id is None and last is None and since is None:
+        reply(message, PURGE_USAGE)
+        return
+
+    # один проход по индексу чата; выбранные id убираются из него, повторный /purge их не тронет
+    ids = history.select(chat_id, user_id, since=time.time() - since if since else None, last=last, take=True)
+    # команда удаляется вместе с остальными, поэтому ответ - обычным сообщением
+    deleter.add(chat_id, ids + [message.message_id])
+    record_action(chat_id, message.from_user, user_id or 0, "purge", f"сообщений: {len(ids)}")
+    print(f"Очистка в чате {chat_id} от {message.from_user.id} ({' '.join(parts[1:])}): {len(ids)} сообщений")
+    send(chat_id, f"Удаляю сообщений: {len(ids)}.")
 
 # -------------------- Обработка сообщений --------------------
 @bot.message_handler(func=lambda m: True,
@@ -223,49 +602,103 @@ def on_message(message: types.Message):
     user_id = message.from_user.id
     now = int(time.time())
     k = key(chat_id, user_id)
+    if not shedder.shed("member_directory"):
+        members.observe(chat_id, message.from_user, now)
 
     if not bot_has_restrict_rights(chat_id):
         return
 
-    with lock:
-        dq_ids = user_msg_ids[k]
-        dq_ids.append(message.message_id)
-        while len(dq_ids) > DELETE_LAST:
-            dq_ids.popleft()
-
-        if k in muted_users:
-            return
+    # блоклист до подсчёта: совпадение удаляется сразу и в окно не попадает
+    blocked = blocklists.get(chat_id).match(message.text or message.caption,
+                                           message.entities or message.caption_entities)
+    if blocked and rights.is_admin(chat_id, user_id):
+        blocked = None
+    if recorder is not None and not shedder.shed("recorder"):
+        recorder.record(message, now, blocked)
+    if blocked:
+        print(f"Сообщение {message.message_id} от {user_id} в чате {chat_id} удалено по блоклисту ({blocked})")
+        blocked_messages.inc(blocked.split(":")[0])
+        queue_delete(chat_id, [message.message_id])
+        audit.record(chat_id, user_id, "delete", reason=blocked)
+        return
 
-        dq_times = user_messages[k]
-        dq_times.append((now, message.message_id))
-        clean_old_timestamps(dq_times, now)
+    # индекс для /purge пополняется и в перегрузке: чистить после рейда нужно именно эти сообщения
+    history.add(chat_id, user_id, message.message_id, now)
+
+    # id сохраняется и для замученных: сообщение, пришедшее уже после мута, сразу уходит на удаление.
+    # Блокируется только шард этого чата и ненадолго, сетевые вызовы идут вне блокировок
+    rules = chat_rules.get(chat_id)
+    count = user_messages[chat_id].add(chat_id, user_id, now, message.message_id, rules.window_seconds)
+    # во время рейда порог строже, и рейд не портит базовую активность чата
+    if raid.on_message(chat_id, user_id, now):
+        limit = rules.lockdown_limit
+    elif rules.adaptive:
+        limit = baselines.observe(chat_id, count, now, rules)
+    else:
+        limit = rules.spam_limit
+
+    if k in muted_users:
+        sweep_muted(chat_id, user_id)
+        return
 
-        if len(dq_times) > MAX_MSG:
-            until = now + MUTE_SECONDS
-            try:
-                perms = types.ChatPermissions(
-                    can_send_messages=False,
-                    can_send_media_messages=False,
-                    can_send_other_messages=False,
-                    can_add_web_page_previews=False
-                )
-                bot.restrict_chat_member(chat_id, user_id, permissions=perms, until_date=until)
-            except telebot.apihelper.ApiException as e:
-                bot.send_message(chat_id, f"Ошибка при попытке замутить пользователя: {e}")
-                return
+    name = message.from_user.full_name or message.from_user.username or str(user_id)
+    if count > limit:
+        auto_mute(message, user_id, name, f"за спам: {limit + 1}+ сообщений за {rules.window_seconds:g} сек.")
+        return
 
-            muted_users[k] = until
-            user_messages[k].clear()
+    # один и тот же текст или файл от нескольких пользователей (или один файл много раз) ->
+    # мут всем; их сообщения в окнах user_messages уходят на удаление при муте,
+    # как у любого замученного (sweep_muted)
+    cluster = dup_index.add(chat_id, user_id, message.message_id, message.text or message.caption, now, name)
+    if cluster:
+        print(f"Одинаковый текст от {len(cluster)} пользователей в чате {chat_id}")
+        mute_cluster(message, cluster, "за рассылку одинаковых сообщений.")
+    cluster = media_index.add(chat_id, user_id, message.message_id, message, now, name)
+    if cluster:
+        print(f"Повтор медиа от {len(cluster)} пользователей в чате {chat_id}")
+        mute_cluster(message, cluster, "за повтор одного и того же медиа.")
+
+def mute_cluster(message: types.Message, cluster: dict, reason: str):
+    """cluster: user_id -> (имя, id сообщений); админов не трогаем"""
+    for uid, (uname, _) in cluster.items():
+        try:
+            if rights.is_admin(message.chat.id, uid):
+                continue
+        except Exception:
+            continue
+        auto_mute(message, uid, uname, reason)
+
+def auto_mute(message: types.Message, user_id: int, name: str, reason: str):
+    chat_id = message.chat.id
+    until = int(time.time()) + chat_rules.get(chat_id).mute_seconds
+    # мут фиксируется атомарно, чтобы параллельные сообщения не мутили повторно
+    if not muted_users.add(key(chat_id, user_id), until):
+        return
 
-            kb = types.InlineKeyboardMarkup()
-            kb.add(types.InlineKeyboardButton("Размутить", callback_data=f"unmute:{chat_id}:{user_id}"))
-            kb.add(types.InlineKeyboardButton("Забанить", callback_data=f"ban:{chat_id}:{user_id}"))
+    perms = types.ChatPermissions(
+        can_send_messages=False,
+        can_send_media_messages=False,
+        can_send_other_messages=False,
+        can_add_web_page_previews=False
+    )
+    restrict(chat_id, user_id, perms, until).add_done_callback(
+        lambda f: after_auto_mute(f, message, user_id, name, reason))
+
+def after_auto_mute(fut, message: types.Message, user_id: int, name: str, reason: str):
+    """Вызывается по завершении restrict: удаление сообщений и уведомление либо откат мута"""
+    chat_id = message.chat.id
+    e = fut.exception()
+    if e is not None:
+        muted_users.cancel(key(chat_id, user_id))
+        send(chat_id, f"Ошибка при попытке замутить пользователя: {e}")
+        return
+    auto_mutes.inc()
+    sweep_muted(chat_id, user_id)
+    rules = chat_rules.get(chat_id)
+    audit.record(chat_id, user_id, "auto_mute", reason=reason, until=time.time() + rules.mute_seconds)
 
-            name = message.from_user.full_name or message.from_user.username or str(user_id)
-            text = (f"⚠️ Пользователь <a href='tg://user?id={user_id}'>{name}</a> "
-                    f"замучен на 12 часов за спам: {MAX_MSG + 1}+ сообщений за {WINDOW_SECONDS} сек. "
-                    f"Последние {DELETE_LAST} сообщений будут удалены.")
-            bot.send_message(chat_id, text, reply_markup=kb, parse_mode="HTML")
+    # одно сводное сообщение на волну автомутов, с кнопками для каждого
+    digest.add(chat_id, user_id, name, f"на {format_duration(rules.mute_seconds)} {reason}")
 
 # -------------------- Inline кнопки --------------------
 @bot.callback_query_handler(func=lambda cq: True)
@@ -273,7 +706,7 @@ def on_callback(cq: types.CallbackQuery):
     data = cq.data or ""
     parts = data.split(":")
     if len(parts) != 3:
-        bot.answer_callback_query(cq.id, "Неверная команда.")
+        answer(cq, "Неверная команда.")
         return
 
     action, chat_s, user_s = parts
@@ -281,62 +714,134 @@ def on_callback(cq: types.CallbackQuery):
         chat_id = int(chat_s)
         target_user_id = int(user_s)
     except ValueError:
-        bot.answer_callback_query(cq.id, "Неверные данные.")
+        answer(cq, "Неверные данные.")
         return
 
     # проверяем, что нажимает админ
     try:
         invoker_id = cq.from_user.id
-        inv_member = bot.get_chat_member(chat_id, invoker_id)
-        if inv_member.status not in ('administrator', 'creator'):
-            bot.answer_callback_query(cq.id, "Только админы могут нажимать эти кнопки.", show_alert=True)
+        if not rights.is_admin(chat_id, invoker_id):
+            answer(cq, "Только админы могут нажимать эти кнопки.", show_alert=True)
             return
     except Exception:
-        bot.answer_callback_query(cq.id, "Не удалось проверить права вызывающего.")
+        answer(cq, "Не удалось проверить права вызывающего.")
         return
 
     k = key(chat_id, target_user_id)
-    try:
-        target_name = bot.get_chat_member(chat_id, target_user_id).user.full_name
-    except Exception:
-        target_name = str(target_user_id)
-
-    with lock:
-        if action == "unmute":
-            if k not in muted_users:
-                bot.answer_callback_query(cq.id, "Пользователь не в муте.")
-                return
-            try:
-                perms = types.ChatPermissions(
-                    can_send_messages=True,
-                    can_send_media_messages=True,
-                    can_send_other_messages=True,
-                    can_add_web_page_previews=True
-                )
-                bot.restrict_chat_member(chat_id, target_user_id, permissions=perms)
-                del muted_users[k]
-            except Exception as e:
-                bot.answer_callback_query(cq.id, f"Ошибка размуты: {e}")
-                return
-            bot.answer_callback_query(cq.id, "Пользователь размучен.")
-            bot.send_message(chat_id, f"🔊 Пользователь <a href='tg://user?id={target_user_id}'>{target_name}</a> был размучен админом.", parse_mode="HTML")
+    target_name = member_name(chat_id, target_user_id)
 
-        elif action == "ban":
-            try:
-                bot.kick_chat_member(chat_id, target_user_id)
-            except Exception as e:
-                bot.answer_callback_query(cq.id, f"Ошибка при бане: {e}")
-                return
-            if k in muted_users: del muted_users[k]
-            if k in user_messages: del user_messages[k]
-            if k in user_msg_ids: del user_msg_ids[k]
-            bot.answer_callback_query(cq.id, "Пользователь забанен.")
-            bot.send_message(chat_id, f"⛔ Пользователь <a href='tg://user?id={target_user_id}'>{target_name}</a> был забанен админом.", parse_mode="HTML")
-        else:
-            bot.answer_callback_query(cq.id, "Неизвестное действие.")
+    if action == "unmute":
+        if k not in muted_users:
+            answer(cq, "Пользователь не в муте.")
+            return
+        try:
+            perms = types.ChatPermissions(
+                can_send_messages=True,
+                can_send_media_messages=True,
+                can_send_other_messages=True,
+                can_add_web_page_previews=True
+            )
+            restrict(chat_id, target_user_id, perms).result()
+            muted_users.cancel(k)
+            record_action(chat_id, cq.from_user, target_user_id, "unmute")
+        except Exception as e:
+            answer(cq, f"Ошибка размуты: {e}")
+            return
+        answer(cq, "Пользователь размучен.")
+        if not digest.resolve(chat_id, cq.message.message_id, target_user_id, "размучен админом"):
+            send(chat_id, f"🔊 Пользователь <a href='tg://user?id={target_user_id}'>{target_name}</a> был размучен админом.", parse_mode="HTML")
+
+    elif action == "ban":
+        try:
+            outbound.call(PRIO_RESTRICT, chat_id, bot.kick_chat_member, chat_id, target_user_id)
+        except Exception as e:
+            answer(cq, f"Ошибка при бане: {e}")
+            return
+        muted_users.cancel(k)
+        record_action(chat_id, cq.from_user, target_user_id, "ban")
+        user_messages[chat_id].discard(chat_id, target_user_id)
+        answer(cq, "Пользователь забанен.")
+        if not digest.resolve(chat_id, cq.message.message_id, target_user_id, "забанен админом"):
+            send(chat_id, f"⛔ Пользователь <a href='tg://user?id={target_user_id}'>{target_name}</a> был забанен админом.", parse_mode="HTML")
+    else:
+        answer(cq, "Неизвестное действие.")
+
+# -------------------- Изменения прав --------------------
+@bot.my_chat_member_handler()
+@bot.chat_member_handler()
+def on_member_update(upd: types.ChatMemberUpdated):
+    """Обновляет кэш прав без лишних запросов get_chat_member и считает вступления для детектора рейдов"""
+    rights.on_member_update(upd)
+    user = upd.new_chat_member.user
+    members.observe(upd.chat.id, user, time.time())
+    joined = (upd.old_chat_member.status in ("left", "kicked")
+              and upd.new_chat_member.status in ("member", "restricted"))
+    if not joined or user.id == rights.me().id:
+        return
+    chat_id = upd.chat.id
+    if raid.on_join(chat_id, user.id, time.time()):
+        # режим защиты: новичок только читает, пока рейд не закончится
+        perms = types.ChatPermissions(can_send_messages=False)
+        until = int(time.time()) + LOCKDOWN_JOIN_MUTE
+        restrict(chat_id, user.id, perms, until).add_done_callback(log_errors(f"lockdown restrict {user.id} in {chat_id}"))
+        audit.record(chat_id, user.id, "lockdown", until=until)
+
+# -------------------- Перегрузка --------------------
+def on_overload_change(active: bool, reason: str):
+    """Подсчёт, муты и удаления продолжаются; сводки ждут конца перегрузки
+    (и тогда уходят со всеми пойманными), удаления идут крупными пачками (см. delete worker)"""
+    print(f"Перегрузка {'началась' if active else 'закончилась'} ({reason})")
+    digest.hold(active)
+
+# -------------------- Рейды --------------------
+def on_raid_change(chat_id: int, active: bool, reason: str):
+    """Вызывается детектором при включении и снятии режима защиты"""
+    if active:
+        print(f"Рейд в чате {chat_id} ({reason}): режим защиты включён")
+        send(chat_id, "🚨 Похоже на рейд. Включён режим защиты: новые участники временно не могут писать, "
+                      f"порог сообщений снижен до {LOCKDOWN_MAX_MSG}.")
+        return
+    joiners = raid.take_restricted(chat_id)
+    print(f"Рейд в чате {chat_id} закончился, снимаю ограничения с {len(joiners)} новичков")
+    perms = types.ChatPermissions(
+        can_send_messages=True,
+        can_send_media_messages=True,
+        can_send_other_messages=True,
+        can_add_web_page_previews=True
+    )
+    for uid in joiners:
+        # замученных за спам не трогаем
+        if key(chat_id, uid) in muted_users:
+            continue
+        restrict(chat_id, uid, perms).add_done_callback(log_errors(f"lockdown release {uid} in {chat_id}"))
+    send(chat_id, "Рейд закончился, режим защиты снят.")
 
 if __name__ == "__main__":
+    if METRICS_LISTEN:
+        host, port = METRICS_LISTEN.rsplit(":", 1)
+        metrics.serve(host, int(port))
+    rights.me()
+    chat_rules.load()
+    chat_rules.watch()
+    blocklists.load()
+    mute_store.start()
+    audit.start()
+    if recorder is not None:
+        recorder.start()
+    # восстановление мутов после рестарта; просроченные снимаются постепенно
+    mute_store.restore(muted_users)
+    outbound.start()
+    digest.start()
+    dispatcher.start()
+    shedder.start()
     schedule_unmute_worker()
     schedule_delete_worker()
     print("Бот запущен...")
-    bot.infinity_polling(timeout=60, long_polling_timeout=60)
+    if WEBHOOK_LISTEN:
+        host, port = WEBHOOK_LISTEN.rsplit(":", 1)
+        server = WebhookServer(bot, host, int(port), secret_token=WEBHOOK_SECRET)
+        if WEBHOOK_URL:
+            bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=util.update_types)
+        server.serve_forever()
+    else:
+        bot.infinity_polling(timeout=60, long_polling_timeout=60, allowed_updates=util.update_types)
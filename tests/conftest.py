@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+from collections import defaultdict
+
+import pytest
+
+# the bot modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def api():
+    from support import Api
+    server = Api().start()
+    yield server
+    server.shutdown()
+
+
+def _load(name, api, tmp_path_factory):
+    import metrics
+    from bench_flood import load_bot
+    # both bots register the same metric names; each gets its own registry
+    fresh = metrics.Registry()
+    metrics.registry, metrics.counter, metrics.histogram, metrics.gauge = (
+        fresh, fresh.counter, fresh.histogram, fresh.gauge)
+    workdir = str(tmp_path_factory.mktemp(name))
+    # rule and blocklist edits go to the temporary directory, not the working tree
+    os.environ["RULES_FILE"] = os.path.join(workdir, "chat_rules.json")
+    os.environ["BLOCKLIST_FILE"] = os.path.join(workdir, "blocklist.json")
+    return load_bot(name, api, workdir)
+
+
+@pytest.fixture(scope="session")
+def delete_bot(api, tmp_path_factory):
+    """telegram_spam_moderator_delete against the session's fake API; imported and started once."""
+    return _load("telegram_spam_moderator_delete", api, tmp_path_factory)
+
+
+@pytest.fixture(scope="session")
+def spam_bot(api, tmp_path_factory):
+    """spam_moderator_bot against the session's fake API; imported and started once."""
+    return _load("spam_moderator_bot", api, tmp_path_factory)
+
+
+@pytest.fixture
+def handled(delete_bot):
+    """chat_id -> message ids in the order they reached the delete bot's handlers."""
+    seen = defaultdict(list)
+    handler = delete_bot.dispatcher.handler
+
+    def recording(updates):
+        for u in updates:
+            seen[u.message.chat.id].append(u.message.message_id)
+        handler(updates)
+
+    delete_bot.dispatcher.handler = recording
+    yield seen
+    delete_bot.dispatcher.handler = handler
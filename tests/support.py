@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Fake Bot API with admins and held calls, and update builders for bot tests."""
+import threading
+import time
+
+from fake_bot_api import FakeBotApi
+
+TIMEOUT = 10.0
+
+
+class Api(FakeBotApi):
+    """FakeBotApi where chosen users are admins and calls can be held per (method, chat)."""
+
+    def __init__(self):
+        super().__init__()
+        self.admins = set()
+        # (method, chat_id) -> Event; the call waits until it is set
+        self.gates = {}
+
+    def hold(self, method: str, chat_id: int) -> threading.Event:
+        gate = self.gates[(method, chat_id)] = threading.Event()
+        return gate
+
+    def _result(self, method, params):
+        gate = self.gates.get((method, int(params.get("chat_id") or 0)))
+        if gate is not None:
+            gate.wait(TIMEOUT)
+        if method == "getChatMember" and int(params.get("user_id", 0)) in self.admins:
+            uid = int(params["user_id"])
+            return {"status": "administrator", "can_restrict_members": True, "can_delete_messages": True,
+                    "user": {"id": uid, "is_bot": False, "first_name": f"admin{uid}"}}
+        return super()._result(method, params)
+
+    def params(self, method: str, chat_id: int) -> list:
+        with self._lock:
+            return [p for _, m, p in self.calls if m == method and int(p.get("chat_id") or 0) == chat_id]
+
+
+def message(message_id: int, chat_id: int, user_id: int, text: str = None) -> dict:
+    return {"update_id": message_id,
+            "message": {"message_id": message_id, "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "supergroup", "title": str(chat_id)},
+                        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                        "text": text if text is not None else f"hello #{message_id}"}}
+
+
+def feed(mod, updates):
+    from telebot import types
+    mod.bot.process_new_updates([types.Update.de_json(u) for u in updates])
+
+
+def wait_for(predicate, timeout: float = TIMEOUT) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def deleted_ids(api: Api, chat_id: int) -> list:
+    """Message ids passed to deleteMessages / deleteMessage in the chat, in call order."""
+    import json
+    out = []
+    with api._lock:
+        calls = list(api.calls)
+    for _, method, p in calls:
+        if int(p.get("chat_id") or 0) != chat_id:
+            continue
+        if method == "deleteMessages":
+            ids = p["message_ids"]
+            out.extend(json.loads(ids) if isinstance(ids, str) else ids)
+        elif method == "deleteMessage":
+            out.append(int(p["message_id"]))
+    return out
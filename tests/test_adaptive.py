@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""AdaptiveLimits: static limit until min_samples, clamped baseline, floods ignored, LRU chats."""
+from types import SimpleNamespace
+
+import pytest
+
+from adaptive import AdaptiveLimits
+
+RULES = SimpleNamespace(spam_limit=10, adaptive_floor=3, adaptive_ceiling=20)
+
+
+def warm(limits, chat_id, counts, ts=0.0):
+    for i, count in enumerate(counts):
+        limits.observe(chat_id, count, ts + i, RULES)
+
+
+def test_static_limit_until_min_samples():
+    limits = AdaptiveLimits(min_samples=5)
+    warm(limits, -1, [1, 1, 1, 1])
+    assert limits.limit(-1, RULES) == RULES.spam_limit
+    assert limits.limit(-2, RULES) == RULES.spam_limit
+    warm(limits, -1, [1])
+    assert limits.limit(-1, RULES) == RULES.adaptive_floor
+
+
+def test_limit_follows_the_baseline_within_floor_and_ceiling():
+    limits = AdaptiveLimits(alpha=0.1, k=3, min_samples=20)
+    warm(limits, -1, [4, 6] * 50)
+    snap = limits.snapshot(-1, RULES, now=100)
+    assert snap["mean"] == pytest.approx(5, abs=0.6)
+    assert snap["limit"] == limits.limit(-1, RULES)
+    assert RULES.adaptive_floor < snap["limit"] < RULES.adaptive_ceiling
+
+    # a noisy chat: mean + k * std is over the ceiling
+    limits = AdaptiveLimits(alpha=0.1, k=5, min_samples=20)
+    warm(limits, -2, [1, 10] * 50)
+    assert limits.limit(-2, RULES) == RULES.adaptive_ceiling
+
+
+def test_samples_over_the_limit_do_not_move_the_baseline():
+    limits = AdaptiveLimits(alpha=0.1, min_samples=10)
+    warm(limits, -1, [2] * 10)
+    before = limits.snapshot(-1, RULES, now=10)
+    assert limits.observe(-1, 15, 10, RULES) == before["limit"]
+    after = limits.snapshot(-1, RULES, now=11)
+    assert after["samples"] == before["samples"]
+    assert after["mean"] == before["mean"]
+
+
+def test_message_rate_decays_with_the_half_life():
+    limits = AdaptiveLimits(rate_halflife=60)
+    warm(limits, -1, [1] * 10, ts=0)
+    fresh = limits.snapshot(-1, RULES, now=9)["per_minute"]
+    assert limits.snapshot(-1, RULES, now=69)["per_minute"] == pytest.approx(fresh / 2)
+
+
+def test_least_recently_active_chat_is_evicted_at_max_chats():
+    limits = AdaptiveLimits(min_samples=1, max_chats=2)
+    warm(limits, -1, [1])
+    warm(limits, -2, [1])
+    warm(limits, -1, [1])
+    warm(limits, -3, [1])
+    assert len(limits) == 2
+    assert limits.snapshot(-2, RULES, now=0)["samples"] == 0
+    assert limits.snapshot(-1, RULES, now=0)["samples"] == 2
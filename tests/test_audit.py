@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""AuditLog pruning gives the disk space back; admins acting by command get a name in /modlog."""
+import os
+import sqlite3
+
+from audit import AuditLog
+from persistence import connect
+from support import feed, message, wait_for
+
+
+def size(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def fill(conn, rows, ts):
+    with conn:
+        conn.executemany("INSERT INTO actions (ts, chat_id, user_id, actor_id, action, until, reason) "
+                         "VALUES (?, -1, ?, NULL, 'delete', NULL, ?)",
+                         [(ts + i, i, "x" * 200) for i in range(rows)])
+
+
+def test_prune_drops_old_and_excess_rows(tmp_path):
+    log = AuditLog(str(tmp_path / "audit.db"), retention_days=1, max_rows=100)
+    conn = connect(log.path)
+    fill(conn, 50, ts=0)              # far past the retention
+    fill(conn, 150, ts=10 ** 9)
+    assert log.prune(conn, now=10 ** 9 + 1000) == 100
+    assert conn.execute("SELECT COUNT(*), MIN(ts) FROM actions").fetchone() == (100, 10 ** 9 + 50)
+    assert log.prune(conn, now=10 ** 9 + 1000) == 0
+
+
+def test_prune_shrinks_the_files(tmp_path):
+    log = AuditLog(str(tmp_path / "audit.db"), max_rows=10)
+    conn = connect(log.path)
+    fill(conn, 20000, ts=10 ** 9)
+    full = size(log.path)
+    log.prune(conn, now=10 ** 9)
+    assert size(log.path) < full / 10
+
+
+def test_existing_database_is_switched_to_incremental_vacuum(tmp_path):
+    path = str(tmp_path / "old.db")
+    sqlite3.connect(path).execute("CREATE TABLE t (x)").connection.close()
+    AuditLog(path)
+    assert connect(path).execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_command_sender_gets_a_name_for_modlog(delete_bot, api):
+    chat_id = -1007000000001
+    admin = 4242
+    api.admins.add(admin)
+    # the admin's first message in the chat is a command
+    feed(delete_bot, [message(1, chat_id, admin, "/ban 777001 1d spam")])
+    assert wait_for(lambda: delete_bot.members.get(chat_id, admin) is not None)
+    assert delete_bot.members.name(chat_id, admin) == f"user{admin}"
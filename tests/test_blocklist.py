@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from blocklist import Blocklist, normalize
+
+# Latin terms that read as Russian words through look-alikes, and back
+TERMS = ["hot", "pot", "mama", "cok", "topt", "рот", "сорт", "мех", "casino", "казино", "free money"]
+
+
+def test_russian_sentence_does_not_match():
+    bl = Blocklist(TERMS)
+    assert bl.match("Мама купила сок и торт, а нот в хоре не знает") is None
+
+
+def test_english_sentence_does_not_match():
+    bl = Blocklist(TERMS)
+    assert bl.match("I cooked soup in a copper pan, my mexican friend said it was good") is None
+
+
+def test_same_script_terms_match():
+    bl = Blocklist(TERMS)
+    assert bl.match("Лучшее КАЗИНО в городе") == "term: казино"
+    assert bl.match("Best casino in town") == "term: casino"
+
+
+def test_mixed_script_words_are_folded():
+    bl = Blocklist(TERMS)
+    # Latin a and o inside a Cyrillic word, digits inside Latin words
+    assert bl.match("Лучшее кaзинo в городе") == "term: казино"
+    assert bl.match("c4sin0 bonus") == "term: casino"
+    assert bl.match("get FREE M0NEY now") == "term: free money"
+
+
+def test_normalize_keeps_single_script_words():
+    assert normalize("Нот  ХОТ\u200b hot") == "нот хот hot"
+    assert normalize("кaзинo") != normalize("казино")
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""ChatHistory: select/take, discard, the ring wrap-around and chat eviction."""
+from chat_history import ChatHistory
+
+
+def filled(history, chat_id, n, user_of=lambda mid: mid % 2, ts0=0.0):
+    for mid in range(1, n + 1):
+        history.add(chat_id, user_of(mid), mid, ts0 + mid)
+
+
+def test_select_by_user_since_and_last():
+    h = ChatHistory()
+    filled(h, -1, 10)
+    assert h.select(-1) == list(range(1, 11))
+    assert h.select(-1, last=3) == [8, 9, 10]
+    assert h.select(-1, user_id=1) == [1, 3, 5, 7, 9]
+    assert h.select(-1, since=8) == [8, 9, 10]
+    assert h.select(-1, user_id=0, since=5, last=2) == [8, 10]
+    assert h.select(-2) == []
+
+
+def test_take_removes_selected_messages():
+    h = ChatHistory()
+    filled(h, -1, 5)
+    assert h.select(-1, last=2, take=True) == [4, 5]
+    assert h.select(-1, last=2) == [2, 3]
+
+
+def test_discard_removes_only_the_given_ids():
+    h = ChatHistory()
+    filled(h, -1, 10)
+    assert h.discard(-1, [3, 9, 10, 42]) == 3
+    assert h.select(-1, last=3) == [6, 7, 8]
+    assert h.select(-1) == [1, 2, 4, 5, 6, 7, 8]
+    assert h.discard(-1, [3]) == 0
+    assert h.discard(-1, []) == 0
+    assert h.discard(-2, [1]) == 0
+
+
+def test_discard_after_the_ring_wrapped():
+    h = ChatHistory(capacity=4)
+    filled(h, -1, 6)           # keeps 3..6, oldest slot overwritten twice
+    assert h.select(-1) == [3, 4, 5, 6]
+    assert h.discard(-1, [1, 4, 6]) == 2
+    assert h.select(-1) == [3, 5]
+
+
+def test_ring_keeps_the_newest_capacity_messages():
+    h = ChatHistory(capacity=3)
+    filled(h, -1, 7)
+    assert h.select(-1) == [5, 6, 7]
+    assert h.stats()["entries"] == 3
+
+
+def test_least_recently_active_chat_goes_over_max_entries():
+    h = ChatHistory(max_entries=5)
+    filled(h, -1, 3)
+    filled(h, -2, 2)
+    h.add(-1, 0, 4, 10.0)      # 6 entries: -2 is the least recently active
+    assert h.select(-2) == []
+    assert h.select(-1) == [1, 2, 3, 4]
+    assert h.stats() == {"chats": 1, "entries": 4, "bytes": 80, "evicted": 1}
+
+
+def test_evict_idle_drops_quiet_chats():
+    h = ChatHistory(idle_seconds=100)
+    filled(h, -1, 2, ts0=0)
+    filled(h, -2, 2, ts0=500)
+    assert h.evict_idle(now=550) == 1
+    assert h.select(-1) == [] and h.select(-2) == [1, 2]
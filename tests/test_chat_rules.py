@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Rules validation: mute_seconds must be a duration Telegram honours."""
+import json
+
+import pytest
+
+from chat_rules import MAX_MUTE_SECONDS, MIN_MUTE_SECONDS, Rules, RulesError, RulesStore, compile_rules
+
+DEFAULTS = Rules(spam_limit=10, window_seconds=10, mute_seconds=3600, delete_last=10, lockdown_limit=3,
+                 adaptive=0, adaptive_floor=3, adaptive_ceiling=20)
+
+
+@pytest.mark.parametrize("seconds", [MIN_MUTE_SECONDS, 3600, MAX_MUTE_SECONDS])
+def test_mute_seconds_in_range_is_accepted(seconds):
+    assert compile_rules(DEFAULTS, {"mute_seconds": seconds}, 50).mute_seconds == seconds
+
+
+@pytest.mark.parametrize("seconds", [0, -5, MIN_MUTE_SECONDS - 1, MAX_MUTE_SECONDS + 1])
+def test_mute_seconds_out_of_range_is_rejected(seconds):
+    with pytest.raises(RulesError, match="mute_seconds"):
+        compile_rules(DEFAULTS, {"mute_seconds": seconds}, 50)
+
+
+def test_config_update_and_file_reload_use_the_same_check(tmp_path):
+    path = tmp_path / "rules.json"
+    store = RulesStore(str(path), DEFAULTS, 50)
+    with pytest.raises(RulesError):
+        store.update(-1, mute_seconds=10)
+    assert store.get(-1).mute_seconds == 3600
+
+    path.write_text(json.dumps({"chats": {"-1": {"mute_seconds": 400 * 86400}}}), encoding="utf-8")
+    assert not store.load()
+    assert store.get(-1).mute_seconds == 3600
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""Delete bot /mute and /ban by the id of a user the bot has never seen."""
+import pytest
+
+from support import feed, message, wait_for
+
+ADMIN = 42
+UNSEEN = 555001
+
+
+@pytest.mark.parametrize("command, method, chat_id", [("/mute", "restrictChatMember", -1006000000001),
+                                                      ("/ban", "banChatMember", -1006000000002)])
+def test_unseen_numeric_id_falls_back_to_the_raw_id(delete_bot, api, command, method, chat_id):
+    api.admins.add(ADMIN)
+    assert delete_bot.members.get(chat_id, UNSEEN) is None
+    feed(delete_bot, [message(1, chat_id, ADMIN, f"{command} {UNSEEN} 1h spam")])
+    assert wait_for(lambda: [p for p in api.params(method, chat_id) + api.params("kickChatMember", chat_id)
+                             if int(p["user_id"]) == UNSEEN])
+    # the name is looked up only for the notice
+    assert wait_for(lambda: any(f"user{UNSEEN}" in p.get("text", "") for p in api.params("sendMessage", chat_id)))
+
+
+def test_unknown_username_is_still_rejected(delete_bot, api):
+    chat_id = -1006000000003
+    feed(delete_bot, [message(1, chat_id, ADMIN, "/mute @nobody 1h spam")])
+    assert wait_for(lambda: any("@username" in p.get("text", "") for p in api.params("sendMessage", chat_id)))
+    assert not api.params("restrictChatMember", chat_id)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+A Bot API call stuck for one chat must not hold up other chats.
+
+The delete bot runs against the fake API with restrictChatMember held for
+chat A: chat B's auto-mute still has to reach the API, and chat A's own
+updates keep being handled, in order, while its mute hangs.
+"""
+from support import feed, message, wait_for
+
+CHAT_A = -1001000000001
+CHAT_B = -1001000000002
+
+
+def test_blocked_chat_does_not_stall_others(delete_bot, api, handled):
+    gate = api.hold("restrictChatMember", CHAT_A)
+    try:
+        burst = delete_bot.MAX_MSG + 2
+        # chat A: a spammer whose mute hangs, then other members keep talking
+        flood_a = [message(i, CHAT_A, 11) for i in range(1, burst + 1)]
+        feed(delete_bot, flood_a)
+        assert wait_for(lambda: delete_bot.key(CHAT_A, 11) in delete_bot.muted_users), "chat A never tried to mute"
+
+        talk_a = [message(100 + i, CHAT_A, 20 + i % 5) for i in range(50)]
+        flood_b = [message(1000 + i, CHAT_B, 31) for i in range(burst)]
+        feed(delete_bot, [u for pair in zip(talk_a, flood_b) for u in pair] + talk_a[len(flood_b):])
+
+        assert wait_for(lambda: api.params("restrictChatMember", CHAT_B)), "chat B's auto-mute waited for chat A"
+        expected_a = [u["update_id"] for u in flood_a + talk_a]
+        assert wait_for(lambda: len(handled[CHAT_A]) == len(expected_a)), "chat A's updates stalled"
+        assert not gate.is_set()
+        assert handled[CHAT_A] == expected_a
+        assert not api.params("restrictChatMember", CHAT_A)
+    finally:
+        gate.set()
+    assert wait_for(lambda: api.params("restrictChatMember", CHAT_A))
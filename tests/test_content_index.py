@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""DuplicateIndex: the min_users threshold, once-per-window reporting, eviction."""
+from content_index import DuplicateIndex, hamming, normalize, simhash
+
+SPAM = "Заработок от 500$ в день без вложений, пиши в личку https://spam.example/join"
+VARIANT = "Заработок от 700$ в день без вложений, пиши в личку https://spam.example/join"
+OTHER = "Кто-нибудь знает, во сколько завтра начинается встреча в библиотеке"
+
+
+def test_numbers_and_urls_are_normalized():
+    assert normalize("Win 500$ at WWW.Example.com!") == ["win", "0", "at", "www.example.com"]
+    assert simhash(normalize(SPAM)) == simhash(normalize(VARIANT))
+    assert hamming(simhash(normalize(SPAM)), simhash(normalize(OTHER))) > 8
+
+
+def test_cluster_is_reported_when_min_users_is_reached():
+    idx = DuplicateIndex(min_users=3)
+    assert idx.add(-1, 1, 10, SPAM, ts=0) is None
+    assert idx.add(-1, 1, 11, VARIANT, ts=1) is None  # same sender twice is still one user
+    assert idx.add(-1, 2, 12, VARIANT, ts=2) is None
+    assert idx.add(-1, 4, 13, OTHER, ts=3) is None
+    cluster = idx.add(-1, 3, 14, SPAM, ts=4, name="third")
+    assert cluster == {1: (None, [10, 11]), 2: (None, [12]), 3: ("third", [14])}
+
+
+def test_reported_users_are_not_reported_again_inside_the_window():
+    idx = DuplicateIndex(min_users=2, window=100)
+    idx.add(-1, 1, 10, SPAM, ts=0)
+    assert set(idx.add(-1, 2, 11, SPAM, ts=1)) == {1, 2}
+    # a new sender joining a flagged cluster is reported alone
+    assert idx.add(-1, 3, 12, VARIANT, ts=2) == {3: (None, [12])}
+    assert idx.add(-1, 1, 13, SPAM, ts=3) is None
+
+
+def test_short_texts_and_other_chats_do_not_match():
+    idx = DuplicateIndex(min_users=2)
+    assert idx.add(-1, 1, 10, "привет всем", ts=0) is None
+    assert idx.add(-1, 2, 11, "привет всем", ts=1) is None
+    idx.add(-1, 1, 12, SPAM, ts=2)
+    assert idx.add(-2, 2, 13, SPAM, ts=3) is None
+
+
+def test_entries_expire_after_the_window():
+    idx = DuplicateIndex(min_users=2, window=60)
+    idx.add(-1, 1, 10, SPAM, ts=0)
+    assert idx.add(-1, 2, 11, SPAM, ts=61) is None
+    assert idx.stats() == {"chats": 1, "entries": 1}
+
+
+def test_per_chat_cap_drops_the_oldest_entries():
+    idx = DuplicateIndex(min_users=2, max_per_chat=3)
+    idx.add(-1, 1, 10, SPAM, ts=0)
+    for i in range(3):
+        idx.add(-1, 10 + i, 20 + i, f"{OTHER} номер {i}", ts=1 + i)
+    assert idx.stats()["entries"] == 3
+    assert idx.add(-1, 2, 30, SPAM, ts=5) is None
+
+
+def test_least_recently_active_chat_is_evicted_at_max_chats():
+    idx = DuplicateIndex(min_users=2, max_chats=2)
+    idx.add(-1, 1, 10, SPAM, ts=0)
+    idx.add(-2, 1, 10, SPAM, ts=1)
+    idx.add(-1, 3, 11, OTHER, ts=2)  # -1 is now the most recent
+    idx.add(-3, 1, 10, SPAM, ts=3)   # evicts -2
+    assert set(idx.add(-1, 2, 12, SPAM, ts=4)) == {1, 2}
+    assert idx.add(-2, 2, 11, SPAM, ts=5) is None
+
+
+def test_evict_idle_drops_quiet_chats():
+    idx = DuplicateIndex(window=60)
+    idx.add(-1, 1, 10, SPAM, ts=0)
+    idx.add(-2, 1, 10, SPAM, ts=100)
+    assert idx.evict_idle(now=110) == 1
+    assert idx.stats()["chats"] == 1
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""ExpiryScheduler: deadlines fire in order, cancel is lazy, the heap stays compact,
+and the journal sees every key's changes in the order they were made."""
+import asyncio
+import threading
+import time
+
+from expiry import AsyncExpiryScheduler, ExpiryScheduler
+from support import wait_for
+
+
+class Journal:
+    """Records put/delete like persistence.MuteStore; delete can be made slow."""
+
+    def __init__(self):
+        self.log = []
+        self.on_delete = None
+
+    def put(self, key, deadline):
+        self.log.append(("put", key))
+
+    def delete(self, key):
+        if self.on_delete is not None:
+            self.on_delete(key)
+        self.log.append(("delete", key))
+
+    def state(self):
+        live = set()
+        for op, key in self.log:
+            (live.add if op == "put" else live.discard)(key)
+        return live
+
+
+def started(journal=None):
+    fired = []
+    sched = ExpiryScheduler(lambda key, deadline: fired.append(key), journal=journal)
+    sched.start()
+    return sched, fired
+
+
+def test_keys_fire_in_deadline_order():
+    sched, fired = started()
+    now = time.time()
+    for key, delay in (("c", 0.15), ("a", 0.05), ("b", 0.1)):
+        sched.schedule(key, now + delay)
+    assert wait_for(lambda: len(fired) == 3)
+    assert fired == ["a", "b", "c"]
+    assert len(sched) == 0
+
+
+def test_cancel_and_reschedule_leave_stale_entries_that_never_fire():
+    sched, fired = started()
+    now = time.time()
+    sched.schedule("gone", now + 0.05)
+    sched.schedule("moved", now + 0.05)
+    sched.schedule("kept", now + 0.1)
+    assert sched.cancel("gone")
+    assert not sched.cancel("gone")
+    sched.schedule("moved", now + 0.2)
+    # cancelled and moved entries stay in the heap until they reach the top
+    assert len(sched._heap) == 4 and len(sched) == 2
+    assert not sched.add("kept", now + 60)
+    assert wait_for(lambda: fired == ["kept", "moved"])
+    time.sleep(0.1)
+    assert fired == ["kept", "moved"]
+
+
+def test_heap_is_compacted_when_stale_entries_pile_up():
+    sched = ExpiryScheduler(lambda key, deadline: None)
+    far = time.time() + 3600
+    for i in range(1000):
+        sched.schedule(i, far + i)
+        sched.cancel(i)
+    sched.schedule("live", far)
+    for i in range(1000):
+        sched.schedule("live", far + i)
+    assert len(sched) == 1
+    assert len(sched._heap) <= 2 * len(sched) + 64
+
+
+def test_journal_delete_of_an_expiry_is_not_overtaken_by_a_new_schedule():
+    journal = Journal()
+    sched, fired = started(journal)
+    rescheduled = threading.Event()
+
+    def slow_delete(key):
+        # a new mute for the same key arrives while the expiry is being journaled
+        journal.on_delete = None
+        threading.Thread(target=lambda: (sched.schedule(key, time.time() + 3600), rescheduled.set())).start()
+        rescheduled.wait(0.2)
+
+    journal.on_delete = slow_delete
+    sched.schedule("k", time.time() + 0.05)
+    assert wait_for(lambda: fired == ["k"] and rescheduled.is_set())
+    assert journal.log == [("put", "k"), ("delete", "k"), ("put", "k")]
+    assert "k" in sched and journal.state() == {"k"}
+
+
+def test_cancel_journals_delete():
+    journal = Journal()
+    sched = ExpiryScheduler(lambda key, deadline: None, journal=journal)
+    sched.schedule("k", time.time() + 3600)
+    sched.cancel("k")
+    sched.cancel("k")
+    assert journal.log == [("put", "k"), ("delete", "k")]
+
+
+def test_async_scheduler_fires_and_skips_cancelled():
+    fired = []
+
+    async def callback(key, deadline):
+        fired.append(key)
+
+    async def main():
+        journal = Journal()
+        sched = AsyncExpiryScheduler(callback, journal=journal)
+        runner = asyncio.create_task(sched.run())
+        now = time.time()
+        sched.schedule("b", now + 0.1)
+        sched.schedule("a", now + 0.05)
+        sched.schedule("gone", now + 0.02)
+        sched.cancel("gone")
+        await asyncio.sleep(0.3)
+        runner.cancel()
+        return journal
+
+    journal = asyncio.run(main())
+    assert fired == ["a", "b"]
+    assert journal.state() == set()
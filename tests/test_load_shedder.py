@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""LoadShedder: enter thresholds, hysteresis on the way out, shed() only while overloaded."""
+from load_shedder import LoadShedder
+
+
+class Backlog:
+    def __init__(self):
+        self.depth = 0
+        self.lag = 0.0
+
+
+def shedder(**kwargs):
+    backlog, changes = Backlog(), []
+    s = LoadShedder(lambda: backlog.depth, lambda: backlog.lag, enter_depth=100, exit_depth=10,
+                    enter_lag=5.0, exit_lag=1.0, calm_seconds=10,
+                    on_change=lambda active, reason: changes.append((active, reason)), **kwargs)
+    return s, backlog, changes
+
+
+def test_enters_on_queue_depth_or_lag():
+    s, backlog, changes = shedder()
+    backlog.depth = 99
+    s.check(now=0)
+    assert not s.active and not s.shed("directory")
+    backlog.depth = 100
+    s.check(now=1)
+    assert s.active and s.shed("directory")
+    assert changes == [(True, "queue_depth=100")]
+
+    s, backlog, changes = shedder()
+    backlog.lag = 5.0
+    s.check(now=0)
+    assert changes == [(True, "lag=5.0s")]
+
+
+def test_leaves_only_after_staying_calm_below_the_exit_thresholds():
+    s, backlog, changes = shedder()
+    backlog.depth = 500
+    s.check(now=0)
+    backlog.depth = 50          # under enter, still over exit: stays on
+    s.check(now=1)
+    s.check(now=30)
+    assert s.active
+    backlog.depth = 5
+    s.check(now=31)             # calm starts
+    backlog.lag = 2.0
+    s.check(now=35)             # lag over exit: calm restarts
+    backlog.lag = 0.5
+    s.check(now=36)
+    s.check(now=45)
+    assert s.active
+    s.check(now=46)
+    assert not s.active and not s.shed("directory")
+    assert changes == [(True, "queue_depth=500"), (False, "queue_depth=500")]
+
+
+def test_a_failing_callback_does_not_break_the_check():
+    backlog = Backlog()
+
+    def broken(active, reason):
+        raise RuntimeError("boom")
+
+    s = LoadShedder(lambda: backlog.depth, lambda: backlog.lag, enter_depth=1, on_change=broken)
+    backlog.depth = 1
+    s.check(now=0)
+    assert s.active
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""MediaIndex: per-user and distinct-user thresholds, shared kinds, eviction."""
+from types import SimpleNamespace
+
+from media_index import MediaIndex, media_unique_id
+
+
+def photo(fuid):
+    return SimpleNamespace(photo=[SimpleNamespace(file_unique_id=fuid + "-small"),
+                                  SimpleNamespace(file_unique_id=fuid)])
+
+
+def sticker(fuid):
+    return SimpleNamespace(sticker=SimpleNamespace(file_unique_id=fuid))
+
+
+def test_media_unique_id_uses_the_largest_photo():
+    assert media_unique_id(photo("P")) == ("photo", "P")
+    assert media_unique_id(sticker("S")) == ("sticker", "S")
+    assert media_unique_id(SimpleNamespace(text="hi")) is None
+
+
+def test_one_user_over_the_per_user_limit():
+    idx = MediaIndex(per_user_limit=3, min_users=5)
+    for i in range(3):
+        assert idx.add(-1, 7, 10 + i, photo("P"), ts=i) is None
+    assert idx.add(-1, 7, 13, photo("P"), ts=3, name="seven") == {7: ("seven", [10, 11, 12, 13])}
+    # reported once per window
+    assert idx.add(-1, 7, 14, photo("P"), ts=4) is None
+
+
+def test_distinct_users_reaching_min_users():
+    idx = MediaIndex(min_users=3)
+    assert idx.add(-1, 1, 10, photo("P"), ts=0) is None
+    assert idx.add(-1, 2, 11, photo("P"), ts=1) is None
+    assert idx.add(-1, 3, 12, photo("P"), ts=2) == {1: (None, [10]), 2: (None, [11]), 3: (None, [12])}
+    assert idx.add(-1, 4, 13, photo("P"), ts=3) == {4: (None, [13])}
+
+
+def test_shared_stickers_only_count_per_user():
+    idx = MediaIndex(min_users=3, per_user_limit=2)
+    for uid in range(1, 6):
+        assert idx.add(-1, uid, uid, sticker("S"), ts=uid) is None
+    idx.add(-1, 9, 20, sticker("S"), ts=6)
+    idx.add(-1, 9, 21, sticker("S"), ts=7)
+    assert idx.add(-1, 9, 22, sticker("S"), ts=8) == {9: (None, [20, 21, 22])}
+
+
+def test_sends_outside_the_window_do_not_count():
+    idx = MediaIndex(window=60, per_user_limit=1)
+    idx.add(-1, 7, 10, photo("P"), ts=0)
+    assert idx.add(-1, 7, 11, photo("P"), ts=61) is None
+    assert idx.add(-1, 7, 12, photo("P"), ts=62) == {7: (None, [11, 12])}
+
+
+def test_same_file_in_another_chat_is_separate():
+    idx = MediaIndex(per_user_limit=1)
+    idx.add(-1, 7, 10, photo("P"), ts=0)
+    assert idx.add(-2, 7, 10, photo("P"), ts=1) is None
+
+
+def test_least_recently_sent_file_is_evicted_at_max_keys():
+    idx = MediaIndex(per_user_limit=1, max_keys=2)
+    idx.add(-1, 7, 10, photo("A"), ts=0)
+    idx.add(-1, 7, 11, photo("B"), ts=1)
+    idx.add(-1, 7, 12, photo("A"), ts=2)  # A flagged and now the most recent
+    idx.add(-1, 7, 13, photo("C"), ts=3)  # evicts B
+    assert len(idx) == 2
+    assert idx.add(-1, 7, 14, photo("B"), ts=4) is None
+
+
+def test_evict_idle_stops_at_the_first_active_file():
+    idx = MediaIndex(window=60)
+    idx.add(-1, 7, 10, photo("A"), ts=0)
+    idx.add(-1, 7, 11, photo("B"), ts=10)
+    idx.add(-1, 7, 12, photo("C"), ts=100)
+    assert idx.evict_idle(now=100) == 2
+    assert len(idx) == 1
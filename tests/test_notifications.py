@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""NotificationAggregator: coalescing, in-place edits, max_users, hold, summary eviction."""
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+
+from notifications import NotificationAggregator
+from support import wait_for
+
+DELAY = 0.05
+
+
+class Chat:
+    """Fake send/edit that record the rendered user lists."""
+
+    def __init__(self, fail_sends=0):
+        self.sent = []    # (chat_id, message_id, [user_id...])
+        self.edits = []   # (chat_id, message_id, [(user_id, status)...])
+        self.fail_sends = fail_sends
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def render(self, chat_id, entries):
+        return [(e.user_id, e.status) for e in entries], None
+
+    def send(self, chat_id, text, markup):
+        fut = Future()
+        with self._lock:
+            if self.fail_sends:
+                self.fail_sends -= 1
+                fut.set_exception(RuntimeError("chat not found"))
+                return fut
+            message_id = next(self._ids)
+        # recorded once the aggregator knows the message id
+        fut.set_result(SimpleNamespace(message_id=message_id))
+        with self._lock:
+            self.sent.append((chat_id, message_id, [uid for uid, _ in text]))
+        return fut
+
+    def edit(self, chat_id, message_id, text, markup):
+        with self._lock:
+            self.edits.append((chat_id, message_id, text))
+        fut = Future()
+        fut.set_result(True)
+        return fut
+
+
+@pytest.fixture
+def chat():
+    return Chat()
+
+
+def aggregator(chat, **kwargs):
+    kwargs.setdefault("delay", DELAY)
+    return NotificationAggregator(chat.render, chat.send, chat.edit, **kwargs).start()
+
+
+def test_mutes_within_the_delay_become_one_message(chat):
+    agg = aggregator(chat)
+    for uid in (1, 2, 3):
+        agg.add(-1, uid, f"user{uid}", "flood")
+    agg.add(-1, 2, "user2", "flood")  # already listed
+    agg.add(-2, 9, "user9", "flood")
+    assert wait_for(lambda: len(chat.sent) == 2)
+    assert {chat_id: users for chat_id, _, users in chat.sent} == {-1: [1, 2, 3], -2: [9]}
+    assert agg.pending() == 0
+
+
+def test_later_mutes_edit_the_posted_summary(chat):
+    agg = aggregator(chat)
+    agg.add(-1, 1, "a", "flood")
+    assert wait_for(lambda: chat.sent)
+    agg.add(-1, 2, "b", "flood")
+    assert wait_for(lambda: chat.edits)
+    assert chat.edits == [(-1, 1, [(1, None), (2, None)])]
+    assert len(chat.sent) == 1
+
+
+def test_a_full_summary_starts_a_new_message(chat):
+    agg = aggregator(chat, max_users=2)
+    for uid in (1, 2, 3):
+        agg.add(-1, uid, str(uid), "flood")
+    assert wait_for(lambda: len(chat.sent) == 2)
+    assert sorted(users for _, _, users in chat.sent) == [[1, 2], [3]]
+
+
+def test_resolve_rerenders_the_summary(chat):
+    agg = aggregator(chat)
+    agg.add(-1, 1, "a", "flood")
+    agg.add(-1, 2, "b", "flood")
+    assert wait_for(lambda: chat.sent)
+    _, message_id, _ = chat.sent[0]
+    assert agg.resolve(-1, message_id, 2, "размучен")
+    assert wait_for(lambda: chat.edits)
+    assert chat.edits[-1][2] == [(1, None), (2, "размучен")]
+    assert not agg.resolve(-1, message_id + 100, 2, "размучен")
+
+
+def test_hold_defers_sending_until_released(chat):
+    agg = aggregator(chat)
+    agg.hold(True)
+    agg.add(-1, 1, "a", "flood")
+    agg.add(-1, 2, "b", "flood")
+    time.sleep(DELAY * 4)
+    assert chat.sent == [] and agg.pending() == 1
+    agg.hold(False)
+    assert wait_for(lambda: chat.sent == [(-1, 1, [1, 2])])
+
+
+def test_old_summaries_are_forgotten_past_max_summaries(chat):
+    agg = aggregator(chat, max_users=1, max_summaries=2)
+    for uid in (1, 2, 3):
+        agg.add(-1, uid, str(uid), "flood")
+        assert wait_for(lambda: len(chat.sent) == uid)
+    ids = {uid: message_id for _, message_id, (uid,) in chat.sent}
+    assert not agg.resolve(-1, ids[1], 1, "забанен")
+    assert agg.resolve(-1, ids[3], 3, "забанен")
+
+
+def test_a_failed_send_starts_over_with_the_next_mute():
+    chat = Chat(fail_sends=1)
+    agg = aggregator(chat)
+    agg.add(-1, 1, "a", "flood")
+    assert wait_for(lambda: chat.fail_sends == 0 and agg.pending() == 0)
+    time.sleep(DELAY)
+    agg.add(-1, 2, "b", "flood")
+    assert wait_for(lambda: chat.sent == [(-1, 1, [2])])
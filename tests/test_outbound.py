@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""OutboundScheduler: priority order, global and per-chat token buckets."""
+import time
+
+import pytest
+
+from outbound import PRIO_DELETE, PRIO_NOTIFY, PRIO_RESTRICT, OutboundScheduler, TokenBucket
+from support import wait_for
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.stamp
+    for _ in range(2):
+        assert bucket.delay(now) == 0
+        bucket.take()
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0
+    # never refills past capacity
+    assert bucket.delay(now + 100) == 0 and bucket.tokens == 2
+
+
+def test_calls_run_in_priority_order_fifo_within_a_class():
+    out = OutboundScheduler(workers=1)
+    order = []
+    for prio, name in ((PRIO_NOTIFY, "notify1"), (PRIO_DELETE, "delete1"), (PRIO_RESTRICT, "restrict1"),
+                       (PRIO_NOTIFY, "notify2"), (PRIO_RESTRICT, "restrict2"), (PRIO_DELETE, "delete2")):
+        out.submit(prio, -1, order.append, name)
+    out.start()
+    assert wait_for(lambda: len(order) == 6)
+    assert order == ["restrict1", "restrict2", "delete1", "delete2", "notify1", "notify2"]
+
+
+def test_chat_bucket_limits_notifications_per_chat_only():
+    out = OutboundScheduler(chat_rate=0.01, chat_burst=2)
+    out.start()
+    sent = [out.submit(PRIO_NOTIFY, -1, lambda i=i: i) for i in range(4)]
+    other = out.submit(PRIO_NOTIFY, -2, lambda: "other chat")
+    restrict = out.submit(PRIO_RESTRICT, -1, lambda: "restrict")
+    assert [f.result(5) for f in sent[:2]] == [0, 1]
+    assert other.result(5) == "other chat"
+    assert restrict.result(5) == "restrict"
+    # the rest of chat -1's notifications wait for its bucket
+    assert not any(f.done() for f in sent[2:])
+    assert out.queue_depth() == 2
+
+
+def test_global_bucket_paces_all_calls():
+    out = OutboundScheduler(global_rate=10)
+    out.start()
+    t0 = time.monotonic()
+    futs = [out.submit(PRIO_RESTRICT, -i, lambda: None) for i in range(15)]
+    for f in futs:
+        f.result(5)
+    # 10 fit in the initial burst, 5 more need half a second of refill
+    assert time.monotonic() - t0 >= 0.4
+
+
+def test_idle_chat_buckets_are_dropped_at_the_cap():
+    out = OutboundScheduler(chat_rate=1000, max_chats=3)
+    for chat_id in (-1, -2, -3):
+        out._chat_bucket(chat_id)
+    time.sleep(0.01)
+    out._chat_bucket(-4)
+    assert list(out._chat_buckets) == [-4]
+
+
+def test_errors_reach_the_future():
+    out = OutboundScheduler()
+    out.start()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        out.call(PRIO_DELETE, -1, fail)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""MuteStore: batched writes collapse per key, restore reschedules and spreads expired mutes."""
+import pytest
+
+from persistence import MuteStore
+from support import wait_for
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def schedule(self, key, deadline):
+        self.calls.append((key, deadline))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MuteStore(str(tmp_path / "mutes.db"), flush_interval=0.01)
+
+
+def test_batch_keeps_last_change_per_key(store):
+    store.put((1, 10), 100.0)
+    store.put((1, 10), 200.0)
+    store.put((1, 11), 300.0)
+    store.delete((1, 11))
+    store.put((2, 10), 400.0)
+    assert store._drain() == {(1, 10): 200.0, (1, 11): None, (2, 10): 400.0}
+    assert store._drain() == {}
+
+
+def test_batch_is_capped(tmp_path):
+    store = MuteStore(str(tmp_path / "mutes.db"), batch_size=3)
+    for u in range(5):
+        store.put((1, u), 100.0)
+    assert len(store._drain()) == 3
+    assert len(store._drain()) == 2
+
+
+def test_writer_applies_the_final_state(store):
+    for i in range(50):
+        store.put((1, 10), 100.0 + i)
+    store.put((1, 11), 500.0)
+    store.put((1, 12), 600.0)
+    store.delete((1, 12))
+    store.start()
+    assert wait_for(lambda: sorted(store.load()) == [(1, 10, 149.0), (1, 11, 500.0)])
+    store.delete((1, 10))
+    assert wait_for(lambda: store.load() == [(1, 11, 500.0)])
+
+
+def test_restore_keeps_running_mutes_and_spreads_expired_ones(store):
+    now = 1000.0
+    store.put((1, 10), now + 60)
+    store.put((1, 11), now + 3600)
+    for u in range(4):
+        store.put((2, u), now - 10 - u)
+    store.start()
+    assert wait_for(lambda: len(store.load()) == 6)
+
+    sched = Recorder()
+    assert store.restore(sched, spread=40.0, now=now) == (2, 4)
+    got = dict(sched.calls)
+    assert got[(1, 10)] == now + 60 and got[(1, 11)] == now + 3600
+    spread = sorted(d for k, d in sched.calls if k[0] == 2)
+    assert spread == [now, now + 10, now + 20, now + 30]
+
+
+def test_restore_of_an_empty_store(store):
+    sched = Recorder()
+    assert store.restore(sched, now=1000.0) == (0, 0)
+    assert sched.calls == []
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""/purge after an auto-mute must pick messages that are still in the chat."""
+import pytest
+
+from support import deleted_ids, feed, message, wait_for
+
+ADMIN = 42
+
+
+@pytest.mark.parametrize("bot_fixture, chat_id", [("spam_bot", -1002000000001),
+                                                  ("delete_bot", -1002000000002)])
+def test_purge_after_auto_mute_skips_deleted(request, api, bot_fixture, chat_id):
+    mod = request.getfixturevalue(bot_fixture)
+    api.admins.add(ADMIN)
+    limit = getattr(mod, "SPAM_LIMIT", None) or mod.MAX_MSG
+
+    talk = [message(i, chat_id, 7) for i in range(1, 6)]
+    flood = [message(10 + i, chat_id, 11) for i in range(limit + 1)]
+    feed(mod, talk + flood)
+    spam_ids = {u["update_id"] for u in flood}
+    assert wait_for(lambda: spam_ids <= set(deleted_ids(api, chat_id))), "auto-mute did not purge the flood"
+
+    command = message(100, chat_id, ADMIN, "/purge last 3")
+    feed(mod, [command])
+    assert wait_for(lambda: 100 in deleted_ids(api, chat_id)), "/purge did not delete anything"
+    purged = set(deleted_ids(api, chat_id)) - spam_ids - {100}
+    assert purged == {3, 4, 5}
+    assert wait_for(lambda: any(p.get("text") == "Удаляю сообщений: 3."
+                                for p in api.params("sendMessage", chat_id)))
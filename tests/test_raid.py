@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""RaidDetector: lockdown thresholds, cooldown, restricted joiners, chat eviction."""
+from raid import BucketCounter, RaidDetector
+
+
+def detector(**kwargs):
+    changes = []
+    kwargs.setdefault("window", 60)
+    kwargs.setdefault("cooldown", 30)
+    raid = RaidDetector(on_change=lambda chat_id, active, reason: changes.append((chat_id, active, reason)),
+                        **kwargs)
+    return raid, changes
+
+
+def test_bucket_counter_forgets_events_older_than_the_window():
+    c = BucketCounter(window=60, buckets=12)
+    c.add(0)
+    c.add(30, 2)
+    assert c.total(30) == 3
+    assert c.total(64) == 2
+    assert c.total(95) == 0
+
+
+def test_join_flood_starts_a_lockdown_and_collects_joiners():
+    raid, changes = detector(join_limit=5)
+    for uid in range(1, 5):
+        assert not raid.on_join(-1, uid, ts=uid)
+    assert raid.on_join(-1, 5, ts=5)
+    assert raid.on_join(-1, 6, ts=6)
+    assert raid.in_lockdown(-1) and not raid.in_lockdown(-2)
+    assert changes == [(-1, True, "joins=5/60s")]
+    assert raid.lockdowns() == 1
+
+
+def test_first_messages_of_recent_joiners_count_once_per_user():
+    raid, changes = detector(new_msg_limit=3, new_user_seconds=100)
+    for uid in (1, 2, 3):
+        raid.on_join(-1, uid, ts=0)
+    raid.on_message(-1, 1, ts=1)
+    raid.on_message(-1, 1, ts=2)  # not a first message any more
+    raid.on_message(-1, 2, ts=3)
+    assert not raid.in_lockdown(-1)
+    assert raid.on_message(-1, 3, ts=4)
+    assert changes[0][:2] == (-1, True)
+
+
+def test_lockdown_ends_after_a_calm_cooldown():
+    raid, changes = detector(msg_limit=10, cooldown=30)
+    for i in range(10):
+        raid.on_message(-1, 100 + i, ts=i * 0.1)
+    assert raid.in_lockdown(-1)
+    raid.tick(now=70)   # counters back under half of the limits: calm from here
+    raid.tick(now=90)
+    assert raid.in_lockdown(-1)
+    raid.tick(now=100)
+    assert not raid.in_lockdown(-1)
+    assert changes == [(-1, True, "msgs=10/60s"), (-1, False, "msgs=10/60s")]
+
+
+def test_traffic_during_the_cooldown_restarts_it():
+    raid, _ = detector(msg_limit=4, cooldown=30)
+    for i in range(4):
+        raid.on_message(-1, i, ts=0)
+    raid.tick(now=70)
+    for i in range(2):
+        raid.on_message(-1, i, ts=80)  # half of the limit is not calm
+    raid.tick(now=100)
+    assert raid.in_lockdown(-1)
+
+
+def test_take_restricted_returns_joiners_of_the_lockdown_once():
+    raid, _ = detector(join_limit=2)
+    raid.on_join(-1, 1, ts=0)
+    raid.on_join(-1, 2, ts=1)
+    raid.on_join(-1, 3, ts=2)
+    assert raid.take_restricted(-1) == [2, 3]
+    assert raid.take_restricted(-1) == []
+    assert raid.take_restricted(-2) == []
+
+
+def test_quiet_chats_are_evicted_before_chats_in_lockdown():
+    raid, _ = detector(join_limit=1, msg_limit=1000, max_chats=2)
+    raid.on_join(-1, 1, ts=0)           # -1 in lockdown, least recently active
+    raid.on_message(-2, 1, ts=1)
+    raid.on_message(-3, 1, ts=2)        # evicts -2, not -1
+    assert raid.in_lockdown(-1)
+    assert set(raid._chats) == {-1, -3}
+
+
+def test_chat_map_stays_bounded_when_every_chat_is_in_lockdown():
+    raid, changes = detector(join_limit=1, max_chats=3)
+    for chat_id in range(-1, -6, -1):
+        assert raid.on_join(chat_id, 100, ts=-chat_id)
+    assert len(raid._chats) == 3
+    # the least recently active lockdowns were ended and reported like a normal end
+    assert [c for c in changes if not c[1]] == [(-1, False, "joins=1/60s"), (-2, False, "joins=1/60s")]
+    assert raid.take_restricted(-1) == [100]
+    assert raid.take_restricted(-1) == []
+    assert raid.lockdowns() == 3
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Per-chat sharding: each chat sticks to one shard, and shards never wait on each other."""
+import threading
+
+from shards import Sharded
+from window_store import WindowStore
+
+LOCK_TYPE = type(threading.Lock())
+
+
+def chats_on_different_shards(sharded):
+    a = -1003000000001
+    b = next(c for c in range(a - 1, a - 100, -1) if sharded[c] is not sharded[a])
+    return a, b
+
+
+def test_chat_always_maps_to_the_same_shard():
+    sharded = Sharded(object, 8)
+    assert len(sharded) == 8
+    assert len({id(s) for s in sharded}) == 8
+    for chat_id in (-1001, -1002, 5, 10 ** 12):
+        assert sharded[chat_id] is sharded[chat_id]
+    assert len({id(sharded[c]) for c in range(-1000, 0)}) == 8
+
+
+def test_busy_shard_does_not_block_other_chats():
+    sharded = Sharded(lambda: WindowStore(capacity=4), 4)
+    a, b = chats_on_different_shards(sharded)
+    done = {}
+
+    def add(chat_id):
+        sharded[chat_id].add(chat_id, 1, 0.0, 1, 60)
+        done[chat_id] = True
+
+    with sharded[a]._lock:
+        other = threading.Thread(target=add, args=(b,))
+        same = threading.Thread(target=add, args=(a,))
+        other.start()
+        same.start()
+        other.join(5)
+        same.join(0.2)
+        assert done.get(b), "a chat on another shard waited for the held lock"
+        assert a not in done, "a chat on the held shard did not wait"
+    same.join(5)
+    assert done.get(a)
+
+
+def test_delete_bot_has_no_global_lock(delete_bot):
+    assert isinstance(delete_bot.user_messages, Sharded)
+    assert not [name for name, value in vars(delete_bot).items() if isinstance(value, LOCK_TYPE)]
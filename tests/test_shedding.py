@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""In overload mode the bots skip get_chat_member lookups that only fetch a name."""
+import time
+
+from telebot import types
+
+from support import wait_for
+
+ADMIN = 42
+STRANGER = 987654
+
+
+def lookups(api, chat_id, user_id):
+    return [p for p in api.params("getChatMember", chat_id) if int(p.get("user_id", 0)) == user_id]
+
+
+def test_spam_bot_find_member_falls_back_to_the_raw_id(spam_bot, api, monkeypatch):
+    chat_id = -1005000000001
+    monkeypatch.setattr(spam_bot.shedder, "active", True)
+    user = spam_bot.find_member(chat_id, str(STRANGER))
+    assert user.id == STRANGER
+    assert not lookups(api, chat_id, STRANGER)
+
+    monkeypatch.setattr(spam_bot.shedder, "active", False)
+    assert spam_bot.find_member(chat_id, str(STRANGER)).first_name == f"user{STRANGER}"
+    assert lookups(api, chat_id, STRANGER)
+
+
+def test_delete_bot_button_skips_the_name_lookup(delete_bot, api, monkeypatch):
+    chat_id = -1005000000002
+    api.admins.add(ADMIN)
+    monkeypatch.setattr(delete_bot.shedder, "active", True)
+    chat = {"id": chat_id, "type": "supergroup", "title": str(chat_id)}
+    update = {"update_id": 1,
+              "callback_query": {"id": "1", "chat_instance": "1", "data": f"ban:{chat_id}:{STRANGER}",
+                                 "from": {"id": ADMIN, "is_bot": False, "first_name": "admin"},
+                                 "message": {"message_id": 500, "date": int(time.time()), "chat": chat,
+                                             "text": "summary"}}}
+    delete_bot.bot.process_new_updates([types.Update.de_json(update)])
+    assert wait_for(lambda: any(str(STRANGER) in p.get("text", "") for p in api.params("sendMessage", chat_id)))
+    assert api.params("banChatMember", chat_id) or api.params("kickChatMember", chat_id)
+    assert not lookups(api, chat_id, STRANGER)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Transport: 429 retry_after, retries only for idempotent methods, per-method breaker."""
+import pytest
+import requests
+
+import transport
+from transport import CircuitOpenError, Transport
+
+URL = "https://api.telegram.org/botTOKEN/"
+
+
+class Clock:
+    """Stands in for the time module inside transport: sleep() only advances monotonic()."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Response:
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.headers = {}
+        self._body = {"ok": status_code == 200}
+        if retry_after is not None:
+            self._body["parameters"] = {"retry_after": retry_after}
+
+    def json(self):
+        return self._body
+
+
+class Session:
+    """Plays back scripted responses (or raises scripted exceptions) and counts calls."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        step = self.script.pop(0) if len(self.script) > 1 else self.script[0]
+        if isinstance(step, Exception):
+            raise step
+        return step
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(transport, "time", clock)
+    return clock
+
+
+def make(*script, **kwargs):
+    t = Transport(**kwargs)
+    t.session = Session(*script)
+    return t
+
+
+def test_flood_wait_sleeps_retry_after_for_any_method(clock):
+    t = make(Response(429, retry_after=7), Response(200))
+    assert t.request("post", URL + "sendMessage").status_code == 200
+    assert t.session.calls == 2
+    assert clock.sleeps == [7.0]
+
+
+def test_flood_wait_beyond_the_limit_is_returned(clock):
+    t = make(Response(429, retry_after=500), max_retry_after=120)
+    assert t.request("post", URL + "deleteMessages").status_code == 429
+    assert t.session.calls == 1 and clock.sleeps == []
+
+
+def test_server_errors_are_retried_only_for_idempotent_methods(clock):
+    t = make(Response(502), Response(502), Response(200))
+    assert t.request("post", URL + "restrictChatMember").status_code == 200
+    assert t.session.calls == 3 and len(clock.sleeps) == 2
+
+    t = make(Response(502), Response(200))
+    assert t.request("post", URL + "sendMessage").status_code == 502
+    assert t.session.calls == 1
+
+    t = make(requests.ConnectionError("reset"), Response(200))
+    with pytest.raises(requests.ConnectionError):
+        t.request("post", URL + "sendMessage")
+    assert t.session.calls == 1
+
+
+def test_retries_stop_after_max_retries(clock):
+    t = make(requests.Timeout("slow"), max_retries=2, breaker_threshold=100)
+    with pytest.raises(requests.Timeout):
+        t.request("post", URL + "deleteMessage")
+    assert t.session.calls == 3
+
+
+def test_breaker_opens_per_method_and_lets_one_trial_through(clock):
+    t = make(Response(500), max_retries=0, breaker_threshold=3, breaker_cooldown=30)
+    for _ in range(3):
+        assert t.request("post", URL + "sendMessage").status_code == 500
+    with pytest.raises(CircuitOpenError):
+        t.request("post", URL + "sendMessage")
+    assert t.session.calls == 3
+
+    # other methods keep their own breaker
+    t.session.script = [Response(200)]
+    assert t.request("post", URL + "deleteMessage").status_code == 200
+
+    clock.now += 31
+    assert t.request("post", URL + "sendMessage").status_code == 200
+    assert t._breakers["sendMessage"].opened_at is None
+
+
+def test_flood_wait_does_not_trip_the_breaker(clock):
+    t = make(Response(429, retry_after=1), max_retries=0, breaker_threshold=2)
+    for _ in range(5):
+        assert t.request("post", URL + "sendMessage").status_code == 429
+    assert t._breakers["sendMessage"].opened_at is None
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""WebhookServer on an ephemeral port: secret check, back-pressure, per-chat order."""
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from support import message, wait_for
+from webhook import SECRET_HEADER, WebhookServer, post_updates
+
+SECRET = "s3cret"
+CHAT_A = -1004000000001
+CHAT_B = -1004000000002
+
+
+class BlockingBot:
+    """Stands in for the bot: process_new_updates waits until released."""
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.updates = []
+
+    def process_new_updates(self, updates):
+        self.entered.set()
+        self.release.wait(10)
+        self.updates.extend(updates)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(bot, **kwargs):
+        server = WebhookServer(bot, "127.0.0.1", 0, secret_token=SECRET, **kwargs)
+        server.start()
+        servers.append(server)
+        return "http://%s:%s/webhook" % server.address[:2], server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def post(url, update, secret=SECRET) -> int:
+    req = urllib.request.Request(url, data=json.dumps(update).encode("utf-8"), method="POST",
+                                 headers={"Content-Type": "application/json", SECRET_HEADER: secret})
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_wrong_secret_is_forbidden(serve):
+    bot = BlockingBot()
+    bot.release.set()
+    url, server = serve(bot)
+    assert post(url, message(1, CHAT_A, 7), secret="wrong") == 403
+    assert post(url, message(2, CHAT_A, 7)) == 200
+    assert wait_for(lambda: [u.update_id for u in bot.updates] == [2])
+    assert server.accepted == 1
+
+
+def test_full_queue_answers_503(serve):
+    bot = BlockingBot()
+    url, server = serve(bot, queue_size=1)
+    try:
+        assert post(url, message(1, CHAT_A, 7)) == 200
+        # the feeder holds update 1, update 2 fills the queue
+        assert bot.entered.wait(10)
+        assert post(url, message(2, CHAT_A, 7)) == 200
+        assert post(url, message(3, CHAT_A, 7)) == 503
+        assert (server.accepted, server.rejected) == (2, 1)
+    finally:
+        bot.release.set()
+    assert wait_for(lambda: [u.update_id for u in bot.updates] == [1, 2])
+
+
+def test_updates_reach_handlers_in_arrival_order_per_chat(delete_bot, serve, handled):
+    url, _ = serve(delete_bot.bot)
+    # a different sender per message keeps everyone under the flood limit
+    updates = [message(100 + i, CHAT_A if i % 3 else CHAT_B, 500 + i) for i in range(60)]
+    assert post_updates([json.dumps(u) for u in updates], url, SECRET) == len(updates)
+
+    expected = {chat: [u["update_id"] for u in updates if u["message"]["chat"]["id"] == chat]
+                for chat in (CHAT_A, CHAT_B)}
+    assert wait_for(lambda: all(len(handled[c]) == len(ids) for c, ids in expected.items()))
+    assert handled[CHAT_A] == expected[CHAT_A]
+    assert handled[CHAT_B] == expected[CHAT_B]
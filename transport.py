@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP transport for telebot: one pooled keep-alive session, flood-wait and
+retry handling, and a circuit breaker per Bot API method.
+
+Installed through apihelper.CUSTOM_REQUEST_SENDER, so it applies to every
+call the bot makes.
+
+- 429: sleep for `retry_after` and try again (any method, Telegram did not
+  execute the request).
+- 5xx / connection errors: retry with jittered exponential backoff, only for
+  idempotent methods (restrict, ban, delete, lookups).
+- After `breaker_threshold` consecutive failures of a method its breaker opens
+  and calls fail fast for `breaker_cooldown` seconds, then one trial call is
+  let through.
+"""
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+
+from metrics import API_ERRORS, API_FLOOD_WAITS, API_LATENCY
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset((
+    "restrictChatMember", "banChatMember", "kickChatMember", "unbanChatMember",
+    "deleteMessage", "deleteMessages", "getChatMember", "getMe", "getChat",
+))
+# getUpdates has its own retry loop in infinity_polling
+PASSTHROUGH_METHODS = frozenset(("getUpdates",))
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, method_name: str, retry_in: float):
+        super().__init__(f"Circuit open for {method_name}, retry in {retry_in:.1f}s")
+        self.method_name = method_name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    __slots__ = ("threshold", "cooldown", "failures", "opened_at", "trial")
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def before_call(self, method_name: str):
+        if self.opened_at is None:
+            return
+        left = self.opened_at + self.cooldown - time.monotonic()
+        if left > 0 or self.trial:
+            raise CircuitOpenError(method_name, max(left, 0.0))
+        # half-open: let exactly one call through
+        self.trial = True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def failure(self):
+        self.failures += 1
+        self.trial = False
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning("Circuit breaker opened after %d failures", self.failures)
+            self.opened_at = time.monotonic()
+
+
+class Transport:
+    def __init__(self, pool_size: int = 32, max_retries: int = 4,
+                 backoff_base: float = 0.5, backoff_max: float = 30,
+                 max_retry_after: float = 120, breaker_threshold: int = 5,
+                 breaker_cooldown: float = 30):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        # method name -> CircuitBreaker
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def install(self):
+        apihelper.CUSTOM_REQUEST_SENDER = self.request
+        return self
+
+    def _breaker(self, method_name: str) -> CircuitBreaker:
+        b = self._breakers.get(method_name)
+        if b is None:
+            b = self._breakers.setdefault(method_name, CircuitBreaker(self.breaker_threshold, self.breaker_cooldown))
+        return b
+
+    def _backoff(self, attempt: int) -> float:
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(cap / 2, cap)
+
+    @staticmethod
+    def _retry_after(resp) -> float:
+        try:
+            return float(resp.json()["parameters"]["retry_after"])
+        except Exception:
+            return float(resp.headers.get("Retry-After", 1))
+
+    def request(self, method, url, **kwargs):
+        method_name = url.rsplit("/", 1)[-1]
+        if method_name in PASSTHROUGH_METHODS or kwargs.get("files"):
+            # uploads can't be replayed: file objects are consumed by the first try
+            return self.session.request(method, url, **kwargs)
+
+        idempotent = method_name in IDEMPOTENT_METHODS
+        breaker = self._breaker(method_name)
+        attempt = 0
+        while True:
+            with self._lock:
+                breaker.before_call(method_name)
+            started = time.monotonic()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                API_LATENCY.observe(time.monotonic() - started, method_name)
+                API_ERRORS.inc(method_name)
+                with self._lock:
+                    breaker.failure()
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning("%s: %s, retry #%d in %.1fs", method_name, type(e).__name__, attempt + 1, delay)
+            else:
+                API_LATENCY.observe(time.monotonic() - started, method_name)
+                if resp.status_code == 429:
+                    API_FLOOD_WAITS.inc(method_name)
+                    # the endpoint is alive, flood control is not a breaker failure
+                    with self._lock:
+                        breaker.success()
+                    delay = self._retry_after(resp)
+                    if attempt >= self.max_retries or delay > self.max_retry_after:
+                        return resp
+                    logger.warning("%s: flood wait %.1fs, retry #%d", method_name, delay, attempt + 1)
+                elif resp.status_code >= 500:
+                    API_ERRORS.inc(method_name)
+                    with self._lock:
+                        breaker.failure()
+                    if not idempotent or attempt >= self.max_retries:
+                        return resp
+                    delay = self._backoff(attempt)
+                    logger.warning("%s: HTTP %d, retry #%d in %.1fs", method_name, resp.status_code, attempt + 1, delay)
+                else:
+                    if resp.status_code >= 400:
+                        API_ERRORS.inc(method_name)
+                    with self._lock:
+                        breaker.success()
+                    return resp
+            attempt += 1
+            time.sleep(delay)
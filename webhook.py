@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Webhook ingestion: a small local HTTP server for Telegram updates.
+
+The request handler only checks the X-Telegram-Bot-Api-Secret-Token header,
+puts the raw body into a bounded queue and answers 200 right away. A single
+feeder thread parses the updates in arrival order and passes them to
+bot.process_new_updates, which the OrderedDispatcher replaces with its
+submit(): handling is parallel across chats there, while updates of one chat
+keep their order (several threads feeding the dispatcher could swap them).
+If the queue is full the server answers 503 and Telegram redelivers later.
+
+Local testing without Telegram (recorded updates, one JSON object per line):
+    python3 webhook.py post updates.jsonl http://127.0.0.1:8443/webhook SECRET
+"""
+import hmac
+import json
+import logging
+import queue
+import sys
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY = 1024 * 1024
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # stdlib default backlog is 5: bursts of deliveries got connection resets
+    request_queue_size = 128
+
+
+class WebhookServer:
+    def __init__(self, bot, host: str = "127.0.0.1", port: int = 8443, secret_token: str = None,
+                 path: str = "/webhook", queue_size: int = 10000):
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.accepted = 0
+        self.rejected = 0
+        self.httpd = _HTTPServer((host, port), self._handler_class())
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    return self._reply(404)
+                if server.secret_token is not None:
+                    got = self.headers.get(SECRET_HEADER, "")
+                    if not hmac.compare_digest(got, server.secret_token):
+                        return self._reply(403)
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_BODY:
+                    return self._reply(400)
+                body = self.rfile.read(length)
+                try:
+                    server.queue.put_nowait(body)
+                except queue.Full:
+                    server.rejected += 1
+                    return self._reply(503)
+                server.accepted += 1
+                self._reply(200)
+
+            def _reply(self, code: int):
+                self.send_response(code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, fmt, *args):
+                logger.debug("webhook: " + fmt, *args)
+
+        return Handler
+
+    def _feeder(self):
+        while True:
+            body = self.queue.get()
+            try:
+                update = types.Update.de_json(body.decode("utf-8"))
+                self.bot.process_new_updates([update])
+            except Exception:
+                logger.exception("Failed to process webhook update")
+
+    def start(self):
+        """Start the feeder and the HTTP server in background threads."""
+        threading.Thread(target=self._feeder, daemon=True, name="webhook-feeder").start()
+        t = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        t.start()
+        logger.info("Webhook server listening on %s:%s%s", *self.address, self.path)
+        return t
+
+    def serve_forever(self):
+        self.start().join()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def post_updates(lines, url: str, secret_token: str = None) -> int:
+    """POST recorded updates (JSON strings) to a webhook; returns how many got 200."""
+    ok = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        req = urllib.request.Request(url, data=line.encode("utf-8"), method="POST",
+                                     headers={"Content-Type": "application/json"})
+        if secret_token:
+            req.add_header(SECRET_HEADER, secret_token)
+        try:
+            with urllib.request.urlopen(req) as resp:
+                ok += resp.status == 200
+        except Exception as e:
+            logger.warning("POST failed: %s", e)
+    return ok
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or sys.argv[1] != "post":
+        print("Usage: python3 webhook.py post <updates.jsonl> <url> [secret]")
+        sys.exit(2)
+    with open(sys.argv[2], encoding="utf-8") as f:
+        n = post_updates(f, sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else None)
+    print(json.dumps({"accepted": n}))
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded sliding-window store of recent messages per (chat_id, user_id).
+
+Each key owns a fixed-size ring buffer of (timestamp, message_id) backed by
+two arrays. Keys are kept in LRU order; keys idle for longer than
+`idle_seconds` are evicted, and the least recently active keys are dropped
+once `max_entries` (or the entry budget derived from `max_bytes`) is reached.
+"""
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+
+class Ring:
+    __slots__ = ("ts", "ids", "head", "size", "last_seen")
+
+    def __init__(self, capacity: int):
+        self.ts = array("d", bytes(8 * capacity))
+        self.ids = array("q", bytes(8 * capacity))
+        self.head = 0   # index of the oldest element
+        self.size = 0
+        self.last_seen = 0.0
+
+    def append(self, ts: float, message_id: int):
+        cap = len(self.ts)
+        if self.size < cap:
+            i = (self.head + self.size) % cap
+            self.size += 1
+        else:
+            i = self.head
+            self.head = (self.head + 1) % cap
+        self.ts[i] = ts
+        self.ids[i] = message_id
+
+    def count_since(self, cutoff: float) -> int:
+        """Number of entries with timestamp >= cutoff (newest first scan)."""
+        cap = len(self.ts)
+        n = 0
+        for k in range(self.size - 1, -1, -1):
+            if self.ts[(self.head + k) % cap] < cutoff:
+                break
+            n += 1
+        return n
+
+    def items(self, since: float = None):
+        """Entries as (timestamp, message_id), oldest first."""
+        cap = len(self.ts)
+        out = [(self.ts[(self.head + k) % cap], self.ids[(self.head + k) % cap]) for k in range(self.size)]
+        if since is not None:
+            out = [e for e in out if e[0] >= since]
+        return out
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+
+    @classmethod
+    def nbytes(cls, capacity: int) -> int:
+        probe = cls(capacity)
+        return (sys.getsizeof(probe) + sys.getsizeof(probe.ts) + sys.getsizeof(probe.ids)
+                + sys.getsizeof((0, 0)) + 100)  # key tuple + OrderedDict node
+
+
+class WindowStore:
+    def __init__(self, capacity: int = 32, max_entries: int = 200000,
+                 idle_seconds: float = 3600, max_bytes: int = None):
+        self.capacity = capacity
+        self.idle_seconds = idle_seconds
+        self.entry_bytes = Ring.nbytes(capacity)
+        if max_bytes is not None:
+            max_entries = min(max_entries, max(1, max_bytes // self.entry_bytes))
+        self.max_entries = max_entries
+        # (chat_id, user_id) -> Ring, least recently active first
+        self._rings = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def add(self, chat_id: int, user_id: int, ts: float, message_id: int, window: float) -> int:
+        """Store a message; returns how many messages fall into the last `window` seconds."""
+        k = (chat_id, user_id)
+        with self._lock:
+            ring = self._rings.get(k)
+            if ring is None:
+                self._evict(ts)
+                ring = self._rings[k] = Ring(self.capacity)
+            else:
+                self._rings.move_to_end(k)
+            ring.last_seen = ts
+            ring.append(ts, message_id)
+            return ring.count_since(ts - window)
+
+    def items(self, chat_id: int, user_id: int, since: float = None):
+        with self._lock:
+            ring = self._rings.get((chat_id, user_id))
+            return ring.items(since) if ring is not None else []
+
+    def message_ids(self, chat_id: int, user_id: int, last: int = None, since: float = None):
+        ids = [mid for _, mid in self.items(chat_id, user_id, since)]
+        return ids[-last:] if last else ids
+
+    def take_ids(self, chat_id: int, user_id: int):
+        """Return all stored message ids of the key and clear its ring."""
+        with self._lock:
+            ring = self._rings.get((chat_id, user_id))
+            if ring is None:
+                return []
+            ids = [mid for _, mid in ring.items()]
+            ring.clear()
+            return ids
+
+    def clear(self, chat_id: int, user_id: int):
+        with self._lock:
+            ring = self._rings.get((chat_id, user_id))
+            if ring is not None:
+                ring.clear()
+
+    def discard(self, chat_id: int, user_id: int):
+        with self._lock:
+            self._rings.pop((chat_id, user_id), None)
+
+    def evict_idle(self, now: float = None) -> int:
+        with self._lock:
+            return self._evict(time.time() if now is None else now)
+
+    def _evict(self, now: float) -> int:
+        # LRU order: the first ring is the one idle the longest
+        n = 0
+        cutoff = now - self.idle_seconds
+        rings = self._rings
+        while rings:
+            k, ring = next(iter(rings.items()))
+            if ring.last_seen >= cutoff and len(rings) < self.max_entries:
+                break
+            del rings[k]
+            n += 1
+        self.evicted += n
+        return n
+
+    def stats(self) -> dict:
+        with self._lock:
+            n = len(self._rings)
+        return {"entries": n, "bytes": n * self.entry_bytes, "max_entries": self.max_entries,
+                "evicted": self.evicted}